@@ -6,44 +6,19 @@ __version__ = "6/6/19"
 from typing import Dict, List
 import sys
 import argparse
+import run_loader
+from map import Evaluator
 
 
 def p_at_1(run_file: str, qrel_file: str):
-    run_file_dict = get_rankings(run_file)
-    qrel_file_dict = get_rankings(qrel_file)
-    prec_dict: Dict[str, int] = {}
-    s: int = 0
-
-    for queryID in run_file_dict:
-        ret_para_list = run_file_dict[queryID]
-
-        if queryID in qrel_file_dict:
-            rel_para_list = qrel_file_dict[queryID]
-            if ret_para_list[0] in rel_para_list:
-                prec_dict[queryID] = 1
-            else:
-                prec_dict[queryID] = 0
-
-    for i in prec_dict.values():
-        s += i
-
-    avg_p_at_1 = s / len(qrel_file_dict)
-    return avg_p_at_1, prec_dict
+    # Averaged over every query of the qrels, as this script always did (trec_eval -c)
+    aggregate, per_query = Evaluator.from_file(qrel_file).evaluate_file(run_file, ["P@1"], complete=True)
+    prec_dict: Dict[str, int] = {queryID: int(p) for queryID, p in per_query["P@1"].items()}
+    return aggregate["P@1"], prec_dict
 
 
 def get_rankings(file_path: str) -> Dict[str, List[str]]:
-    rankings: Dict[str, List[str]] = {}
-    with open(file_path, 'r') as file:
-        for line in file:
-            line_parts = line.split(" ")
-            queryID = line_parts[0]
-            field2 = line_parts[2]
-            _list: List[str] = []
-            if queryID in rankings.keys():
-                _list = rankings[queryID]
-            _list.append(field2)
-            rankings[queryID] = _list
-    return rankings
+    return run_loader.read_rankings(file_path)
 
 
 def main():
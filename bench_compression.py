@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""This script measures what reading and writing compressed run and feature files costs over uncompressed ones."""
+
+__author__ = "Shubham Chatterjee"
+__version__ = "10/18/26"
+
+from typing import List
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import compressed_io
+import create_feature_file
+import ranklib_io
+import run_cache
+import run_loader
+
+
+def compress_runs(run_dir: str, out_dir: str, fmt: str) -> List[str]:
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for f in sorted(os.listdir(run_dir)):
+        path = os.path.join(out_dir, f + "." + fmt)
+        with open(os.path.join(run_dir, f), 'rb') as src, compressed_io.open_file(path, 'wb') as dest:
+            shutil.copyfileobj(src, dest, compressed_io.BLOCK_SIZE)
+        paths.append(path)
+    return paths
+
+
+def time_read(paths: List[str], background: bool) -> float:
+    compressed_io.BACKGROUND = background
+    start = time.perf_counter()
+    queries, docs = run_loader.IdTable(), run_loader.IdTable()
+    for path in paths:
+        run_loader.read_run(path, queries, docs)
+    return time.perf_counter() - start
+
+
+def time_write(matrix, labels, path: str, background: bool) -> float:
+    compressed_io.BACKGROUND = background
+    start = time.perf_counter()
+    ranklib_io.write_feature_file(path, matrix, labels)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser("Benchmark reading and writing compressed run and feature files.")
+    parser.add_argument("--rundir", help="Path to the directory containing the (uncompressed) run files.",
+                        required=True)
+    parser.add_argument("--qrel", help="Path to the ground truth (qrel) file, for the feature file labels.",
+                        required=True)
+    parser.add_argument("--formats", help="Formats to measure ({}). Defaults to all that can be written here.".format(
+        ", ".join(compressed_io.FORMATS)), nargs="+")
+    parser.add_argument("--work", help="Directory for the compressed copies. Defaults to the system temp directory.")
+    args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
+
+    formats = args.formats or [f for f in compressed_io.FORMATS if f != "zst" or compressed_io.zstandard is not None]
+    # Parse every time rather than load the parsed columns from the cache
+    run_cache.configure(mode="off")
+    plain_paths = [os.path.join(args.rundir, f) for f in sorted(os.listdir(args.rundir))]
+    plain_bytes = sum(os.path.getsize(p) for p in plain_paths)
+    num_lines = 0
+    for path in plain_paths:
+        with open(path, 'rb') as f:
+            num_lines += sum(1 for _ in f)
+
+    runs = run_loader.read_runs(args.rundir)
+    matrix = create_feature_file.create_feature_matrix(runs)
+    labels = create_feature_file.make_labels(matrix, run_loader.read_qrels(args.qrel, matrix.queries, matrix.docs))
+
+    work_dir = tempfile.mkdtemp(prefix="bench-compression-", dir=args.work)
+    try:
+        plain_read = time_read(plain_paths, True)
+        plain_feature = os.path.join(work_dir, "features.txt")
+        plain_write = time_write(matrix, labels, plain_feature, True)
+        feature_bytes = os.path.getsize(plain_feature)
+        print("{} files, {} lines, {:.1f} MB of runs; feature file of {} rows, {:.1f} MB".format(
+            len(plain_paths), num_lines, plain_bytes / 2 ** 20, len(matrix), feature_bytes / 2 ** 20))
+        print("{:<8}{:>8}{:>12}{:>14}{:>12}{:>8}{:>12}{:>12}{:>8}".format(
+            "format", "ratio", "read s", "lines/sec", "no thread", "cost", "write s", "no thread", "cost"))
+        print("{:<8}{:>8.2f}{:>12.3f}{:>14,.0f}{:>12}{:>8}{:>12.3f}{:>12}{:>8}".format(
+            "none", 1.0, plain_read, num_lines / plain_read, "", "", plain_write, "", ""))
+        for fmt in formats:
+            paths = compress_runs(args.rundir, os.path.join(work_dir, fmt), fmt)
+            ratio = plain_bytes / sum(os.path.getsize(p) for p in paths)
+            read_bg = time_read(paths, True)
+            read_fg = time_read(paths, False)
+            feature = os.path.join(work_dir, "features.txt." + fmt)
+            write_bg = time_write(matrix, labels, feature, True)
+            write_fg = time_write(matrix, labels, feature, False)
+            print("{:<8}{:>8.2f}{:>12.3f}{:>14,.0f}{:>12.3f}{:>+8.0%}{:>12.3f}{:>12.3f}{:>+8.0%}".format(
+                fmt, ratio, read_bg, num_lines / read_bg, read_fg, read_bg / plain_read - 1, write_bg, write_fg,
+                write_bg / plain_write - 1))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        compressed_io.BACKGROUND = True
+
+
+if __name__ == '__main__':
+    main()
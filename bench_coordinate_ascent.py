@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""This script compares the NumPy Coordinate Ascent with the RankLib JAR on the folds of a cross-validation directory."""
+
+__author__ = "Shubham Chatterjee"
+__version__ = "10/18/26"
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import combine
+import coordinate_ascent
+import rank_lib_runner
+import ranklib_io
+
+
+def test_score(model_file: str, test_file: str, metric: str) -> float:
+    """The metric of a model on held-out feature data."""
+    weights = combine.get_weights(model_file)
+    data = ranklib_io.read_feature_file(test_file, num_features=max(int(f) for f in weights))
+    w = combine.weight_vector(weights, data.num_features)
+    return coordinate_ascent.Scorer(metric, data.labels, data.offsets).score(data.values @ w)
+
+
+def main():
+    parser = argparse.ArgumentParser("Benchmark the NumPy Coordinate Ascent against the RankLib JAR.")
+    parser.add_argument("--cvdir", help="Path to a directory made by cross_validation.py (needs train/ and test/).",
+                        required=True)
+    parser.add_argument("--k", help="Number of folds.", required=True)
+    parser.add_argument("--jar", help="Path to the RankLib JAR file. Without it only the NumPy ranker is run.")
+    parser.add_argument("--metric", help="Metric to optimize for (MAP|NDCG@k|P@k). Defaults to MAP.", default="MAP")
+    args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
+
+    out_dir = os.path.join(args.cvdir, "bench")
+    if not os.path.isdir(out_dir):
+        os.mkdir(out_dir)
+
+    print("{:<8}{:<10}{:>12}{:>12}".format("fold", "trainer", "seconds", "test " + args.metric))
+    totals = {}
+    for i in range(int(args.k)):
+        train_file = os.path.join(args.cvdir, "train", "leave-" + str(i) + ".txt")
+        test_file = os.path.join(args.cvdir, "test", "feature-file-" + str(i) + ".txt")
+        trainers = [("numpy", lambda model: coordinate_ascent.train_file(train_file, model, args.metric))]
+        if args.jar:
+            job = rank_lib_runner.TrainJob("fold-" + str(i), train_file, "",
+                                           os.path.join(out_dir, "ranklib-" + str(i) + ".log"))
+
+            def ranklib(model, job=job):
+                job.model_file = model
+                rank_lib_runner.train_all(args.jar, [job], args.metric)
+            trainers.append(("ranklib", ranklib))
+
+        for name, train in trainers:
+            model_file = os.path.join(out_dir, name + "-model-" + str(i) + ".txt")
+            start = time.perf_counter()
+            train(model_file)
+            elapsed = time.perf_counter() - start
+            score = test_score(model_file, test_file, args.metric)
+            seconds, scores = totals.get(name, (0.0, []))
+            totals[name] = (seconds + elapsed, scores + [score])
+            print("{:<8}{:<10}{:>12.2f}{:>12.4f}".format(i, name, elapsed, score))
+
+    for name, (seconds, scores) in totals.items():
+        print("{:<8}{:<10}{:>12.2f}{:>12.4f}".format("all", name, seconds, float(np.mean(scores))))
+
+
+if __name__ == '__main__':
+    main()
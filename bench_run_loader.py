@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""This script compares parse throughput and memory of the columnar run loader against the old dict-of-lists parser."""
+
+__author__ = "Shubham Chatterjee"
+__version__ = "10/18/26"
+
+from typing import Dict, List
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+import run_loader
+
+
+def dict_of_lists(file_path: str) -> Dict[str, List[str]]:
+    """The parser that map.py, P@1.py and create_feature_file.py used to copy around."""
+    rankings: Dict[str, List[str]] = {}
+    with open(file_path, 'r') as file:
+        for line in file:
+            line_parts = line.split()
+            query = line_parts[0]
+            para = line_parts[2]
+            if query in rankings:
+                rankings[query].append(para)
+            else:
+                rankings[query] = [para]
+    return rankings
+
+
+def dict_of_scores(file_path: str) -> Dict[str, Dict[str, float]]:
+    rankings: Dict[str, Dict[str, float]] = {}
+    with open(file_path, 'r') as file:
+        for line in file:
+            line_parts = line.split()
+            query = line_parts[0]
+            if query in rankings:
+                rankings[query][line_parts[2]] = float(line_parts[4])
+            else:
+                rankings[query] = {line_parts[2]: float(line_parts[4])}
+    return rankings
+
+
+def measure(parse, file_paths: List[str]):
+    """
+    Parse all files twice: once timed, once under tracemalloc (which slows parsing down) for memory.
+    :return: (seconds, bytes retained by the parsed data, peak bytes allocated while parsing)
+    """
+    gc.collect()
+    start = time.perf_counter()
+    result = parse(file_paths)
+    elapsed = time.perf_counter() - start
+    del result
+    gc.collect()
+    tracemalloc.start()
+    result = parse(file_paths)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return elapsed, retained, peak
+
+
+def main():
+    parser = argparse.ArgumentParser("Benchmark the columnar run loader against the dict-of-lists parser.")
+    parser.add_argument("--rundir", help="Path to the directory containing the run files.", required=True)
+    args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
+
+    file_paths = [os.path.join(args.rundir, f) for f in sorted(os.listdir(args.rundir))]
+    num_lines = 0
+    for file_path in file_paths:
+        with open(file_path, 'rb') as f:
+            num_lines += sum(1 for _ in f)
+
+    def columnar(paths):
+        queries, docs = run_loader.IdTable(), run_loader.IdTable()
+        return [run_loader.read_run(p, queries, docs) for p in paths]
+
+    parsers = [
+        ("dict-of-lists", lambda paths: [dict_of_lists(p) for p in paths]),
+        ("dict-of-scores", lambda paths: [dict_of_scores(p) for p in paths]),
+        ("columnar", columnar),
+    ]
+    print("{} files, {} lines".format(len(file_paths), num_lines))
+    print("{:<16}{:>12}{:>16}{:>14}{:>14}".format("parser", "seconds", "lines/sec", "retained MB", "peak MB"))
+    for name, parse in parsers:
+        elapsed, retained, peak = measure(parse, file_paths)
+        print("{:<16}{:>12.3f}{:>16,.0f}{:>14.1f}{:>14.1f}".format(
+            name, elapsed, num_lines / elapsed, retained / 2 ** 20, peak / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main()
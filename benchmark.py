@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+"""This script times every stage of the pipeline on synthetic data and compares the results against a baseline."""
+
+__author__ = "Shubham Chatterjee"
+__version__ = "10/18/26"
+
+from typing import Dict, List, Optional
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import instrumentation
+import synthetic_data
+
+# Stages in pipeline order.
+STAGES = ["create_feature_file", "combine", "map", "cross_validation_split", "choose_best_candidates"]
+
+# Relative slow down (or growth in peak RSS) over the baseline that counts as a regression.
+DEFAULT_TOLERANCE: float = 0.2
+
+
+def run_stage(stage: str, data_dir: str, work_dir: str):
+    """Run one stage on the data generated in data_dir, writing its outputs to work_dir."""
+    run_dir = os.path.join(data_dir, "runs")
+    qrel_file = os.path.join(data_dir, "qrels")
+    run_files = [os.path.join(run_dir, f) for f in sorted(os.listdir(run_dir))]
+    if stage == "create_feature_file":
+        import create_feature_file
+        create_feature_file.create_feature_file(run_dir, data_dir, "qrels", work_dir, "features.txt", True)
+    elif stage == "combine":
+        import combine
+        combine.combine(os.path.join(data_dir, "features.txt"), os.path.join(data_dir, "model.txt"),
+                        os.path.join(work_dir, "combined.run"))
+    elif stage == "map":
+        from map import Evaluator
+        evaluator = Evaluator.from_file(qrel_file)
+        for run_file in run_files:
+            evaluator.evaluate_file(run_file, ["map"])
+    elif stage == "cross_validation_split":
+        import cross_validation_split
+        fold_of = cross_validation_split.fold_map(cross_validation_split.get_query_list(run_files), 5)
+        cross_validation_split.split_run_files(run_files, work_dir, 5, fold_of)
+    elif stage == "choose_best_candidates":
+        import choose_best_candidates
+        choose_best_candidates.find_best_runs(run_dir, work_dir, qrel_file, "map", max(len(run_files) // 2, 1))
+    else:
+        raise ValueError("Unknown stage '{}'. Choose from: {}".format(stage, ", ".join(STAGES)))
+
+
+def input_lines(stage: str, data_dir: str) -> int:
+    """Number of input lines a stage reads: the feature file for combine, the run files for the others."""
+    if stage == "combine":
+        paths = [os.path.join(data_dir, "features.txt")]
+    else:
+        run_dir = os.path.join(data_dir, "runs")
+        paths = [os.path.join(run_dir, f) for f in os.listdir(run_dir)]
+    num_lines = 0
+    for path in paths:
+        with open(path, 'rb') as f:
+            num_lines += sum(1 for _ in f)
+    return num_lines
+
+
+def measure(stage: str, data_dir: str, work_dir: str) -> Dict[str, float]:
+    """
+    Run a stage in a fresh interpreter, so that its peak RSS is its own and no imports or caches are shared
+    between stages.
+    :return: {"seconds": wall time of the stage, "peak_rss_mb": peak RSS of the child process}
+    """
+    env = dict(os.environ)
+    # The run cache would turn the stages into cache loads
+    env["RUN_CACHE_MODE"] = "off"
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", stage, "--data", data_dir,
+                          "--work", work_dir], env=env, stdout=subprocess.PIPE, check=True,
+                         universal_newlines=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def _child(stage: str, data_dir: str, work_dir: str):
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        run_stage(stage, data_dir, work_dir)
+        elapsed = time.perf_counter() - start
+    print(json.dumps({"seconds": elapsed, "peak_rss_mb": instrumentation.peak_rss_mb()}))
+
+
+def benchmark(data_dir: str, stages: List[str], repeat: int = 3, work_root: Optional[str] = None) -> Dict[str, dict]:
+    """
+    Time every stage repeat times, each time with an empty output directory.
+    The fastest time and the largest peak RSS of the repeats are kept.
+    """
+    results = {}
+    for stage in stages:
+        num_lines = input_lines(stage, data_dir)
+        seconds, rss = [], []
+        for _ in range(repeat):
+            work_dir = tempfile.mkdtemp(prefix="bench-" + stage + "-", dir=work_root)
+            try:
+                result = measure(stage, data_dir, work_dir)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+            seconds.append(result["seconds"])
+            rss.append(result["peak_rss_mb"])
+        best = min(seconds)
+        results[stage] = {"seconds": best, "lines": num_lines, "lines_per_sec": num_lines / best if best else 0.0,
+                          "peak_rss_mb": max(rss)}
+    return results
+
+
+def environment() -> dict:
+    import numpy
+    return {"python": platform.python_version(), "numpy": numpy.__version__, "machine": platform.machine(),
+            "system": platform.system(), "cpus": os.cpu_count()}
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float = DEFAULT_TOLERANCE) -> List[dict]:
+    """
+    Stages that are slower, or use more memory, than in the baseline by more than tolerance (0.2 = 20%).
+    Throughput is compared as lines/sec, so a baseline taken at a different scale still compares sensibly.
+    """
+    regressions = []
+    for stage, result in results.items():
+        base = baseline.get(stage)
+        if base is None:
+            continue
+        if result["lines_per_sec"] < base["lines_per_sec"] / (1 + tolerance):
+            regressions.append({"stage": stage, "what": "lines/sec", "baseline": base["lines_per_sec"],
+                                "now": result["lines_per_sec"]})
+        if result["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance):
+            regressions.append({"stage": stage, "what": "peak RSS MB", "baseline": base["peak_rss_mb"],
+                                "now": result["peak_rss_mb"]})
+    return regressions
+
+
+def print_results(results: Dict[str, dict], baseline: Optional[Dict[str, dict]] = None):
+    print("{:<24}{:>10}{:>12}{:>14}{:>12}{:>10}".format("stage", "seconds", "lines", "lines/sec", "peak MB",
+                                                        "vs base"))
+    for stage, result in results.items():
+        change = ""
+        if baseline and stage in baseline and baseline[stage]["lines_per_sec"]:
+            change = "{:+.0%}".format(result["lines_per_sec"] / baseline[stage]["lines_per_sec"] - 1)
+        print("{:<24}{:>10.3f}{:>12}{:>14,.0f}{:>12.1f}{:>10}".format(
+            stage, result["seconds"], result["lines"], result["lines_per_sec"], result["peak_rss_mb"], change))
+
+
+def main():
+    parser = argparse.ArgumentParser("Benchmark the pipeline stages on seeded synthetic data.")
+    parser.add_argument("--data", help="Path to the synthetic data directory. It is generated if it has no runs.",
+                        required=True)
+    parser.add_argument("--stages", help="Stages to run ({}). Defaults to all.".format(", ".join(STAGES)),
+                        nargs="+", default=STAGES)
+    parser.add_argument("--repeat", help="Number of times to run every stage. Defaults to 3.", default=3)
+    parser.add_argument("--work", help="Directory for the stages' outputs. Defaults to the system temp directory.")
+    parser.add_argument("--save", help="Path to a JSON file to save the results to, as a baseline.")
+    parser.add_argument("--compare", help="Path to a baseline JSON file to compare the results against.")
+    parser.add_argument("--tolerance", help="Relative change that counts as a regression. Defaults to {}.".format(
+        DEFAULT_TOLERANCE), default=DEFAULT_TOLERANCE)
+    parser.add_argument("--queries", help="Synthetic data: number of queries. Defaults to 100.", default=100)
+    parser.add_argument("--depth", help="Synthetic data: paragraphs per query per run. Defaults to 100.",
+                        default=100)
+    parser.add_argument("--runs", help="Synthetic data: number of runs. Defaults to 10.", default=10)
+    parser.add_argument("--id-length", help="Synthetic data: length of the paragraph IDs. Defaults to 40.",
+                        default=40)
+    parser.add_argument("--seed", help="Synthetic data: random seed. Defaults to 0.", default=0)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
+
+    if args.child:
+        _child(args.child, args.data, args.work)
+        return
+
+    for stage in args.stages:
+        if stage not in STAGES:
+            parser.error("Unknown stage '{}'. Choose from: {}".format(stage, ", ".join(STAGES)))
+
+    scale = synthetic_data.Scale(int(args.queries), int(args.depth), int(args.runs), int(args.id_length),
+                                 seed=int(args.seed))
+    scale_file = os.path.join(args.data, "scale.json")
+    if not os.path.isdir(os.path.join(args.data, "runs")):
+        print("Generating synthetic data...", end=' ')
+        synthetic_data.generate(args.data, scale)
+        with open(scale_file, 'w') as f:
+            json.dump(scale.to_dict(), f, indent=1, sort_keys=True)
+        print("[Done].")
+    if os.path.exists(scale_file):
+        with open(scale_file, 'r') as f:
+            scale_dict = json.load(f)
+    else:
+        scale_dict = {}
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        if baseline.get("scale") != scale_dict:
+            print("Warning: the baseline was taken at a different scale: {}".format(baseline.get("scale")))
+
+    results = benchmark(args.data, args.stages, int(args.repeat), args.work)
+    print_results(results, baseline["stages"] if baseline else None)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({"scale": scale_dict, "environment": environment(), "stages": results}, f, indent=1,
+                      sort_keys=True)
+        print("Baseline is written to: " + args.save)
+
+    if baseline:
+        regressions = compare(results, baseline["stages"], float(args.tolerance))
+        for r in regressions:
+            print("REGRESSION {}: {} {:,.1f} -> {:,.1f}".format(r["stage"], r["what"], r["baseline"], r["now"]))
+        if regressions:
+            sys.exit(1)
+        print("No regressions against " + args.compare)
+
+
+if __name__ == '__main__':
+    main()
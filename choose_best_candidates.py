@@ -5,42 +5,104 @@ import shutil
 __author__ = "Shubham Chatterjee"
 __version__ = "8/16/19"
 
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
+from multiprocessing import Pool
 import sys
 import os
 import argparse
-from map import mean_avg_prec, get_rankings
-import operator
-
-
-def find_best_runs(run_dir: str, bestdir: str, qrel_file: str):
-    run_file_list = os.listdir(run_dir)
-    map_dict: Dict[str, float] = {}
-    qrel_file_dict = get_rankings(qrel_file)
-
-    print("Finding top 10 runs...")
-
-    # Find MAP for each file
-    for file_name in run_file_list:
-        full_file_name = os.path.join(run_dir, file_name)
-        run_file_dict = get_rankings(full_file_name)
-        _map, p_dict = mean_avg_prec(run_file_dict, qrel_file_dict)
-        map_dict[file_name] = _map
+import heapq
+from map import Evaluator, MEASURES, parse_measure
+import run_cache
+
+# Evaluator (indexed qrels) of the process; set once in the parent and in every worker by _init_worker.
+_evaluator: Optional[Evaluator] = None
+
+
+def _init_worker(evaluator: Evaluator):
+    global _evaluator
+    _evaluator = evaluator
+
+
+def evaluate_run(job: Tuple[str, str]) -> Tuple[str, float]:
+    full_file_name, metric = job
+    aggregate, _ = _evaluator.evaluate_file(full_file_name, [metric])
+    return os.path.basename(full_file_name), aggregate[metric]
+
+
+def read_scores(scores_file: str) -> Dict[str, float]:
+    """Scores of an earlier (possibly interrupted) evaluation, so that those runs are not evaluated again."""
+    scores: Dict[str, float] = {}
+    if os.path.exists(scores_file):
+        with open(scores_file, 'r') as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) == 2 and parts[0] != "run":
+                    scores[parts[0]] = float(parts[1])
+    return scores
+
+
+def write_ranked_scores(scores: Dict[str, float], ranked_file: str, metric: str):
+    with open(ranked_file, 'w') as f:
+        f.write("rank\trun\t" + metric + "\n")
+        for rank, (name, value) in enumerate(sorted(scores.items(), key=lambda kv: (-kv[1], kv[0])), start=1):
+            f.write(str(rank) + "\t" + name + "\t" + str(value) + "\n")
+
+
+def find_best_runs(run_dir: str, bestdir: str, qrel_file: str, metric: str = "map", top: int = 10, workers: int = 1,
+                   scores_file: Optional[str] = None):
+    if scores_file is None:
+        scores_file = os.path.join(bestdir, "scores-" + metric + ".tsv")
+    ranked_file = os.path.splitext(scores_file)[0] + "-ranked.tsv"
+
+    scores = read_scores(scores_file)
+    run_file_list = [f for f in sorted(os.listdir(run_dir)) if f not in scores]
+    parse_measure(metric)
+    evaluator = Evaluator.from_file(qrel_file)
+    _init_worker(evaluator)
+
+    # Top runs so far, as a min-heap of (score, name)
+    best: List[Tuple[float, str]] = []
+
+    def push(name: str, value: float):
+        item = (value, name)
+        if len(best) < top:
+            heapq.heappush(best, item)
+        elif item > best[0]:
+            heapq.heapreplace(best, item)
+
+    for name, value in scores.items():
+        push(name, value)
+
+    print("Evaluating {} runs ({} already scored in {})...".format(len(run_file_list), len(scores), scores_file))
+    jobs = [(os.path.join(run_dir, file_name), metric) for file_name in run_file_list]
+    with open(scores_file, 'a') as out:
+        if not scores:
+            out.write("run\t" + metric + "\n")
+        if workers > 1 and len(jobs) > 1:
+            with Pool(min(workers, len(jobs)), initializer=_init_worker, initargs=(evaluator,)) as pool:
+                results = pool.imap_unordered(evaluate_run, jobs, chunksize=4)
+                _collect(results, scores, out, push)
+        else:
+            _collect(map(evaluate_run, jobs), scores, out, push)
     print("[Done].")
 
-    i: int = 0
+    write_ranked_scores(scores, ranked_file, metric)
+    print("All scores are written to: " + ranked_file)
 
-    print("Copying best runs to dir...")
+    print("Copying best {} runs to dir...".format(top))
+    for value, name in sorted(best, key=lambda item: (-item[0], item[1])):
+        print(name + " " + str(value))
+        copy(os.path.join(run_dir, name), bestdir)
+    print("[Done].")
 
-    for key, value in sorted(map_dict.items(), key=operator.itemgetter(1), reverse=True):
-        i = i + 1
-        print(key + " " + str(value))
-        full_file_name = os.path.join(run_dir, key)
-        copy(full_file_name, bestdir)
-        if i == 10:
-            break
 
-    print("[Done].")
+def _collect(results, scores: Dict[str, float], out, push):
+    # Record every score as soon as it is known, so that an interrupted sweep resumes where it stopped
+    for name, value in results:
+        scores[name] = value
+        out.write(name + "\t" + str(value) + "\n")
+        out.flush()
+        push(name, value)
 
 
 def copy(file, dir):
@@ -52,11 +114,17 @@ def main():
     parser.add_argument("--rundir", help="Path to the directory containing runs.", required=True)
     parser.add_argument("--bestdir", help="Path to the directory to put the best runs.", required=True)
     parser.add_argument("--qrel", help="Path to the ground truth (qrel) file.", required=True)
+    parser.add_argument("--metric", help="Metric to rank the runs by ({}). Defaults to map.".format(", ".join(MEASURES)),
+                        default="map")
+    parser.add_argument("--top", help="Number of best runs to copy. Defaults to 10.", default=10)
+    parser.add_argument("--workers", help="Number of runs to evaluate in parallel. Defaults to 1.", default=1)
+    parser.add_argument("--scores", help="Path to the TSV file of scores. Runs already in it are not evaluated again. "
+                                         "Defaults to <bestdir>/scores-<metric>.tsv.")
+    run_cache.add_arguments(parser)
     args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
-    find_best_runs(args.rundir, args.bestdir, args.qrel)
+    run_cache.configure_from_args(args)
+    find_best_runs(args.rundir, args.bestdir, args.qrel, args.metric, int(args.top), int(args.workers), args.scores)
 
 
 if __name__ == '__main__':
     main()
-
-
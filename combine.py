@@ -4,16 +4,29 @@
 __author__ = "Shubham Chatterjee"
 __version__ = "6/6/19"
 
-from typing import Dict, List
-from collections import OrderedDict
+from typing import Dict, Iterable, Iterator, List, Set
 import sys
 import argparse
+import heapq
+import itertools
 import os
+import tempfile
+import numpy as np
+import compressed_io
+import instrumentation
+import ranklib_io
+import run_loader
+
+# Number of run lines formatted and written at a time, and of feature lines scored at a time when streaming.
+CHUNK_LINES: int = 1 << 16
+
+# Number of feature lines sorted in memory at a time when a feature file has to be sorted by query.
+CHUNK_SIZE: int = 1 << 20
 
 
 def get_weights(model_file: str) -> Dict[str, float]:
     weights: Dict[str, float] = {}
-    with open(model_file, 'r') as f:
+    with compressed_io.open_file(model_file, 'r') as f:
         for line in f:
             if not line.startswith('#'):
                 data = line.split(" ")
@@ -24,93 +37,258 @@ def get_weights(model_file: str) -> Dict[str, float]:
     return weights
 
 
-def get_scores(feature_file: str, weights: Dict[str, float]) -> Dict[str, Dict[str, float]]:
-    score_map: OrderedDict[str, OrderedDict[str, float]] = OrderedDict()
-    _map: OrderedDict[str, float]
+def weight_vector(weights: Dict[str, float], num_features: int) -> np.ndarray:
+    """Weights as a vector; w[f - 1] is the weight of feature f, 0 for features the model does not know."""
+    w = np.zeros(num_features, dtype=np.float64)
+    for fid, weight in weights.items():
+        w[int(fid) - 1] = weight
+    return w
 
-    with open(feature_file, 'r') as f:
-        for line in f:
-            sum_score: float = 0.0
-            line_parts = line.split(" ")
-            query_id: str = line_parts[len(line_parts) - 1].split("_")[0][1:]
-            para_id: str = line_parts[len(line_parts) - 1].split("_")[1]
-
-
-            """
-            # For every (feature, value pair do
-            # Note: line_parts[0] --> target, line_parts[1] --> qid, line_parts[2]..line_parts[len(line_parts) - 1] --> (feature : score) pairs
-            # This is according to the RankLib feature file format
-            """
-            n: int = len(line_parts) - 1
-            for i in range(2, n):
-                feature: str = line_parts[i].split(":")[0]
-                weight: float = weights[feature]
-                score: float = float(line_parts[i].split(":")[1])
-                new_score: float = weight * score
-                sum_score += new_score
-
-            """
-            # If the score_map already contains the query, then get the map of (para_id, score) for the query
-            # Otherwise make a new dictionary of (para_id, score) for the query
-            """
-            if query_id in score_map.keys():
-                _map = score_map[query_id]
-            else:
-                _map = OrderedDict()
-
-            """Put the (para_id, score) values in the map"""
-            _map[para_id] = sum_score
-            score_map[query_id] = _map
-    return score_map
-
-
-def sort_by_value_descending(dictionary) -> Dict[str, float]:
-    return OrderedDict(sorted(dictionary.items(), key=lambda kv: (kv[1], kv[0]), reverse=True))
-
-
-def make_run_strings(score_map: Dict[str, Dict[str, float]]) -> List[str]:
-    run_strings: List[str] = []
-    for query_id in score_map.keys():
-        rank = 0
-        _map = sort_by_value_descending(score_map[query_id])
-        for para_id in _map.keys():
-            score = _map[para_id]
-            if score != 0:
-                run_file_string = query_id + " Q0 " + para_id.rstrip() + " " + str(rank) + " " + str(score) + " " + "combined"
-                run_strings.append(run_file_string)
-                rank += 1
-
-    return run_strings
-
-
-def combine(feature_file: str, model_file: str, combined_file: str):
-    print("Reading model file. Getting feature weights....", end=' ')
-    weights: Dict[str, float] = get_weights(model_file)
-    print("[Done]")
-    print("The weight vector is {}".format(weights))
-    print("Reading feature file. Getting scores for each feature....", end=' ')
-    score_map: Dict[str, Dict[str, float]] = get_scores(feature_file, weights)
-    print("[Done]")
-    run_strings: List[str] = make_run_strings(score_map)
-    print("Writing to file....", end=" ")
-    write_file(run_strings, combined_file)
-    print("[Done]")
-    print("Combined run file written to: " + combined_file)
-
-
-def write_file(run_strings: List[str], combined_file: str):
-    with open(combined_file, 'w') as file:
-        for run_file_string in run_strings:
-            file.write(run_file_string + os.linesep)
+
+def get_scores(values: np.ndarray, w: np.ndarray) -> np.ndarray:
+    """
+    The model score of every row. This is a matrix-vector product, accumulated one feature column at a time
+    so that each sum is added up in the same order as the per-line loop did, and scores do not change in the
+    last digit.
+    """
+    scores = np.zeros(values.shape[0], dtype=np.float64)
+    for j in np.flatnonzero(w):
+        scores += values[:, j] * w[j]
+    return scores
+
+
+def rank_scores(comments: List[str], scores: np.ndarray):
+    """
+    Rank the paragraphs of every query by descending score (ties by descending paragraph ID), leaving out
+    paragraphs that scored 0. Queries come in the order of the feature file; a paragraph listed twice for a
+    query keeps its last score.
+    :return: (query IDs, paragraph IDs, query index of every row, paragraph index of every row, ranked row order,
+             offsets of the queries into the ranked row order)
+    """
+    queries, paras = run_loader.IdTable(), run_loader.IdTable()
+    split = [comment.rpartition("_") for comment in comments]
+    query_idx = queries.intern_grouped([q for q, _, _ in split])
+    para_idx = paras.intern_all([p for _, _, p in split])
+
+    keys = query_idx.astype(np.int64) * max(len(paras), 1) + para_idx
+    _, last_rev = np.unique(keys[::-1], return_index=True)
+    rows = np.sort(len(keys) - 1 - last_rev)
+    rows = rows[scores[rows] != 0]
+
+    para_ids = np.array(paras.ids)
+    para_rank = np.empty(len(para_ids), dtype=np.int64)
+    para_rank[np.argsort(para_ids, kind="stable")] = np.arange(len(para_ids))
+    order = rows[np.lexsort((-para_rank[para_idx[rows]], -scores[rows], query_idx[rows]))]
+
+    counts = np.bincount(query_idx[order], minlength=len(queries))
+    offsets = np.append(0, np.cumsum(counts))
+    return queries.ids, paras.ids, query_idx, para_idx, order, offsets
+
+
+def write_run(combined_file: str, query_ids: List[str], para_ids: List[str], query_idx: np.ndarray,
+              para_idx: np.ndarray, scores: np.ndarray, order: np.ndarray, offsets: np.ndarray):
+    with compressed_io.open_file(combined_file, 'w', buffering=ranklib_io.BUFFER_SIZE) as file:
+        _write_lines(file, query_ids, para_ids, query_idx, para_idx, scores, order, offsets)
+
+
+def _write_lines(file, query_ids: List[str], para_ids: List[str], query_idx: np.ndarray, para_idx: np.ndarray,
+                 scores: np.ndarray, order: np.ndarray, offsets: np.ndarray):
+    # Rank of every line within its query, starting at 0
+    ranks = np.arange(len(order)) - np.repeat(offsets[:-1], np.diff(offsets))
+    query_ids = np.asarray(query_ids, dtype=object)
+    para_ids = np.asarray(para_ids, dtype=object)
+    for start in range(0, len(order), CHUNK_LINES):
+        rows = order[start:start + CHUNK_LINES]
+        file.write("".join(["{} Q0 {} {} {} combined\n".format(q, p, r, s) for q, p, r, s in zip(
+            query_ids[query_idx[rows]].tolist(), para_ids[para_idx[rows]].tolist(),
+            ranks[start:start + CHUNK_LINES].tolist(), scores[rows].tolist())]))
+
+
+class NotGroupedError(Exception):
+    """Raised when the lines of a query are not all next to each other in a feature file."""
+
+
+def _query_of(line: str) -> str:
+    return line.partition("#")[2].strip().rpartition("_")[0]
+
+
+def iter_query_groups(lines: Iterable[str], group_lines: int = CHUNK_LINES) -> Iterator[List[str]]:
+    """
+    Cut the lines of a feature file into groups of whole queries of about group_lines lines (a group only ends
+    where a query ends, so it is at most group_lines plus the largest query).
+    :raise NotGroupedError: if a query comes back after other queries
+    """
+    done: Set[str] = set()
+    group: List[str] = []
+    current = None
+    for line in lines:
+        if not line.partition("#")[0].strip():
+            continue
+        query = _query_of(line)
+        if query != current:
+            if query in done:
+                raise NotGroupedError("Query {} is not in one block of lines.".format(query))
+            if current is not None:
+                done.add(current)
+            if len(group) >= group_lines:
+                yield group
+                group = []
+            current = query
+        group.append(line)
+    if group:
+        yield group
+
+
+def sort_by_query(feature_file: str, tmp_dir: str, chunk_lines: int = CHUNK_SIZE) -> Iterator[str]:
+    """
+    External sort of a feature file by query (queries in order of first appearance, lines of a query in file
+    order): sorted chunks of chunk_lines lines are written to tmp_dir and merged.
+    """
+    first_seen: Dict[str, int] = {}
+    chunk_files: List[str] = []
+    with compressed_io.open_file(feature_file, 'r', buffering=ranklib_io.BUFFER_SIZE) as f:
+        line_no = 0
+        while True:
+            lines = list(itertools.islice(f, chunk_lines))
+            if not lines:
+                break
+            keyed = [(first_seen.setdefault(_query_of(line), len(first_seen)), line_no + i, line)
+                     for i, line in enumerate(lines) if line.partition("#")[0].strip()]
+            keyed.sort()
+            chunk_file = os.path.join(tmp_dir, "chunk-" + str(len(chunk_files)) + ".txt")
+            with open(chunk_file, 'w', buffering=ranklib_io.BUFFER_SIZE) as out:
+                out.write("".join(["{}\t{}\t{}".format(q, n, line if line.endswith("\n") else line + "\n")
+                                   for q, n, line in keyed]))
+            chunk_files.append(chunk_file)
+            line_no += len(lines)
+
+    files = [open(chunk_file, 'r', buffering=ranklib_io.BUFFER_SIZE) for chunk_file in chunk_files]
+    try:
+        keyed_lines = [((int(q), int(n), rest) for q, n, rest in (line.split("\t", 2) for line in f)) for f in files]
+        for _, _, line in heapq.merge(*keyed_lines):
+            yield line
+    finally:
+        for f in files:
+            f.close()
+
+
+def combine_streaming(feature_file: str, weights: Dict[str, float], combined_file: str,
+                      group_lines: int = CHUNK_LINES):
+    """
+    Score and rank a feature file one group of whole queries at a time, so memory is bounded by the group size
+    and the largest query rather than the file. If the lines of a query are not next to each other, the file is
+    sorted by query on disk (next to the combined file) and streamed again.
+    :return: the number of lines written
+    """
+    num_features = max([int(fid) for fid in weights] + [0])
+    w = weight_vector(weights, num_features)
+
+    def write_groups(lines: Iterable[str]) -> int:
+        written = 0
+        with compressed_io.open_file(combined_file, 'w', buffering=ranklib_io.BUFFER_SIZE) as file:
+            for group in iter_query_groups(lines, group_lines):
+                data = ranklib_io.parse_feature_lines(group, num_features, source=feature_file)
+                instrumentation.count("lines_parsed", len(group))
+                scores = get_scores(data.values, w)
+                query_ids, para_ids, query_idx, para_idx, order, offsets = rank_scores(data.comments, scores)
+                _write_lines(file, query_ids, para_ids, query_idx, para_idx, scores, order, offsets)
+                written += len(order)
+        return written
+
+    try:
+        with compressed_io.open_file(feature_file, 'r', buffering=ranklib_io.BUFFER_SIZE) as f:
+            return write_groups(f)
+    except NotGroupedError as e:
+        print("{} Sorting the feature file by query....".format(e), end=" ")
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(combined_file))) as tmp_dir:
+        return write_groups(sort_by_query(feature_file, tmp_dir))
+
+
+def combine(feature_file: str, model_file: str, combined_file: str, stream: bool = False, workers: int = 1):
+    """
+    :param stream: score one group of queries at a time (see combine_streaming()). Binary feature files are
+                   memory-mapped, so they are never streamed.
+    :param workers: parse a large text feature file in this many processes (see ranklib_io.read_text_parallel())
+    """
+    with instrumentation.stage("combine"):
+        print("Reading model file. Getting feature weights....", end=' ')
+        weights: Dict[str, float] = get_weights(model_file)
+        print("[Done]")
+        print("The weight vector is {}".format(weights))
+        instrumentation.count("features", len(weights))
+        if stream and not ranklib_io.is_binary_file(feature_file):
+            print("Scoring and writing one group of queries at a time....", end=" ")
+            lines_written = combine_streaming(feature_file, weights, combined_file)
+            print("[Done]")
+            instrumentation.count("lines_written", lines_written)
+            instrumentation.count("bytes_written", instrumentation.file_size(combined_file))
+            print("Combined run file written to: " + combined_file)
+            return
+        print("Reading feature file. Getting scores for each feature....", end=' ')
+        with instrumentation.stage("read_features"):
+            data = ranklib_io.read_feature_file(feature_file, num_features=max([int(fid) for fid in weights] + [0]),
+                                                workers=workers)
+            instrumentation.count("lines_parsed", len(data.comments))
+        with instrumentation.stage("score"):
+            scores = get_scores(data.values, weight_vector(weights, data.num_features))
+        print("[Done]")
+        with instrumentation.stage("rank"):
+            query_ids, para_ids, query_idx, para_idx, order, offsets = rank_scores(data.comments, scores)
+        print("Writing to file....", end=" ")
+        with instrumentation.stage("write_run"):
+            write_run(combined_file, query_ids, para_ids, query_idx, para_idx, scores, order, offsets)
+            instrumentation.count("lines_written", len(order))
+            instrumentation.count("bytes_written", instrumentation.file_size(combined_file))
+        print("[Done]")
+        print("Combined run file written to: " + combined_file)
+
+
+def read_scores(score_file: str) -> np.ndarray:
+    """The scores of a RankLib -score file ("qid<TAB>row<TAB>score" lines), in the order of its lines."""
+    with compressed_io.open_file(score_file, 'r', buffering=ranklib_io.BUFFER_SIZE) as f:
+        return np.array([float(line.rsplit(None, 1)[1]) for line in f if line.strip()], dtype=np.float64)
+
+
+def combine_scores(feature_file: str, score_file: str, combined_file: str):
+    """
+    Create the run file from scores RankLib computed for the lines of the feature file (see
+    rank_lib_runner.score()), for models that are not a weight per feature (e.g. LambdaMART). Ranked and written
+    the same way as combine().
+    """
+    with instrumentation.stage("combine"):
+        with instrumentation.stage("read_features"):
+            data = ranklib_io.read_feature_file(feature_file)
+            scores = read_scores(score_file)
+            instrumentation.count("lines_parsed", len(data.comments))
+        if len(scores) != len(data.comments):
+            raise ValueError("{} has {} scores for the {} lines of {}.".format(score_file, len(scores),
+                                                                            len(data.comments), feature_file))
+        with instrumentation.stage("rank"):
+            query_ids, para_ids, query_idx, para_idx, order, offsets = rank_scores(data.comments, scores)
+        with instrumentation.stage("write_run"):
+            write_run(combined_file, query_ids, para_ids, query_idx, para_idx, scores, order, offsets)
+            instrumentation.count("lines_written", len(order))
+            instrumentation.count("bytes_written", instrumentation.file_size(combined_file))
+        print("Combined run file written to: " + combined_file)
 
 
 def main():
     parser = argparse.ArgumentParser("Create a new run file using the RankLib model.")
-    parser.add_argument("--feature", help="Path to the RankLib feature file", required=True)
+    parser.add_argument("--feature", help="Path to the RankLib feature file, text or binary", required=True)
     parser.add_argument("--model", help="Path to the RankLib model file", required=True)
     parser.add_argument("--combined", help="Path to the combined run file", required=True)
+    parser.add_argument("--stream", help="Score one group of queries at a time instead of the whole file, to bound "
+                                          "memory. Files whose queries are not grouped are sorted on disk first.",
+                        action="store_true")
+    parser.add_argument("--workers", help="Number of processes parsing a large text feature file. Defaults to 1.",
+                        default=1)
+    compressed_io.add_arguments(parser)
+    instrumentation.add_arguments(parser)
     args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
-    combine(args.feature, args.model, args.combined)
+    instrumentation.configure_from_args(args)
+    combine(args.feature, args.model, compressed_io.output_path(args.combined, args.compress), args.stream,
+            int(args.workers))
+    instrumentation.finish()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+"""This script reads and writes gzip, bzip2, xz and zstd compressed files, (de)compressing in a background thread."""
+
+__author__ = "Shubham Chatterjee"
+__version__ = "10/18/26"
+
+from typing import Optional
+import argparse
+import bz2
+import gzip
+import io
+import lzma
+import os
+import queue
+import shutil
+import sys
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compression format of every file name suffix.
+SUFFIXES = {".gz": "gz", ".bz2": "bz2", ".xz": "xz", ".zst": "zst"}
+
+FORMATS = ["gz", "bz2", "xz", "zst"]
+
+# Compression level of each format when writing: zlib's default level for gz (the gzip command's too), bzip2's
+# only block size for bz2, and fast presets for xz and zstd, whose defaults are much slower.
+LEVELS = {"gz": 6, "bz2": 9, "xz": 1, "zst": 3}
+
+# Size of the blocks handed between the (de)compression thread and the reader or writer.
+BLOCK_SIZE: int = 1 << 20
+
+# Number of blocks the (de)compression thread may run ahead of (or behind) the reader (or writer).
+QUEUE_BLOCKS: int = 8
+
+# Whether files are (de)compressed in a background thread unless open_file() is told otherwise.
+BACKGROUND: bool = True
+
+
+def compression_of(file_path: str) -> Optional[str]:
+    """The compression format of a file, from its suffix, or None for an uncompressed file."""
+    return SUFFIXES.get(os.path.splitext(file_path)[1].lower())
+
+
+def strip_suffix(file_path: str) -> str:
+    """The file name without its compression suffix (if any)."""
+    return os.path.splitext(file_path)[0] if compression_of(file_path) else file_path
+
+
+def output_path(file_path: str, compress: Optional[str]) -> str:
+    """The file name with the suffix of the compress format added, unless it already has it."""
+    if not compress:
+        return file_path
+    if compress not in FORMATS:
+        raise ValueError("Unknown compression '{}'. Choose from: {}".format(compress, ", ".join(FORMATS)))
+    return file_path if compression_of(file_path) == compress else file_path + "." + compress
+
+
+def _zstandard():
+    if zstandard is None:
+        raise ImportError("Reading and writing .zst files needs the zstandard package (pip install zstandard).")
+    return zstandard
+
+
+def _open_stream(file_path: str, fmt: str, writing: bool):
+    """The binary (de)compressing stream of a file."""
+    if fmt == "gz":
+        return gzip.open(file_path, 'wb', compresslevel=LEVELS[fmt]) if writing else gzip.open(file_path, 'rb')
+    if fmt == "bz2":
+        return bz2.open(file_path, 'wb', compresslevel=LEVELS[fmt]) if writing else bz2.open(file_path, 'rb')
+    if fmt == "xz":
+        return lzma.open(file_path, 'wb', preset=LEVELS[fmt]) if writing else lzma.open(file_path, 'rb')
+    zstd = _zstandard()
+    if writing:
+        return zstd.ZstdCompressor(level=LEVELS[fmt]).stream_writer(open(file_path, 'wb'), closefd=True)
+    # Concatenated files (e.g. cross_validation.concat) are several frames
+    return zstd.ZstdDecompressor().stream_reader(open(file_path, 'rb'), read_across_frames=True, closefd=True)
+
+
+class ThreadedReader(io.RawIOBase):
+    """
+    A raw binary stream over a decompressing stream that a background thread reads ahead, so that decompression
+    (which zlib, bz2, lzma and zstd do without holding the GIL) overlaps the parsing of the data already read.
+    """
+
+    def __init__(self, stream, block_size: int = BLOCK_SIZE, queue_blocks: int = QUEUE_BLOCKS):
+        super().__init__()
+        self._stream = stream
+        self._block_size = block_size
+        self._queue: queue.Queue = queue.Queue(queue_blocks)
+        self._block = memoryview(b"")
+        self._eof = False
+        self._error: Optional[BaseException] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._fill, daemon=True)
+        self._thread.start()
+
+    def _fill(self):
+        try:
+            while not self._stop.is_set():
+                block = self._stream.read(self._block_size)
+                self._put(block)
+                if not block:
+                    return
+        except BaseException as e:
+            self._error = e
+            self._put(b"")
+
+    def _put(self, block: bytes):
+        # Give up once the reader is closed, rather than waiting for it forever
+        while not self._stop.is_set():
+            try:
+                self._queue.put(block, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        if not len(self._block):
+            if self._eof:
+                return 0
+            self._block = memoryview(self._queue.get())
+            if not len(self._block):
+                self._eof = True
+                if self._error is not None:
+                    raise self._error
+                return 0
+        n = min(len(b), len(self._block))
+        b[:n] = self._block[:n]
+        self._block = self._block[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+            self._stream.close()
+        super().close()
+
+
+class ThreadedWriter(io.RawIOBase):
+    """
+    A raw binary stream that hands what is written to a background thread, which compresses it into the
+    underlying compressing stream, so that compression overlaps the formatting of the next lines.
+    """
+
+    def __init__(self, stream, queue_blocks: int = QUEUE_BLOCKS):
+        super().__init__()
+        self._stream = stream
+        self._queue: queue.Queue = queue.Queue(queue_blocks)
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+        self._thread.start()
+
+    def _drain(self):
+        while True:
+            block = self._queue.get()
+            if block is None:
+                return
+            if self._error is None:
+                try:
+                    self._stream.write(block)
+                except BaseException as e:
+                    self._error = e
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        if self._error is not None:
+            raise self._error
+        block = bytes(b)
+        self._queue.put(block)
+        return len(block)
+
+    def close(self):
+        if not self.closed:
+            try:
+                self._queue.put(None)
+                self._thread.join()
+            finally:
+                # Closing the compressing stream writes the end of the compressed data
+                self._stream.close()
+                super().close()
+            if self._error is not None:
+                raise self._error
+
+
+def open_file(file_path: str, mode: str = 'r', buffering: int = -1, background: Optional[bool] = None):
+    """
+    open() for files that may be compressed: a file whose name ends in .gz, .bz2, .xz or .zst is decompressed as
+    it is read, or compressed as it is written. Modes are 'r', 'w', 'rb' and 'wb'.
+    :param buffering: as for open(); compressed files are buffered BLOCK_SIZE bytes if it is not positive
+    :param background: (de)compress in a background thread. Defaults to BACKGROUND.
+    """
+    fmt = compression_of(file_path)
+    if fmt is None:
+        return open(file_path, mode, buffering=buffering)
+    buffering = buffering if buffering > 0 else BLOCK_SIZE
+    if mode not in ('r', 'w', 'rb', 'wb'):
+        raise ValueError("Compressed files can only be opened with mode r, w, rb or wb, not " + mode)
+    writing = mode.startswith('w')
+    background = BACKGROUND if background is None else background
+    stream = _open_stream(file_path, fmt, writing)
+    if writing:
+        raw = ThreadedWriter(stream) if background else stream
+        binary = io.BufferedWriter(raw, buffer_size=buffering)
+    else:
+        raw = ThreadedReader(stream, buffering) if background else stream
+        binary = io.BufferedReader(raw, buffer_size=buffering)
+    return binary if mode.endswith('b') else io.TextIOWrapper(binary)
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """The output compression option of the scripts that write run or feature files."""
+    parser.add_argument("--compress", help="Compress the output files ({}); the suffix is added to their names. "
+                                           "Inputs are decompressed by their suffix either way.".format(
+                                               ", ".join(FORMATS)), choices=FORMATS)
+
+
+def main():
+    parser = argparse.ArgumentParser("Compress or decompress a file the way the other scripts read and write them.")
+    parser.add_argument("--input", help="Path to the file to read (decompressed by its suffix).", required=True)
+    parser.add_argument("--output", help="Path to the file to write (compressed by its suffix).", required=True)
+    args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
+    with open_file(args.input, 'rb') as src, open_file(args.output, 'wb') as dest:
+        shutil.copyfileobj(src, dest, BLOCK_SIZE)
+    print("Written to: " + args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+"""This script trains a Coordinate Ascent ranker (RankLib ranker 4) in-process with NumPy, without Java."""
+
+__author__ = "Shubham Chatterjee"
+__version__ = "10/18/26"
+
+from typing import Dict, List, Optional, Tuple
+import argparse
+import sys
+import time
+import numpy as np
+import ranklib_io
+
+METRICS = ["MAP", "NDCG@k", "P@k"]
+
+
+def parse_metric(metric: str) -> Tuple[str, Optional[int]]:
+    """Split a RankLib metric such as "NDCG@10" into ("NDCG", 10)."""
+    name, _, k = metric.partition("@")
+    name = name.upper()
+    if name not in ("MAP", "NDCG", "P") or (name != "MAP" and not k):
+        raise ValueError("Unsupported metric '{}'. Supported metrics: {}".format(metric, ", ".join(METRICS)))
+    return name, int(k) if k else None
+
+
+class Scorer:
+    """
+    Scores a ranking metric over every query of a training set at once, the way RankLib does: a query's list
+    is ranked by descending score (ties keep file order), and the metric is averaged over all queries.
+    """
+
+    def __init__(self, metric: str, labels: np.ndarray, offsets: np.ndarray):
+        self.name, self.k = parse_metric(metric)
+        counts = np.diff(offsets)
+        self.num_queries = len(counts)
+        self.seg = np.repeat(np.arange(self.num_queries), counts)
+        # Stable sorts of 16 bit keys are radix sorts, which makes regrouping by query cheap
+        self.seg_key = self.seg.astype(np.int16 if self.num_queries < 2 ** 15 else np.int32)
+        self.labels = labels
+        self.seg_starts = offsets[:-1]
+        self.counts = counts
+        # Segments keep their place when sorted by (query, -score), so positions never change
+        self.pos = (np.arange(len(labels)) - np.repeat(self.seg_starts, counts) + 1).astype(np.float64)
+        self.in_cutoff = self.pos <= self.k if self.k else np.ones(len(labels), dtype=bool)
+        if self.name == "MAP":
+            self.norm = np.bincount(self.seg, weights=labels > 0, minlength=self.num_queries)
+        elif self.name == "NDCG":
+            self.discount = self.in_cutoff / np.log2(self.pos + 1)
+            ideal = np.lexsort((-labels, self.seg))
+            self.norm = self._sum((2.0 ** labels[ideal] - 1) * self.discount)
+        else:
+            # RankLib divides by k, or by the list length if the list is shorter than k
+            self.norm = np.minimum(counts, self.k).astype(np.float64)
+
+    def _sum(self, x: np.ndarray) -> np.ndarray:
+        return np.bincount(self.seg, weights=x, minlength=self.num_queries)
+
+    def per_query(self, scores: np.ndarray) -> np.ndarray:
+        by_score = np.argsort(-scores, kind="stable")
+        labels = self.labels[by_score[np.argsort(self.seg_key[by_score], kind="stable")]]
+        if self.name == "MAP":
+            rel = (labels > 0).astype(np.float64)
+            cum_rel = np.cumsum(rel)
+            if len(rel):
+                cum_rel -= np.repeat(cum_rel[self.seg_starts] - rel[self.seg_starts], self.counts)
+            total = self._sum(rel * cum_rel / self.pos)
+        elif self.name == "NDCG":
+            total = self._sum((2.0 ** labels - 1) * self.discount)
+        else:
+            total = self._sum((labels > 0) * self.in_cutoff)
+        out = np.zeros(self.num_queries, dtype=np.float64)
+        np.divide(total, self.norm, out=out, where=self.norm > 0)
+        return out
+
+    def score(self, scores: np.ndarray) -> float:
+        return float(self.per_query(scores).mean()) if self.num_queries else 0.0
+
+
+class CoordinateAscent:
+    """RankLib's Coordinate Ascent with its default parameters, optimizing MAP, NDCG@k or P@k."""
+
+    def __init__(self, metric: str = "MAP", restarts: int = 5, max_iterations: int = 25, step_base: float = 0.05,
+                 step_scale: float = 2.0, tolerance: float = 0.001, seed: Optional[int] = 0):
+        parse_metric(metric)
+        self.metric = metric
+        self.restarts = restarts
+        self.max_iterations = max_iterations
+        self.step_base = step_base
+        self.step_scale = step_scale
+        self.tolerance = tolerance
+        self.seed = seed
+        self.weights: Optional[np.ndarray] = None
+        self.train_score: float = 0.0
+
+    def fit(self, values: np.ndarray, labels: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+        """
+        Learn one weight per column of values. Rows offsets[k]:offsets[k + 1] are the list of query k.
+        :return: the weights, also kept in self.weights
+        """
+        scorer = Scorer(self.metric, labels, offsets)
+        rng = np.random.RandomState(self.seed)
+        num_features = values.shape[1]
+        # float64 columns, so that float32 (binary) feature files are trained with the same arithmetic as text ones
+        columns = [np.ascontiguousarray(values[:, j], dtype=np.float64) for j in range(num_features)]
+        best_weights, best_score = None, -np.inf
+
+        for _ in range(self.restarts):
+            weights = np.full(num_features, 1.0 / num_features)
+            scores = values @ weights
+            start_score = current = scorer.score(scores)
+            consecutive_fails = 0
+            while (num_features > 1 and consecutive_fails < num_features - 1) or \
+                    (num_features == 1 and consecutive_fails == 0):
+                for fid in rng.permutation(num_features):
+                    column = columns[fid]
+                    orig = weights[fid]
+                    best_step, succeeds = 0.0, False
+                    for direction in (1, -1, 0):
+                        step = 0.001 * direction
+                        if orig != 0.0 and abs(step) > 0.5 * abs(orig):
+                            step = self.step_base * abs(orig) * direction
+                        total_step, num_iterations = step, self.max_iterations
+                        if direction == 0:
+                            total_step, num_iterations = -orig, 1
+                        for j in range(num_iterations):
+                            score = scorer.score(scores + total_step * column)
+                            if score > current:
+                                current, best_step, succeeds = score, total_step, True
+                            if j < num_iterations - 1:
+                                step *= self.step_scale
+                                total_step += step
+                        if succeeds:
+                            break
+                    if succeeds:
+                        weights[fid] = orig + best_step
+                        scores += best_step * column
+                        norm = np.abs(weights).sum()
+                        if norm > 0:
+                            weights /= norm
+                            scores /= norm
+                        consecutive_fails = 0
+                    else:
+                        consecutive_fails += 1
+                if current - start_score < self.tolerance:
+                    break
+            if current > best_score:
+                best_score, best_weights = current, weights.copy()
+
+        self.weights = best_weights
+        self.train_score = best_score
+        return best_weights
+
+    def save(self, model_file: str):
+        """Write the model in RankLib's Coordinate Ascent model format, readable by combine.get_weights."""
+        with open(model_file, 'w') as f:
+            f.write("## Coordinate Ascent\n")
+            f.write("## Restart = {}\n".format(self.restarts))
+            f.write("## MaxIteration = {}\n".format(self.max_iterations))
+            f.write("## StepBase = {}\n".format(self.step_base))
+            f.write("## StepScale = {}\n".format(self.step_scale))
+            f.write("## Tolerance = {}\n".format(self.tolerance))
+            f.write("## Regularized = false\n")
+            f.write("## Slack = 0.001\n")
+            f.write(" ".join(str(fid) + ":" + repr(float(w)) for fid, w in enumerate(self.weights, start=1)) + "\n")
+
+
+def train_file(feature_file: str, model_file: str, metric: str = "MAP", seed: Optional[int] = 0) -> float:
+    """Train on a RankLib feature file and save the model. :return: the metric on the training data"""
+    return train_data(ranklib_io.read_feature_file(feature_file), model_file, metric, seed)
+
+
+def train_files(feature_files: List[str], model_file: str, metric: str = "MAP", seed: Optional[int] = 0,
+                loaded: Optional[Dict[str, ranklib_io.FeatureData]] = None) -> float:
+    """
+    Train on the concatenation of several feature files without writing it to disk.
+    :param loaded: files already read, by path; files read here are added to it
+    """
+    loaded = {} if loaded is None else loaded
+    for feature_file in feature_files:
+        if feature_file not in loaded:
+            loaded[feature_file] = ranklib_io.read_feature_file(feature_file)
+    return train_data(ranklib_io.concat_feature_data([loaded[f] for f in feature_files]), model_file, metric, seed)
+
+
+def train_data(data: ranklib_io.FeatureData, model_file: str, metric: str = "MAP", seed: Optional[int] = 0) -> float:
+    ranker = CoordinateAscent(metric, seed=seed)
+    ranker.fit(data.values, data.labels, data.offsets)
+    ranker.save(model_file)
+    return ranker.train_score
+
+
+def main():
+    parser = argparse.ArgumentParser("Train a Coordinate Ascent ranker with NumPy (no Java needed).")
+    parser.add_argument("--train", help="Path to the RankLib compatible feature file (training data), text or binary.",
+                        required=True)
+    parser.add_argument("--model", help="Path to the model file.", required=True)
+    parser.add_argument("--metric", help="Metric to optimize for (MAP|NDCG@k|P@k). Defaults to MAP.", default="MAP")
+    parser.add_argument("--seed", help="Seed of the random feature order. Defaults to 0.", default=0)
+    args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
+    start = time.perf_counter()
+    score = train_file(args.train, args.model, args.metric, int(args.seed))
+    print("{} on training data: {:.4f}".format(args.metric, score))
+    print("Trained in {:.1f} seconds.".format(time.perf_counter() - start))
+    print("Model file is written to: " + args.model)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,187 +6,134 @@ __version__ = "7/9/19"
 
 import argparse
 import sys
-import os
-import pandas as pd
+import time
 import numpy as np
-from scipy.stats import zscore
-from typing import List, Dict
-
-
-def read_run_files(run_dir: str):
-
-    runfiles: Dict[str, Dict[str, Dict[str, float]]] = {}
-    list_of_runfiles: List[str] = sorted(os.listdir(run_dir))
-    for fname in list_of_runfiles:
-        print(fname)
-        rankings: Dict[str, Dict[str, float]] = {}
-        with open(run_dir + "/" + fname) as f:
-            for line in f:
-                line_elems = line.split()
-                query = line_elems[0]
-                para = line_elems[2]
-                runscore = float(line_elems[4])
-                if query in rankings.keys():
-                    rankings[query][para] = runscore
-                else:
-                    para_score_dict = {para: runscore}
-                    rankings[query] = para_score_dict
-        runfiles[fname] = rankings
-        f.close()
+from typing import List, Optional
+import feature_matrix
+import compressed_io
+import instrumentation
+import normalization
+import qrel_index
+import ranklib_io
+import run_cache
+import run_loader
+
+
+def read_run_files(run_dir: str) -> List[run_loader.RunTable]:
+    runfiles = run_loader.read_runs(run_dir)
+    for run in runfiles:
+        print(run.name)
     return runfiles
 
 
-def read_ground_truth_file(qrels_dir: str, qrels_file: str):
-    qrels_dict: Dict[str, List[str]] = {}
-    with open(qrels_dir + "/" + qrels_file, 'r') as f:
-        for line in f:
-            query = line.split()[0]
-            para = line.split()[2]
-            if query in qrels_dict.keys():
-                qrels_dict[query].append(para)
-            else:
-                para_list: List[str] = [para]
-                qrels_dict[query] = para_list
-    f.close()
-    return qrels_dict
-
-
-def create_pool(run_dir: str):
-    pool: Dict[str, List[str]] = {}
-    list_of_runfiles: List[str] = sorted(os.listdir(run_dir))
-    for fname in list_of_runfiles:
-        with open(run_dir + "/" + fname) as f:
-            for line in f:
-                line_elems = line.split()
-                query = line_elems[0]
-                para = line_elems[2]
-                if query in pool.keys():
-                    pool.get(query).append(para)
-                else:
-                    para_list: List[str] = [para]
-                    pool[query] = para_list
-    f.close()
-    return pool
-
-
-def create_feature_dict(runfiles, pool):
-    features: Dict[str, Dict[str, Dict[int, float]]] = {}
-    for query in pool.keys():
-        para_list = pool[query]
-        for para in para_list:
-            get_feature_value(query, para, features, runfiles)
-
-    return features
-
-
-def get_feature_value(query, para, features, runfiles):
-    fet_val_dict: Dict[int, float] = {}
-    fet = 1
-    for file in runfiles:
-        rankings = runfiles[file]
-        if query in rankings.keys():
-            para_score_dict = rankings[query]
-            if para in para_score_dict:
-                fet_val_dict[fet] = para_score_dict[para]
-            else:
-                fet_val_dict[fet] = 0.0
-        else:
-            fet_val_dict[fet] = 0.0
-        fet = fet + 1
-    if query in features.keys():
-        features[query][para] = fet_val_dict
-    else:
-        para_val_dict = {para: fet_val_dict}
-        features[query] = para_val_dict
-
-
-def make_feature_file(feature_dict, qrels):
-    fet_line_list: List[str] = []
-    qid: int = 1
-    for query in feature_dict.keys():
-        para_dict = feature_dict[query]
-        rel_para_list = qrels[query]
-        for para in para_dict.keys():
-            fet_val_dict = para_dict[para]
-            if para in rel_para_list:
-                target = "1"
-            else:
-                target = "0"
-            fet_line = target + " " + "qid:" + str(qid)
-            for fet in fet_val_dict.keys():
-                fet_line = fet_line + " " + str(fet) + ":" + str(fet_val_dict[fet])
-            fet_line = fet_line + " #" + str(query) + "_" + str(para)
-            fet_line_list.append(fet_line)
-        qid = qid + 1
-    return fet_line_list
-
-
-def write_feature_file(fet_line_list, out_fet_file):
-    with open(out_fet_file, 'w') as file:
-        for fet_line in fet_line_list:
-            file.write(fet_line + "\n")
-
-
-def dict_to_dataframe(fet_dict):
-    new_dict = {}
-
-    for query in fet_dict.keys():
-        para_dict = fet_dict[query]
-        for para in para_dict.keys():
-            q = query + "_" + para
-            fet_val_dict = para_dict[para]
-            new_dict[q] = fet_val_dict
-
-    df = pd.DataFrame.from_dict(new_dict, orient='index').fillna(0)
-    return df
-
-
-def normalize_dataframe(df):
-    numeric_cols = df.select_dtypes(include=[np.number]).columns
-    normalized_df = df[numeric_cols].apply(zscore)
-    return normalized_df
-
-
-def convert(df_dict):
-    norm_features = {}
-    for key in df_dict.keys():
-        query = key.split("_")[0]
-        para = key.split("_")[1]
-        fet_val_dict = df_dict[key]
-        if query in norm_features.keys():
-            norm_features[query][para] = fet_val_dict
-        else:
-            para_val_dict = {para: fet_val_dict}
-            norm_features[query] = para_val_dict
-
-    return norm_features
-
-
-def create_feature_file(rundir: str, qrelsdir: str, qrelfile: str, save: str, name: str, zscore):
-    print("Reading runs....")
-    runfiles = read_run_files(rundir)
-    print("[Done].")
+def read_ground_truth_file(qrels_dir: str, qrels_file: str, queries: Optional[run_loader.IdTable] = None,
+                           docs: Optional[run_loader.IdTable] = None) -> run_loader.QrelTable:
+    return run_loader.read_qrels(qrels_dir + "/" + qrels_file, queries, docs)
 
-    pool = create_pool(rundir)
 
-    print("Reading qrels...",end=' ')
-    qrels = read_ground_truth_file(qrelsdir, qrelfile)
-    print("[Done].")
+def create_feature_matrix(runfiles: List[run_loader.RunTable], pool_depth: Optional[int] = None,
+                          max_candidates: Optional[int] = None) -> feature_matrix.FeatureMatrix:
+    return feature_matrix.build_feature_matrix(runfiles, depth=pool_depth, max_candidates=max_candidates)
+
+
+def make_labels(matrix: feature_matrix.FeatureMatrix, qrels: run_loader.QrelTable, graded: bool = False) -> np.ndarray:
+    """
+    1 for every candidate listed in the qrels (at any grade), 0 otherwise; with graded, the candidate's relevance
+    grade instead (0 if it is not listed). Negative grades (e.g. the -2 and -1 of TREC-CAR manual qrels) become 0,
+    as map.Evaluator gives them no gain, so that NDCG is trained the way it is evaluated. The qrels must share the
+    matrix's ID tables.
+    """
+    index = qrel_index.QrelIndex(qrels)
+    if graded:
+        return np.maximum(index.grade(matrix.cand_query, matrix.cand_doc), 0)
+    return index.judged(matrix.cand_query, matrix.cand_doc).astype(np.int8)
 
-    out_fet_file = save + "/" + name
 
-    feature_dict = create_feature_dict(runfiles, pool)
-    if zscore:
-        print("Using zscore normalization")
-        normalized_feature_dict = convert(normalize_dataframe(dict_to_dataframe(feature_dict)).to_dict("index"))
-        fet_line_list = make_feature_file(normalized_feature_dict, qrels)
+def write_feature_file(matrix: feature_matrix.FeatureMatrix, labels: np.ndarray, out_fet_file: str, sparse: bool,
+                       binary: bool = False):
+    start = time.perf_counter()
+    if binary:
+        num_rows = ranklib_io.write_binary_file(out_fet_file, ranklib_io.matrix_feature_data(matrix, labels))
     else:
-        fet_line_list = make_feature_file(feature_dict, qrels)
+        num_rows = ranklib_io.write_feature_file(out_fet_file, matrix, labels, sparse)
+    elapsed = time.perf_counter() - start
+    return num_rows, num_rows / elapsed if elapsed > 0 else float(num_rows)
+
+
+def normalize_matrix(matrix: feature_matrix.FeatureMatrix, mode: str = "zscore", stats_in: Optional[str] = None,
+                     stats_out: Optional[str] = None) -> feature_matrix.FeatureMatrix:
+    return normalization.normalize(matrix, mode, stats_in, stats_out)
+
+
+def create_feature_file(rundir: str, qrelsdir: str, qrelfile: str, save: str, name: str, zscore, sparse=False,
+                        pool_depth: Optional[int] = None, max_candidates: Optional[int] = None,
+                        normalize: Optional[str] = None, stats_in: Optional[str] = None,
+                        stats_out: Optional[str] = None, graded: bool = False, binary: bool = False):
+    """
+    :param zscore: z-score normalize the features (the same as normalize="zscore")
+    :param graded: label candidates with their relevance grade rather than 1 (see make_labels())
+    :param normalize: one of normalization.MODES; overrides zscore
+    :param stats_in: normalize with the statistics saved in this file (e.g. those of the training data)
+    :param stats_out: save the normalization statistics to this file
+    :param binary: write the binary feature format (see ranklib_io.write_binary_file()) instead of text
+    """
+    mode = normalization.mode_of(zscore, normalize)
+    with instrumentation.stage("create_feature_file"):
+        print("Reading runs....")
+        with instrumentation.stage("read_runs"):
+            runfiles = read_run_files(rundir)
+            instrumentation.count("runs", len(runfiles))
+            instrumentation.count("lines_parsed", sum(len(run) for run in runfiles))
+        print("[Done].")
+
+        start = time.perf_counter()
+        with instrumentation.stage("pool"):
+            matrix = create_feature_matrix(runfiles, pool_depth, max_candidates)
+            instrumentation.count("candidates", len(matrix))
+            instrumentation.count("features", matrix.num_features)
+        limited = pool_depth is not None or max_candidates is not None
+        if limited:
+            full_size = feature_matrix.pool_size(runfiles)
+            print("Pooled {} candidates instead of {} ({:.0%} fewer) in {:.2f} seconds.".format(
+                len(matrix), full_size, 1 - len(matrix) / full_size if full_size else 0.0,
+                time.perf_counter() - start))
+
+        print("Reading qrels...",end=' ')
+        with instrumentation.stage("read_qrels"):
+            qrels = read_ground_truth_file(qrelsdir, qrelfile, matrix.queries, matrix.docs)
+            instrumentation.count("lines_parsed", len(qrels))
+        print("[Done].")
+
+        out_fet_file = save + "/" + name
+        num_rows, rows_per_sec = write_matrix(matrix, qrels, out_fet_file, mode, sparse, stats_in, stats_out, graded,
+                                            binary)
+        if limited:
+            print("Writing the full pool would have taken about {:.1f} seconds more.".format(
+                (full_size - num_rows) / rows_per_sec if rows_per_sec else 0.0))
+
+
+def write_matrix(matrix: feature_matrix.FeatureMatrix, qrels: run_loader.QrelTable, out_fet_file: str,
+                 mode: str = "none", sparse: bool = False, stats_in: Optional[str] = None,
+                 stats_out: Optional[str] = None, graded: bool = False, binary: bool = False):
+    """
+    Normalize a feature matrix, label it with the qrels (which must share its ID tables) and write it.
+    :return: (rows written, rows written per second)
+    """
+    if mode != "none":
+        print("Using {} normalization".format(mode))
+        with instrumentation.stage("normalize", mode=mode):
+            matrix = normalize_matrix(matrix, mode, stats_in, stats_out)
+    labels = make_labels(matrix, qrels, graded)
 
     print("Writing feature file...",end=' ')
-    write_feature_file(fet_line_list, out_fet_file)
+    with instrumentation.stage("write_features"):
+        num_rows, rows_per_sec = write_feature_file(matrix, labels, out_fet_file, sparse, binary)
+        instrumentation.count("rows_written", num_rows)
+        instrumentation.count("bytes_written", instrumentation.file_size(out_fet_file))
     print("[Done].")
+    print("Wrote {} rows ({:.0f} rows/sec).".format(num_rows, rows_per_sec))
     print("Feature file is written to: " + out_fet_file)
+    return num_rows, rows_per_sec
 
 
 def main():
@@ -196,10 +143,40 @@ def main():
     parser.add_argument("--qrelfile", help="Name of the ground truth file file", required=True)
     parser.add_argument("--save", help="Path to the directory where the feature file will be saved", required=True)
     parser.add_argument("--name", help="Name of the feature file", required=True)
-    parser.add_argument("--zscore", help="Whether to zscore normalize the features or not. "
-                                         "Defaults to no normalization.", action="store_true")
+    parser.add_argument("--sparse", help="Whether to leave out features with value 0 or not. "
+                                         "Defaults to writing every feature.", action="store_true")
+    parser.add_argument("--pool-depth", help="Pool only the top d paragraphs of every run for every query. "
+                                             "Defaults to every retrieved paragraph.")
+    parser.add_argument("--max-candidates", help="Keep at most this many candidates per query, those ranked "
+                                                 "highest by their best run. Defaults to no limit.")
+    parser.add_argument("--graded", help="Label every candidate with its relevance grade in the qrels instead of 1 "
+                                         "(e.g. for training on NDCG). Negative grades are labelled 0.",
+                        action="store_true")
+    parser.add_argument("--binary", help="Write the binary feature format, which combine and the NumPy trainer "
+                                         "memory-map instead of parsing (RankLib itself needs text; convert with "
+                                         "ranklib_io.py).", action="store_true")
+    normalization.add_arguments(parser)
+    parser.add_argument("--norm-stats-in", help="Normalize with the statistics saved in this file (e.g. those of "
+                                                "the training data) instead of those of this data.")
+    parser.add_argument("--norm-stats-out", help="Path to a file to save the normalization statistics to.")
+    compressed_io.add_arguments(parser)
+    run_cache.add_arguments(parser)
+    instrumentation.add_arguments(parser)
     args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
-    create_feature_file(args.rundir, args.qrelsdir, args.qrelfile, args.save, args.name, args.zscore)
+    for option in ("pool_depth", "max_candidates"):
+        value = getattr(args, option)
+        if value is not None and int(value) < 1:
+            parser.error("--{} must be at least 1, not {}.".format(option.replace("_", "-"), value))
+    if args.binary and args.compress:
+        parser.error("--binary cannot be combined with --compress; binary feature files are memory-mapped.")
+    run_cache.configure_from_args(args)
+    instrumentation.configure_from_args(args)
+    create_feature_file(args.rundir, args.qrelsdir, args.qrelfile, args.save,
+                        compressed_io.output_path(args.name, args.compress), args.zscore, args.sparse,
+                        int(args.pool_depth) if args.pool_depth is not None else None,
+                        int(args.max_candidates) if args.max_candidates is not None else None, args.normalize,
+                        args.norm_stats_in, args.norm_stats_out, args.graded, args.binary)
+    instrumentation.finish()
 
 
 if __name__ == '__main__':
@@ -7,6 +7,7 @@ __version__ = "7/11/19"
 import sys
 import argparse
 import os
+import compressed_io
 import cross_validation_split
 
 
@@ -15,39 +16,35 @@ def main():
     parser.add_argument("--fdir", help="Path to the directory where the folds will be saved.", required=True)
     parser.add_argument("--rdir", help="Path to the directory containing the run files.", required=True)
     parser.add_argument("--fold", help="Number of folds required.", required=True)
+    parser.add_argument("--qrels", help="Path to a ground truth (qrel) file to take the queries from. "
+                                        "Defaults to the queries of all run files.")
+    parser.add_argument("--workers", help="Number of run files to split in parallel. Defaults to 1.", default=1)
+    compressed_io.add_arguments(parser)
     args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
-    create_folds(args.fdir, args.rdir, int(args.fold))
+    create_folds(args.fdir, args.rdir, int(args.fold), args.qrels, int(args.workers), args.compress)
 
 
 def get_query_list(run_dir):
-    query_list = []
-    src_files = os.listdir(run_dir)
-    for file_name in src_files:
-        full_file_name = os.path.join(run_dir, file_name)
-        if os.path.isfile(full_file_name):
-            get_query_list_from_file(full_file_name, query_list)
-
-    return query_list
-
-
-def get_query_list_from_file(run_file_path, query_list):
-    with open(run_file_path, 'r') as f:
-        for line in f:
-            line_parts = line.split(" ")
-            query = line_parts[0]
-            query_id = query.split("+")[0]
-            if query_id not in query_list:
-                query_list.append(query_id)
+    return cross_validation_split.get_query_list(get_run_files(run_dir))
 
 
-def create_folds(fold_dir, run_dir, fold):
-    src_files = os.listdir(run_dir)
-    query_list = get_query_list(run_dir)
-    query_list.sort()
-    for file_name in src_files:
+def get_run_files(run_dir):
+    run_files = []
+    for file_name in os.listdir(run_dir):
         full_file_name = os.path.join(run_dir, file_name)
         if os.path.isfile(full_file_name):
-            cross_validation_split.cross_validation_split(full_file_name, fold_dir, fold, query_list)
+            run_files.append(full_file_name)
+    return run_files
+
+
+def create_folds(fold_dir, run_dir, fold, qrel_file=None, workers=1, compress=None):
+    run_files = get_run_files(run_dir)
+    if qrel_file:
+        query_list = cross_validation_split.get_query_list([qrel_file])
+    else:
+        query_list = cross_validation_split.get_query_list(run_files)
+    fold_of = cross_validation_split.fold_map(query_list, fold)
+    cross_validation_split.split_run_files(run_files, fold_dir, fold, fold_of, workers, compress)
 
 
 if __name__ == '__main__':
@@ -9,11 +9,23 @@ import sys
 import argparse
 import os
 import shutil
+from multiprocessing import Pool
+import numpy as np
 import combine
+import coordinate_ascent
 import create_feature_file
 import create_folds
+import cross_validation_split
+import instrumentation
+import manifest
+import map
+import normalization
 import rank_lib_runner
-import re
+import run_cache
+import run_loader
+
+# Ways of putting the run files into the CV directory (see stage()).
+STAGING = ["link", "symlink", "copy", "none"]
 
 
 def main():
@@ -22,43 +34,107 @@ def main():
     parser.add_argument("--rundir", help="Path to the directory containing the run files.", required=True)
     parser.add_argument("--qrelsdir", help="Path to the directory containing the ground truth files.", required=True)
     parser.add_argument("--qrelfile", help="Name of the ground truth file file.", required=True)
-    parser.add_argument("--zscore", help="Whether to zscore normalize the features or not. "
-                                         "Defaults to no normalization.", action="store_true")
+    normalization.add_arguments(parser)
+    parser.add_argument("--graded", help="Label the candidates with their relevance grade in the qrels instead of 1 "
+                                         "(e.g. for training on NDCG). Negative grades are labelled 0.",
+                        action="store_true")
     parser.add_argument("--k", help="Number of folds required.",
                         required=True)
     parser.add_argument("--ranklib", help="Path to the RankLib JAR file. ")
+    parser.add_argument("--metric", help="Metric to optimize for (MAP|NDCG@k|DCG@k|P@k|RR@k|ERR@k). Defaults to MAP.",
+                        default="MAP")
+    parser.add_argument("--ranker", help="RankLib ranker ({}). Defaults to 4; the NumPy trainer only has 4.".format(
+        ", ".join("{}: {}".format(r, name) for r, name in rank_lib_runner.RANKERS.items())),
+                        choices=list(rank_lib_runner.RANKERS), default="4")
+    parser.add_argument("--workers", help="Number of folds to train at the same time. Defaults to 1.", default=1)
+    parser.add_argument("--heap", help="Maximum JVM heap of each training job, e.g. 8g. Defaults to the JVM default.")
+    parser.add_argument("--timeout", help="Seconds a RankLib training job may run before it is killed. Defaults to "
+                                          "no limit.")
+    parser.add_argument("--trainer", help="Train with the RankLib JAR (ranklib) or with the in-process NumPy "
+                                          "Coordinate Ascent (numpy), which needs no Java. Defaults to ranklib.",
+                        choices=["ranklib", "numpy"], default="ranklib")
+    parser.add_argument("--staging", help="How run files are put into the CV directory: hard links (link, falls back "
+                                          "to symlinks and then copies across file systems), symlink, copy, or none to "
+                                          "read them in place. Defaults to link.",
+                        choices=STAGING, default="link")
+    parser.add_argument("--write-train", help="Write the leave-i.txt train files even for the NumPy trainer, which "
+                                              "otherwise reads its train sets straight from the test feature files.",
+                        action="store_true")
+    parser.add_argument("--slice-folds", help="Read the runs once into one feature matrix of all queries and slice "
+                                              "the test feature file of every fold from it, instead of splitting "
+                                              "the runs into fold run files and reading those.",
+                        action="store_true")
+    parser.add_argument("--force", help="Redo every stage, even those the manifest of the CV directory records as "
+                                        "up to date.", action="store_true")
+    parser.add_argument("--from-stage", help="Redo this stage and every later one. Earlier stages are still skipped "
+                                             "when up to date.", choices=manifest.STAGES)
+    run_cache.add_arguments(parser)
+    instrumentation.add_arguments(parser)
     args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
-    cross_validation(args.cvdir, args.rundir, args.qrelsdir, args.qrelfile, args.zscore, int(args.k), args.ranklib)
-
-
-def cross_validation(cv_dir, run_dir, qrels_dir, qrel_file, zscore, k, ranklib_path):
+    run_cache.configure_from_args(args)
+    instrumentation.configure_from_args(args)
+    try:
+        with instrumentation.stage("cross_validation"):
+            cross_validation(args.cvdir, args.rundir, args.qrelsdir, args.qrelfile, args.zscore, int(args.k),
+                             args.ranklib, args.metric, int(args.workers), args.heap, args.trainer,
+                             manifest.STAGES[0] if args.force else args.from_stage, args.staging, args.write_train,
+                             args.normalize, args.ranker, args.slice_folds,
+                             float(args.timeout) if args.timeout else None, args.graded)
+    except rank_lib_runner.RankLibError as e:
+        print(e)
+        sys.exit(-1)
+    instrumentation.finish()
+
+
+def cross_validation(cv_dir, run_dir, qrels_dir, qrel_file, zscore, k, ranklib_path, metric="MAP", workers=1,
+                     heap=None, trainer="ranklib", from_stage=None, staging="link", write_train=False, normalize=None,
+                     ranker="4", slice_folds=False, timeout=None, graded=False):
+    if trainer == "numpy" and ranker != "4":
+        raise ValueError("The NumPy trainer only has Coordinate Ascent (ranker 4), not ranker " + ranker)
     feature_dir = cv_dir + "/" + "features"
     fold_dir = cv_dir + "/" + "folds"
     model_dir = cv_dir + "/" + "models"
     train_dir = cv_dir + "/" + "train"
     test_dir = cv_dir + "/" + "test"
     comb_dir = cv_dir + "/" + "combined"
+    log_dir = cv_dir + "/" + "logs"
+    train = ranklib_path or trainer == "numpy"
 
     print("Creating directories.......")
     print("============================================================================")
 
     # Create directories within the CV directory to hold different things
+    create_directory(cv_dir)
     create_directory(feature_dir)
     create_directory(fold_dir)
     create_directory(train_dir)
     create_directory(test_dir)
 
-    if ranklib_path:
+    if train:
         create_directory(model_dir)
         create_directory(comb_dir)
+        create_directory(log_dir)
+
+    # Stages whose inputs did not change since they last finished are skipped
+    mf = manifest.Manifest(cv_dir, from_stage)
 
     print("\n")
 
-    print("Copying run files to CV directory.......")
+    print("Staging run files in CV directory.......")
     print("============================================================================")
 
-    # Copy run files to CV directory
-    copy(run_dir, feature_dir)
+    # Link (or copy) run files into the CV directory, or fold them where they are
+    if staging == "none":
+        feature_dir = run_dir
+        print("Reading run files in place from: " + run_dir)
+    else:
+        run_files = [os.path.join(run_dir, f) for f in os.listdir(run_dir) if os.path.isfile(os.path.join(run_dir, f))]
+        with instrumentation.stage("copy"):
+            instrumentation.count("runs", len(run_files))
+            if not mf.run("copy", "copy", run_files, lambda: sync(run_dir, feature_dir, staging),
+                          lambda: manifest.list_files(feature_dir), {"staging": staging}):
+                print("Run files are unchanged.")
+                instrumentation.count("reused")
 
     print("\n")
 
@@ -66,7 +142,20 @@ def cross_validation(cv_dir, run_dir, qrels_dir, qrel_file, zscore, k, ranklib_p
     print("============================================================================")
 
     # Divide the runfiles into folds
-    create_folds.create_folds(fold_dir, feature_dir, k)
+    def make_folds():
+        clear_directory(fold_dir)
+        create_folds.create_folds(fold_dir, feature_dir, k)
+    if slice_folds:
+        print("Folds are sliced from the feature matrix of all runs; no fold run files are written.")
+    else:
+        with instrumentation.stage("folds"):
+            if not mf.run("folds", "folds", manifest.list_files(feature_dir), make_folds,
+                          lambda: manifest.list_files(fold_dir), {"k": k}):
+                print("Folds are up to date.")
+                instrumentation.count("reused")
+            else:
+                instrumentation.count("bytes_written", sum(instrumentation.file_size(f)
+                                                           for f in manifest.list_files(fold_dir)))
 
     print("\n")
 
@@ -74,58 +163,184 @@ def cross_validation(cv_dir, run_dir, qrels_dir, qrel_file, zscore, k, ranklib_p
     print("============================================================================")
 
     # Create test data
-    create_test_set(fold_dir, test_dir, qrels_dir, qrel_file, zscore, k)
+    if slice_folds:
+        slice_test_set(FullPool(feature_dir, qrels_dir + "/" + qrel_file), test_dir, zscore, k, mf, normalize,
+                       graded)
+    else:
+        create_test_set(fold_dir, test_dir, qrels_dir, qrel_file, zscore, k, mf, normalize, graded)
 
     print("\n")
 
     print("Creating train data.......")
     print("============================================================================")
 
-    # Create train data
-    create_train_set(train_dir, test_dir, k)
+    # Create train data. The NumPy trainer reads the k - 1 test feature files of a train set directly, so the
+    # leave-i.txt files (k - 1 copies of all feature data) are only written for RankLib, which needs a path.
+    train_sets = None
+    if trainer == "numpy" and not write_train:
+        train_sets = get_train_sets(test_dir, k)
+        print("Train sets are read from the test feature files; no train files are written.")
+    else:
+        create_train_set(train_dir, test_dir, k, mf)
 
     print("\n")
 
-    if ranklib_path:
-        ranklib(train_dir, model_dir, comb_dir, ranklib_path, k)
+    if train:
+        ranklib(train_dir, test_dir, model_dir, comb_dir, log_dir, ranklib_path, k, metric, workers, heap,
+                qrels_dir + "/" + qrel_file, trainer, mf, train_sets, ranker, timeout)
+
+    print("\n")
+    print("Stages reused from earlier runs (manifest: {}).......".format(mf.path))
+    print("============================================================================")
+    mf.print_report()
     print("Done.")
     print("============================================================================")
 
 
-def ranklib(train_dir, model_dir, comb_dir, ranklib_path, k):
-    print("Running RankLib with Coordinate Ascent, optimized for MAP.......")
-    print("============================================================================")
-
-    # Run RankLib with Coordinate Ascent, optimize for Mean Average Precision (MAP) on each train file
-    train_files = os.listdir(train_dir)
-    for file_name in train_files:
-        full_file_name = os.path.join(train_dir, file_name)
-        n = [int(s) for s in re.findall(r'\d+', file_name)][0]  # Find the fold number
-        model_file = model_dir + "/model-" + str(n) + ".txt"
-        rank_lib_runner.run(ranklib_path, full_file_name, model_file)
+def ranklib(train_dir, test_dir, model_dir, comb_dir, log_dir, ranklib_path, k, metric="MAP", workers=1, heap=None,
+            qrel_path=None, trainer="ranklib", mf=None, train_sets=None, ranker="4", timeout=None):
+    # Train one model per fold on the data that leaves that fold out, up to `workers` folds at a time
+    jobs = []
+    for i in range(0, k):
+        jobs.append(rank_lib_runner.TrainJob("fold-" + str(i), train_dir + "/leave-" + str(i) + ".txt",
+                                             model_dir + "/model-" + str(i) + ".txt",
+                                             log_dir + "/train-" + str(i) + ".log", ranker))
+
+    # Only folds whose training data (or trainer) changed are trained again; every model is recorded as soon as it
+    # is saved, so that an interrupted run resumes at the folds that did not finish.
+    params = {"trainer": trainer, "metric": metric}
+    if ranker != "4":
+        params["ranker"] = ranker
+    train_files = {job.name: train_sets[i] if train_sets else [job.feature_file] for i, job in enumerate(jobs)}
+    job_inputs = {job.name: train_files[job.name] + ([ranklib_path] if trainer == "ranklib" else []) for job in jobs}
+    stale = jobs if mf is None else [job for job in jobs if not mf.up_to_date("model-" + job.name, "models",
+                                                                               job_inputs[job.name], params)]
+
+    def on_done(job):
+        if mf is not None:
+            mf.record("model-" + job.name, "models", job_inputs[job.name], [job.model_file], params)
+            mf.rebuilt("models")
+
+    if mf is not None:
+        for job in stale:
+            mf.invalidate("model-" + job.name)
+        for _ in range(len(jobs) - len(stale)):
+            mf.reused("models")
+
+    with instrumentation.stage("models", trainer=trainer):
+        instrumentation.count("trained", len(stale))
+        instrumentation.count("reused", len(jobs) - len(stale))
+        if not stale:
+            print("All models are up to date.")
+        elif trainer == "numpy":
+            print("Running NumPy Coordinate Ascent, optimized for {}.......".format(metric))
+            print("============================================================================")
+            train_numpy(stale, metric, workers, on_done, [train_files[job.name] for job in stale])
+        else:
+            print("Running RankLib with {}, optimized for {}.......".format(rank_lib_runner.RANKERS[ranker], metric))
+            print("============================================================================")
+            results = rank_lib_runner.train_all(ranklib_path, stale, metric, workers, heap, on_done, timeout)
+            for result in results:
+                print("{}: trained in {:.1f} seconds".format(result.job.name, result.duration))
+            print("Training logs are in: " + log_dir)
 
     print("\n")
 
     print("Combining models to get final trec_eval compatible run file.......")
     print("============================================================================")
 
-    # Combine the models with the feature files
-    model_files = os.listdir(model_dir)
-    for i in range(len(model_files)):
-        model = model_files[i]
-        feature = train_files[i]
-        n = [int(s) for s in re.findall(r'\d+', model)][0]  # Find the fold number
-        combined = comb_dir + "/comb-" + str(n) + ".txt"
-        combine.combine(feature, model, combined)
+    # Score each held-out fold with the model that was trained without it
+    l = []
+    for i in range(0, k):
+        feature = test_dir + "/feature-file-" + str(i) + ".txt"
+        model = model_dir + "/model-" + str(i) + ".txt"
+        combined = comb_dir + "/comb-" + str(i) + ".txt"
+        step(mf, "combine-" + str(i), "combine", [feature, model],
+             lambda: combine_fold(feature, model, combined, ranker, ranklib_path, heap,
+                                  log_dir + "/score-" + str(i) + ".log"), [combined],
+             {"ranker": ranker} if ranker != "4" else None)
+        l.append(combined)
 
     # Concatenate all combined files to get one big ranklib combined file
-    comb_files = os.listdir(comb_dir)
-    l = []
-    for file_name in comb_files:
-        full_file_name = os.path.join(comb_dir, file_name)
-        l.append(full_file_name)
     final_combined_file = comb_dir + "/ranklib-combined-" + str(k) + "-fold-cross-validated-file.run"
-    concat(l, final_combined_file)
+    step(mf, "concat", "evaluate", l, lambda: concat(l, final_combined_file), [final_combined_file])
+
+    if qrel_path:
+        print("\n")
+        print("Evaluating the cross-validated run file.......")
+        print("============================================================================")
+        with instrumentation.stage("evaluate"):
+            evaluate(final_combined_file, qrel_path)
+
+
+def step(mf, name, stage, inputs, action, outputs, params=None):
+    """
+    Run one step of the pipeline, or skip it if the manifest says it is up to date (see manifest.Manifest.run()).
+    Shared with the sweep, which runs the combine and evaluate steps of every configuration this way.
+    :param mf: the manifest of the directory the step writes to, or None to always run the step
+    :param name: name of the step in the manifest, e.g. "combine-0"
+    :param stage: one of manifest.STAGES
+    :param inputs: files the step reads
+    :param action: does the step
+    :param outputs: files the step writes
+    :param params: settings the outputs depend on besides the inputs
+    """
+    with instrumentation.stage(stage, step=name):
+        if mf is None:
+            action()
+        elif not mf.run(name, stage, inputs, action, lambda: outputs, params):
+            print("{} is up to date.".format(name))
+            instrumentation.count("reused")
+            return
+        # Only a step that ran wrote its outputs
+        instrumentation.count("bytes_written", sum(instrumentation.file_size(f) for f in outputs))
+
+
+def combine_fold(feature_file, model_file, combined_file, ranker="4", ranklib_path=None, heap=None, log_file=None):
+    """Score a held-out fold with its model: in-process for linear models, with RankLib for the others."""
+    if ranker in rank_lib_runner.LINEAR_RANKERS:
+        combine.combine(feature_file, model_file, combined_file)
+        return
+    score_file = combined_file + ".scores"
+    rank_lib_runner.score(ranklib_path, model_file, feature_file, score_file, log_file or os.devnull, heap)
+    combine.combine_scores(feature_file, score_file, combined_file)
+    os.remove(score_file)
+
+
+def train_numpy(jobs, metric, workers, on_done=None, train_files=None):
+    """
+    Train the jobs with the NumPy Coordinate Ascent, each optimized for its own metric if it has one. Job i trains
+    on the concatenation of train_files[i] (defaults to its own feature file); run one at a time, every feature
+    file is read only once.
+    """
+    train_files = [[job.feature_file] for job in jobs] if train_files is None else train_files
+    args = [(i, files, job.model_file, job.metric or metric) for i, (job, files) in enumerate(zip(jobs, train_files))]
+    if workers > 1:
+        with Pool(min(workers, len(jobs))) as pool:
+            _collect_numpy(jobs, metric, pool.imap_unordered(_train_numpy_job, args), on_done)
+    else:
+        loaded = {}
+        _collect_numpy(jobs, metric, (_train_numpy_job(a, loaded) for a in args), on_done)
+
+
+def _train_numpy_job(job, loaded=None):
+    i, feature_files, model_file, metric = job
+    with instrumentation.stage("coordinate_ascent", job=i):
+        instrumentation.count("bytes_read", sum(instrumentation.file_size(f) for f in feature_files))
+        return i, coordinate_ascent.train_files(feature_files, model_file, metric, loaded=loaded)
+
+
+def _collect_numpy(jobs, metric, results, on_done):
+    for i, score in results:
+        print("{}: {} on training data {:.4f}".format(jobs[i].name, jobs[i].metric or metric, score))
+        if on_done is not None:
+            on_done(jobs[i])
+
+
+def evaluate(run_file, qrel_path):
+    aggregate, _ = map.Evaluator.from_file(qrel_path).evaluate_file(run_file)
+    for measure, value in aggregate.items():
+        print(measure + "\t\t\t" + "all" + "\t" + "{:.4f}".format(value))
 
 
 def create_directory(path):
@@ -145,6 +360,51 @@ def copy(src, dest):
             shutil.copy(full_file_name, dest)
 
 
+def stage(src_file, dest, mode="link"):
+    """
+    Put a file into dest as a hard link, a symlink or a copy. Hard links fall back to symlinks (e.g. across file
+    systems), and symlinks to copies.
+    """
+    dest_file = os.path.join(dest, os.path.basename(src_file))
+    if os.path.lexists(dest_file):
+        if mode == "link" and os.path.exists(dest_file) and os.path.samefile(src_file, dest_file):
+            return
+        os.remove(dest_file)
+    if mode == "link":
+        try:
+            os.link(src_file, dest_file)
+            return
+        except OSError:
+            mode = "symlink"
+    if mode == "symlink":
+        try:
+            os.symlink(os.path.abspath(src_file), dest_file)
+            return
+        except OSError:
+            pass
+    shutil.copy(src_file, dest_file)
+
+
+def sync(src, dest, mode="copy"):
+    """Stage the files of src in dest (see stage()) and remove files of dest that are no longer in src."""
+    for file_name in os.listdir(src):
+        full_file_name = os.path.join(src, file_name)
+        if os.path.isfile(full_file_name):
+            stage(full_file_name, dest, mode)
+    for file_name in os.listdir(dest):
+        if not os.path.isfile(os.path.join(src, file_name)):
+            os.remove(os.path.join(dest, file_name))
+
+
+def clear_directory(path):
+    for name in os.listdir(path):
+        full_name = os.path.join(path, name)
+        if os.path.isdir(full_name):
+            shutil.rmtree(full_name)
+        else:
+            os.remove(full_name)
+
+
 def grouper(iterable, elements, rotations):
     """
     In order to get a cyclic elements from your list you can use deque from collections module and do a deque.rotation(-1).
@@ -173,36 +433,104 @@ def concat(file_list, out_file):
                 shutil.copyfileobj(f, out)
 
 
-def create_test_set(fold_dir, test_dir, qrels_dir, qrel_file, zscore, k):
+def create_test_set(fold_dir, test_dir, qrels_dir, qrel_file, zscore, k, mf=None, normalize=None, graded=False):
+    # Every fold is normalized on its own; its statistics are kept next to its feature file
+    mode = normalization.mode_of(zscore, normalize)
+    params = test_params(mode, graded)
     for i in range(0, k):
         fdir = fold_dir + "/fold-" + str(i)
         feature_file_name = "feature-file-" + str(i) + ".txt"
-        create_feature_file.create_feature_file(fdir, qrels_dir, qrel_file, test_dir, feature_file_name, zscore)
+        stats_file = test_dir + "/feature-file-" + str(i) + ".norm.json" if mode != "none" else None
+        step(mf, "test-" + str(i), "test", manifest.list_files(fdir) + [qrels_dir + "/" + qrel_file],
+             lambda: create_feature_file.create_feature_file(fdir, qrels_dir, qrel_file, test_dir,
+                                                             feature_file_name, zscore, normalize=mode,
+                                                             stats_out=stats_file, graded=graded),
+             [test_dir + "/" + feature_file_name] + ([stats_file] if stats_file else []), params)
+
+
+def test_params(mode, graded):
+    # Binary labels are left out, so that test files written before graded labels existed stay up to date
+    return dict({"normalize": mode}, **({"graded": True} if graded else {}))
+
+
+class FullPool:
+    """The feature matrix of all queries of a directory of runs, built the first time a fold needs it."""
+
+    def __init__(self, run_dir, qrel_path):
+        self.run_dir = run_dir
+        self.qrel_path = qrel_path
+        self.matrix = None
+        self.qrels = None
+        self._folds = {}
+
+    def inputs(self):
+        return manifest.list_files(self.run_dir) + [self.qrel_path]
+
+    def load(self):
+        if self.matrix is None:
+            print("Reading runs....")
+            with instrumentation.stage("read_runs"):
+                runs = create_feature_file.read_run_files(self.run_dir)
+                instrumentation.count("runs", len(runs))
+                instrumentation.count("lines_parsed", sum(len(run) for run in runs))
+            print("[Done].")
+            with instrumentation.stage("pool"):
+                self.matrix = create_feature_file.create_feature_matrix(runs)
+                instrumentation.count("candidates", len(self.matrix))
+            with instrumentation.stage("read_qrels"):
+                self.qrels = run_loader.read_qrels(self.qrel_path, self.matrix.queries, self.matrix.docs)
+        return self.matrix
+
+    def fold(self, i, k):
+        """The matrix of the queries that create_folds() puts into fold i of k."""
+        matrix = self.load()
+        if k not in self._folds:
+            # Folds are dealt out over the sorted query IDs (the part before any '+'), as in cross_validation_split
+            query_ids = matrix.queries.ids
+            base = [query_ids[q].split("+", 1)[0] for q in matrix.query_list.tolist()]
+            fold_of = cross_validation_split.fold_map(sorted(set(base)), k)
+            self._folds[k] = np.array([fold_of[b] for b in base], dtype=np.int64)
+        return matrix.select_queries(np.flatnonzero(self._folds[k] == i))
+
+
+def slice_test_set(full_pool, test_dir, zscore, k, mf=None, normalize=None, graded=False):
+    """
+    Write the same test feature files as create_test_set(), slicing every fold out of the feature matrix of all
+    queries instead of reading its fold run files. The pool of a query is the same either way, and queries and
+    candidates keep the order in which the runs (in name order, as their folds are) first retrieved them.
+    """
+    mode = normalization.mode_of(zscore, normalize)
+    for i in range(0, k):
+        feature_file = test_dir + "/feature-file-" + str(i) + ".txt"
+        stats_file = test_dir + "/feature-file-" + str(i) + ".norm.json" if mode != "none" else None
+        step(mf, "test-" + str(i), "test", full_pool.inputs(),
+             lambda: create_feature_file.write_matrix(full_pool.fold(i, k), full_pool.qrels, feature_file, mode,
+                                                      stats_out=stats_file, graded=graded),
+             [feature_file] + ([stats_file] if stats_file else []), dict(test_params(mode, graded), k=k))
 
 
-def create_train_set(train_dir, test_dir, k):
+def get_train_sets(test_dir, k):
+    """The test feature files that make up the train set of every fold, in the order they are concatenated."""
     # Generate a list of all possible feature file numbers
     file_list = [i for i in range(0, k)]
 
     # Get a list of all possible cyclical combinations of the list, picking k - 1 elements for k cycles
     cycle = list(grouper(file_list, k - 1, k))
 
+    train_sets = {}
     # For every list in the cycle
     for l in cycle:
-
-        # Get the leave number and make the leave file name
+        # Get the leave number and make a list of the feature files of every other fold
         leave = get_leave(file_list, l)
-        leave_file = train_dir + "/leave-" + str(leave) + ".txt"
-        files = []
+        train_sets[leave] = [test_dir + "/feature-file-" + str(n) + ".txt" for n in l]
+    return train_sets
 
-        # For every file number in the list
-        for n in l:
-            # Make a list of feature files to concatenate
-            feature_file = test_dir + "/feature-file-" + str(n) + ".txt"
-            files.append(feature_file)
 
+def create_train_set(train_dir, test_dir, k, mf=None):
+    for leave, files in sorted(get_train_sets(test_dir, k).items()):
+        leave_file = train_dir + "/leave-" + str(leave) + ".txt"
         # Concatenate those files
-        concat(files, leave_file)
+        step(mf, "train-" + str(leave), "train", files, lambda: concat(files, leave_file), [leave_file])
 
 
 if __name__ == '__main__':
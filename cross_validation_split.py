@@ -7,19 +7,81 @@ __version__ = "6/7/19"
 import argparse
 import sys
 import os
+from multiprocessing import Pool
+from typing import Dict, List, Optional
+import compressed_io
 
+# Size of the read and write buffers used while splitting.
+BUFFER_SIZE: int = 1 << 20
 
-def cross_validation_split(run_file_path, dest, folds, query_list):
-    run_file_name = run_file_path[run_file_path.rfind("/")+1:]
+
+def cross_validation_split(run_file_path, dest, folds, query_list, compress=None):
+    split_run_file(run_file_path, dest, int(folds), fold_map(query_list, int(folds)), compress)
+
+
+def split_run_file(run_file_path: str, dest: str, folds: int, fold_of: Dict[str, int],
+                   compress: Optional[str] = None):
+    """
+    Split a run file into folds in one pass over the file. Each line goes to the fold of its query,
+    dest/fold-<i>/fold_<i>_<run file name>. Lines of queries that are in no fold are dropped.
+    A compressed run file gives compressed folds of the same format.
+    :param compress: compress the folds in this format (see compressed_io.FORMATS)
+    """
+    run_file_name = os.path.basename(run_file_path)
     print("File: " + run_file_name)
 
-    for i in range(0, int(folds)):
-        fold_query_list = split(query_list, folds)[i]
-        fold_file_name = "fold_" + str(i) + "_" + run_file_name
+    fold_files = []
+    try:
+        for i in range(0, folds):
+            fold_dir = dest + "/" + "fold-" + str(i)
+            if not os.path.isdir(fold_dir):
+                create_directory(fold_dir)
+            fold_file_path = compressed_io.output_path(fold_dir + "/" + "fold_" + str(i) + "_" + run_file_name,
+                                                       compress)
+            fold_files.append(compressed_io.open_file(fold_file_path, 'w', buffering=BUFFER_SIZE))
+        writers = [f.write for f in fold_files]
+
+        with compressed_io.open_file(run_file_path, 'r', buffering=BUFFER_SIZE) as f:
+            for line in f:
+                fold = fold_of.get(line.split(" ", 1)[0].split("+", 1)[0])
+                if fold is not None:
+                    writers[fold](line.rstrip() + "\n")
+    finally:
+        for fold_file in fold_files:
+            fold_file.close()
+
+
+def split_run_files(run_file_paths: List[str], dest: str, folds: int, fold_of: Dict[str, int], workers: int = 1,
+                    compress: Optional[str] = None):
+    """Split many run files, workers of them at a time."""
+    # Make the fold directories up front so that the workers do not race to create them.
+    for i in range(0, folds):
         fold_dir = dest + "/" + "fold-" + str(i)
         if not os.path.isdir(fold_dir):
             create_directory(fold_dir)
-        create_fold(fold_query_list, fold_file_name, run_file_path, fold_dir)
+
+    if workers > 1 and len(run_file_paths) > 1:
+        with Pool(min(workers, len(run_file_paths))) as pool:
+            pool.starmap(split_run_file, [(path, dest, folds, fold_of, compress) for path in run_file_paths])
+    else:
+        for path in run_file_paths:
+            split_run_file(path, dest, folds, fold_of, compress)
+
+
+def fold_map(query_list: List[str], folds: int) -> Dict[str, int]:
+    """Query -> fold number. Fold i gets query_list[i::folds], as split() does."""
+    return {query_id: i % folds for i, query_id in enumerate(query_list)}
+
+
+def get_query_list(file_paths: List[str]) -> List[str]:
+    """Sorted query IDs (the part before any '+') of a set of run or qrel files."""
+    queries = set()
+    for file_path in file_paths:
+        with compressed_io.open_file(file_path, 'r', buffering=BUFFER_SIZE) as f:
+            queries.update(line.split(" ", 1)[0].split("+", 1)[0] for line in f)
+    queries.discard("")
+    queries.discard("\n")
+    return sorted(queries)
 
 
 def create_directory(path):
@@ -29,36 +91,21 @@ def create_directory(path):
         print("Creation of the directory %s failed" % path)
 
 
-def create_fold(fold_query_list, fold_file_name, run_file_path, fold_dir):
-    fold_file_path = fold_dir + "/" + fold_file_name
-    run_strings = []
-    with open(run_file_path, 'r') as f:
-        for line in f:
-            line_parts = line.split(" ")
-            query = line_parts[0]
-            query_id = query.split("+")[0]
-            if query_id in fold_query_list:
-                run_strings.append(line.rstrip())
-    write_file(fold_file_path, run_strings)
-
-
 def split(query_list, n):
     return [query_list[i::n] for i in range(n)]
 
 
-def write_file(file_path, run_strings):
-    with open(file_path, 'w') as file:
-        for run_file_string in run_strings:
-            file.write(run_file_string + "\n")
-
-
 def main():
     parser = argparse.ArgumentParser("Divide a TREC-CAR run file into folds for cross-validation.")
     parser.add_argument("--file", help="Path to the data file to split.", required=True)
     parser.add_argument("--save", help="Path to the directory where the folds will be saved.", required=True)
     parser.add_argument("--fold", help="Number of folds required.", required=True)
+    parser.add_argument("--qrels", help="Path to a ground truth (qrel) file to take the queries from. "
+                                        "Defaults to the queries of the data file.")
+    compressed_io.add_arguments(parser)
     args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
-    cross_validation_split(args.file, args.save, int(args.fold))
+    query_list = get_query_list([args.qrels if args.qrels else args.file])
+    cross_validation_split(args.file, args.save, int(args.fold), query_list, args.compress)
 
 
 if __name__ == '__main__':
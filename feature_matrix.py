@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+"""This script builds a candidates x runs feature matrix from a set of TREC-CAR run files."""
+
+__author__ = "Shubham Chatterjee"
+__version__ = "10/18/26"
+
+from typing import Iterator, List, Optional, Tuple
+import argparse
+import sys
+import numpy as np
+import run_loader
+
+
+class FeatureMatrix:
+    """
+    The pooled candidates of a set of runs and the score every run gives them.
+
+    Row i is the (query, paragraph) pair (cand_query[i], cand_doc[i]) and column j holds the score of run
+    j, or 0 if run j did not retrieve the pair. Rows are grouped by query: the rows of queries[k] are
+    offsets[k]:offsets[k + 1]. Queries and candidates keep the order in which the runs (taken in order)
+    first retrieved them, which is the order the dict based pool used.
+    """
+
+    def __init__(self, queries: run_loader.IdTable, docs: run_loader.IdTable, run_names: List[str],
+                 query_list: np.ndarray, offsets: np.ndarray, cand_query: np.ndarray, cand_doc: np.ndarray,
+                 values: np.ndarray):
+        self.queries = queries
+        self.docs = docs
+        self.run_names = run_names
+        self.query_list = query_list
+        self.offsets = offsets
+        self.cand_query = cand_query
+        self.cand_doc = cand_doc
+        self.values = values
+
+    def __len__(self) -> int:
+        return len(self.cand_query)
+
+    @property
+    def num_features(self) -> int:
+        return self.values.shape[1]
+
+    def query_slices(self) -> Iterator[Tuple[str, int, int]]:
+        """(query ID, first row, end row) for every query, in order."""
+        query_ids = self.queries.ids
+        offsets = self.offsets.tolist()
+        for k, q in enumerate(self.query_list.tolist()):
+            yield query_ids[q], offsets[k], offsets[k + 1]
+
+    def with_values(self, values: np.ndarray) -> 'FeatureMatrix':
+        """The same candidates with a different (e.g. normalized) matrix of values."""
+        return FeatureMatrix(self.queries, self.docs, self.run_names, self.query_list, self.offsets,
+                             self.cand_query, self.cand_doc, values)
+
+    def select_queries(self, positions: np.ndarray) -> 'FeatureMatrix':
+        """
+        The rows of the queries at the given positions of query_list, in that order. The pool of a query does not
+        depend on the other queries, so this is the matrix the runs restricted to those queries would give.
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        starts = self.offsets[positions]
+        counts = self.offsets[positions + 1] - starts
+        offsets = np.append(0, np.cumsum(counts)).astype(np.int64)
+        rows = np.arange(offsets[-1]) + np.repeat(starts - offsets[:-1], counts)
+        # Column by column, to keep the values column-major without a second copy
+        values = np.empty((len(rows), self.num_features), dtype=self.values.dtype, order='F')
+        for j in range(self.num_features):
+            values[:, j] = self.values[rows, j]
+        return FeatureMatrix(self.queries, self.docs, self.run_names, self.query_list[positions], offsets,
+                             self.cand_query[rows], self.cand_doc[rows], values)
+
+
+def select_top(run: run_loader.RunTable, depth: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The rows of a run that are among the top depth of their query by score (ties go to the earlier line).
+    A query whose lines are already sorted by descending score (the usual case) just keeps its first depth
+    lines; other queries are selected with argpartition, and only the selected lines are sorted.
+    :return: (selected rows in file order, 0-based position of each by score within its query)
+    """
+    if depth < 1:
+        raise ValueError("The pool depth must be at least 1, not {}.".format(depth))
+    order, _, starts, ends = run.group_by_query()
+    counts = ends - starts
+    score = run.score[order]
+    seg = np.repeat(np.arange(len(counts)), counts)
+    pos = np.arange(len(order)) - np.repeat(starts, counts)
+
+    # A query is sorted if no line has a higher score than the line before it
+    rises = np.flatnonzero(np.diff(score) > 0) + 1
+    unsorted = np.zeros(len(counts), dtype=bool)
+    unsorted[seg[rises[pos[rises] > 0]]] = True
+
+    keep = (pos < depth) & ~unsorted[seg]
+    for k in np.flatnonzero(unsorted).tolist():
+        start, end = int(starts[k]), int(ends[k])
+        s = score[start:end]
+        if end - start > depth:
+            threshold = s[np.argpartition(-s, depth - 1)[depth - 1]]
+            above = np.flatnonzero(s > threshold)
+            ties = np.flatnonzero(s == threshold)[:depth - len(above)]
+            chosen = np.concatenate((above, ties))
+        else:
+            chosen = np.arange(end - start)
+        chosen = chosen[np.lexsort((chosen, -s[chosen]))]
+        keep[start + chosen] = True
+        pos[start + chosen] = np.arange(len(chosen))
+
+    rows = order[keep]
+    by_file = np.argsort(rows, kind="stable")
+    return rows[by_file], pos[keep][by_file]
+
+
+def pool(runs: List[run_loader.RunTable], depth: Optional[int] = None, max_candidates: Optional[int] = None):
+    """
+    Deduplicated pool of the (query, paragraph) pairs retrieved by the runs.
+    :param depth: pool only the top depth lines of every run for every query (see select_top())
+    :param max_candidates: keep at most this many candidates per query: those ranked highest by their best run
+                           (ties in pool order). Without depth, every run's top max_candidates lines are pooled.
+    :return: (sorted pair keys, row of each sorted key in the pool, query list, offsets, cand_query, cand_doc)
+    """
+    num_docs = len(runs[0].docs) if runs else 0
+    if depth is None and max_candidates is None:
+        keys = np.concatenate([_pair_keys(run, num_docs) for run in runs]) if runs else np.empty(0, dtype=np.int64)
+        return _pool_keys(keys, num_docs)
+
+    for name, value in (("depth", depth), ("max_candidates", max_candidates)):
+        if value is not None and value < 1:
+            raise ValueError("The pool {} must be at least 1, not {}.".format(name, value))
+    depth = min(d for d in (depth, max_candidates) if d is not None)
+    selected = [select_top(run, depth) for run in runs]
+    keys = np.concatenate([_pair_keys(run, num_docs)[rows] for run, (rows, _) in zip(runs, selected)])
+    pooled = _pool_keys(keys, num_docs)
+    if max_candidates is None:
+        return pooled
+
+    # Best (smallest) position any run gives each candidate, then the max_candidates best of every query
+    uniq, row_of, query_list, offsets, _, _ = pooled
+    best = np.full(len(uniq), np.iinfo(np.int64).max)
+    np.minimum.at(best, row_of[np.searchsorted(uniq, keys)], np.concatenate([pos for _, pos in selected]))
+    query_rank = np.repeat(np.arange(len(query_list)), np.diff(offsets))
+    ranked = np.lexsort((np.arange(len(best)), best, query_rank))
+    within = np.arange(len(ranked)) - offsets[query_rank[ranked]]
+    keep_row = np.zeros(len(best), dtype=bool)
+    keep_row[ranked[within < max_candidates]] = True
+    return _pool_keys(keys[np.isin(keys, uniq[keep_row[row_of]])], num_docs)
+
+
+def pool_size(runs: List[run_loader.RunTable]) -> int:
+    """Number of distinct (query, paragraph) pairs retrieved by the runs, at any depth."""
+    num_docs = len(runs[0].docs) if runs else 0
+    return len(np.unique(np.concatenate([_pair_keys(run, num_docs) for run in runs]))) if runs else 0
+
+
+def _pool_keys(keys: np.ndarray, num_docs: int):
+    uniq, first = np.unique(keys, return_index=True)
+    cand_query = (uniq // max(num_docs, 1)).astype(np.int32)
+    cand_doc = (uniq % max(num_docs, 1)).astype(np.int32)
+
+    # A query comes where the runs first retrieved it; inside a query, candidates keep first-retrieved order.
+    # The sorted keys are already grouped by query, so each query's first retrieval is a segment minimum.
+    query_first = np.empty(0, dtype=np.int64)
+    if len(uniq):
+        seg = np.flatnonzero(np.diff(cand_query, prepend=-1))
+        query_first = np.repeat(np.minimum.reduceat(first, seg), np.diff(np.append(seg, len(uniq))))
+    order = np.lexsort((first, query_first))
+    row_of = np.empty(len(order), dtype=np.int64)
+    row_of[order] = np.arange(len(order))
+
+    cand_query = cand_query[order]
+    cand_doc = cand_doc[order]
+    starts = np.flatnonzero(np.diff(cand_query, prepend=-1)) if len(order) else np.empty(0, dtype=np.int64)
+    query_list = cand_query[starts]
+    offsets = np.append(starts, len(order)).astype(np.int64)
+    return uniq, row_of, query_list, offsets, cand_query, cand_doc
+
+
+def build_feature_matrix(runs: List[run_loader.RunTable], dtype=np.float64, depth: Optional[int] = None,
+                         max_candidates: Optional[int] = None) -> FeatureMatrix:
+    """
+    Pool the runs and scatter each run's scores into its column of the matrix.
+    The runs must share their query and paragraph ID tables (see run_loader.read_runs).
+    float64 keeps the scores exactly as parsed; float32 halves the memory.
+    With depth or max_candidates (see pool()) the pool is smaller, but a pooled candidate still gets the score of
+    every run that retrieved it, at any depth.
+    """
+    uniq, row_of, query_list, offsets, cand_query, cand_doc = pool(runs, depth, max_candidates)
+    num_docs = len(runs[0].docs) if runs else 0
+
+    # Column-major, so that every run's column is contiguous for the scatter and for per-feature statistics.
+    values = np.zeros((len(cand_query), len(runs)), dtype=dtype, order='F')
+    for j, run in enumerate(runs):
+        keys = _pair_keys(run, num_docs)
+        score = run.score
+        last = _last_occurrence(keys)
+        if last is not None:
+            keys, score = keys[last], score[last]
+        at = np.searchsorted(uniq, keys)
+        if depth is not None or max_candidates is not None:
+            # Drop the lines whose pair did not make it into the pool
+            pooled = at < len(uniq)
+            pooled[pooled] = uniq[at[pooled]] == keys[pooled]
+            at, score = at[pooled], score[pooled]
+        values[row_of[at], j] = score
+
+    return FeatureMatrix(runs[0].queries if runs else run_loader.IdTable(),
+                         runs[0].docs if runs else run_loader.IdTable(),
+                         [run.name for run in runs], query_list, offsets, cand_query, cand_doc, values)
+
+
+def _pair_keys(run: run_loader.RunTable, num_docs: int) -> np.ndarray:
+    return run.query_idx.astype(np.int64) * num_docs + run.doc_idx
+
+
+def _last_occurrence(keys: np.ndarray) -> Optional[np.ndarray]:
+    """Rows holding the last occurrence of every key, or None if the keys are already unique."""
+    uniq, first_rev = np.unique(keys[::-1], return_index=True)
+    if len(uniq) == len(keys):
+        return None
+    return len(keys) - 1 - first_rev
+
+
+def main():
+    parser = argparse.ArgumentParser("Build the candidates x runs feature matrix for a directory of run files.")
+    parser.add_argument("--rundir", help="Path to the directory containing the run files.", required=True)
+    parser.add_argument("--save", help="Path to a .npz file to save the matrix to.")
+    parser.add_argument("--pool-depth", help="Pool only the top d paragraphs of every run for every query.")
+    parser.add_argument("--max-candidates", help="Keep at most this many candidates per query.")
+    args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
+    for option in ("pool_depth", "max_candidates"):
+        value = getattr(args, option)
+        if value is not None and int(value) < 1:
+            parser.error("--{} must be at least 1, not {}.".format(option.replace("_", "-"), value))
+
+    matrix = build_feature_matrix(run_loader.read_runs(args.rundir),
+                                  depth=int(args.pool_depth) if args.pool_depth is not None else None,
+                                  max_candidates=int(args.max_candidates) if args.max_candidates is not None else None)
+    print("Queries: {}".format(len(matrix.query_list)))
+    print("Candidates: {}".format(len(matrix)))
+    print("Runs: {}".format(matrix.num_features))
+    if args.save:
+        np.savez(args.save, values=matrix.values, cand_query=matrix.cand_query, cand_doc=matrix.cand_doc,
+                 offsets=matrix.offsets, query_ids=np.array(matrix.queries.ids), doc_ids=np.array(matrix.docs.ids),
+                 run_names=np.array(matrix.run_names))
+        print("Feature matrix is written to: " + args.save)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+"""This script records the wall time, CPU time, memory and counters of every stage of the pipeline."""
+
+__author__ = "Shubham Chatterjee"
+__version__ = "10/18/26"
+
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+import argparse
+import cProfile
+import csv
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+# Columns of the CSV report; the counters come after them, one column per counter name.
+COLUMNS = ["stage", "labels", "parent", "start", "wall", "cpu", "child_cpu", "peak_rss_mb", "rss_growth_mb"]
+
+
+def peak_rss_mb() -> float:
+    """Peak RSS of this process in MB."""
+    # On Linux ru_maxrss survives fork and exec, so a child would report the parent's peak if that was higher;
+    # VmHWM belongs to the address space and starts over at exec.
+    try:
+        with open("/proc/self/status", 'r') as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 2 ** 10
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2 ** 20 if sys.platform == "darwin" else rss / 2 ** 10
+
+
+def _reset_peak_rss() -> bool:
+    """Start the peak RSS over at the current RSS (Linux only). :return: whether it was reset"""
+    try:
+        with open("/proc/self/clear_refs", 'w') as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _child_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Stage:
+    """An open stage: where it started and what it counted so far."""
+
+    def __init__(self, name: str, labels: Dict[str, str], parent: Optional['Stage']):
+        self.name = name
+        self.labels = labels
+        self.parent = parent
+        self.counters: Dict[str, int] = {}
+        self.peak = peak_rss_mb()
+        self.start_peak = self.peak
+        self.start = time.time()
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        self.child_cpu = _child_cpu()
+
+    def path(self) -> str:
+        return self.name if self.parent is None else self.parent.path() + "/" + self.name
+
+
+class Recorder:
+    """
+    Collects one record per stage: wall time, CPU time of this process and of the child processes it waited for
+    (e.g. the RankLib JVMs), peak RSS and counters such as lines parsed or bytes written.
+
+    Stages nest, per thread. Where the kernel lets us (Linux), the peak RSS is started over at every stage, so a
+    stage's peak RSS is its own rather than the process's peak so far; the stages open at the time (including
+    the enclosing ones) are credited with the peak before it is started over. The CPU time of this process covers
+    all its threads, so stages run in parallel threads overlap in it. Stages that run in worker processes are not
+    recorded.
+    """
+
+    def __init__(self, profile: Optional[List[str]] = None, profile_dir: str = "."):
+        self.records: List[dict] = []
+        self.profile = set(profile or [])
+        self.profile_dir = profile_dir
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._open: List[Stage] = []
+        self._profiling = False
+        self._profiled: Dict[str, int] = {}
+
+    def _stack(self) -> List[Stage]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def _fold_peak(self):
+        # Credit the peak so far to every open stage, of every thread, before it is started over
+        peak = peak_rss_mb()
+        for open_stage in self._open:
+            open_stage.peak = max(open_stage.peak, peak)
+
+    @contextmanager
+    def stage(self, name: str, **labels) -> Iterator[Stage]:
+        """Record the code in the with block as a stage; labels (e.g. fold=3) tell repeated stages apart."""
+        stack = self._stack()
+        with self._lock:
+            self._fold_peak()
+            _reset_peak_rss()
+            current = Stage(name, {k: str(v) for k, v in labels.items()}, stack[-1] if stack else None)
+            self._open.append(current)
+        stack.append(current)
+
+        profiler = None
+        if name in self.profile:
+            with self._lock:
+                # Only one profiler can be active at a time
+                if not self._profiling:
+                    self._profiling = True
+                    profiler = cProfile.Profile()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield current
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                with self._lock:
+                    self._profiling = False
+                    # Every run of a stage gets its own dump, numbered in order
+                    self._profiled[name] = self._profiled.get(name, 0) + 1
+                    number = self._profiled[name]
+                os.makedirs(self.profile_dir, exist_ok=True)
+                profiler.dump_stats(os.path.join(self.profile_dir, "{}-{}.prof".format(
+                    "-".join([name] + list(current.labels.values())), number)))
+            with self._lock:
+                self._fold_peak()
+                self._open.remove(current)
+            stack.pop()
+            record = {"stage": name, "labels": current.labels,
+                      "parent": current.parent.path() if current.parent else "", "start": current.start,
+                      "wall": time.perf_counter() - current.wall, "cpu": time.process_time() - current.cpu,
+                      "child_cpu": _child_cpu() - current.child_cpu, "peak_rss_mb": current.peak,
+                      "rss_growth_mb": current.peak - current.start_peak, "counters": current.counters}
+            with self._lock:
+                self.records.append(record)
+
+    def count(self, counter: str, n: int = 1):
+        """Add n to a counter of the innermost open stage of this thread (if any)."""
+        stack = self._stack()
+        if stack:
+            counters = stack[-1].counters
+            counters[counter] = counters.get(counter, 0) + int(n)
+
+    def write_report(self, report_file: str):
+        """Write the records as JSON, or as CSV if the file name ends in .csv."""
+        records = sorted(self.records, key=lambda r: r["start"])
+        if report_file.endswith(".csv"):
+            counters = sorted(set(c for r in records for c in r["counters"]))
+            with open(report_file, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(COLUMNS + counters)
+                for r in records:
+                    labels = " ".join("{}={}".format(k, v) for k, v in sorted(r["labels"].items()))
+                    writer.writerow([labels if c == "labels" else r[c] for c in COLUMNS] +
+                                    [r["counters"].get(c, "") for c in counters])
+        else:
+            with open(report_file, 'w') as f:
+                json.dump({"argv": sys.argv, "stages": records}, f, indent=1)
+
+
+_recorder = Recorder()
+_report_file: Optional[str] = None
+
+
+def recorder() -> Recorder:
+    return _recorder
+
+
+def stage(name: str, **labels):
+    """Record a stage with the default recorder (see Recorder.stage())."""
+    return _recorder.stage(name, **labels)
+
+
+def count(counter: str, n: int = 1):
+    _recorder.count(counter, n)
+
+
+def file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def configure(report_file: Optional[str] = None, profile: Optional[List[str]] = None,
+              profile_dir: Optional[str] = None):
+    """Set where finish() writes the report, and the stages to profile with cProfile."""
+    global _report_file
+    _report_file = report_file
+    _recorder.profile = set(profile or [])
+    if profile_dir is not None:
+        _recorder.profile_dir = profile_dir
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """The instrumentation options shared by the pipeline scripts."""
+    parser.add_argument("--report", help="Path to a JSON (or .csv) file to write the time, memory and counters of "
+                                         "every stage to.")
+    parser.add_argument("--profile", help="Names of stages to run under cProfile; each run of such a stage is "
+                                          "dumped to <profile-dir>/<stage>[-<labels>]-<n>.prof.", nargs="+")
+    parser.add_argument("--profile-dir", help="Directory for the cProfile dumps. Defaults to the current directory.",
+                        default=".")
+
+
+def configure_from_args(args: argparse.Namespace):
+    configure(args.report, args.profile, args.profile_dir)
+
+
+def finish():
+    """Write the report, if one was asked for."""
+    if _report_file:
+        _recorder.write_report(_report_file)
+        print("Stage report is written to: " + _report_file)
+
+
+def print_report(report: dict):
+    names = [(r["parent"] + "/" if r["parent"] else "") + r["stage"] +
+             "".join(" {}={}".format(k, v) for k, v in sorted(r["labels"].items())) for r in report["stages"]]
+    width = max([len(name) for name in names] + [5]) + 2
+    print("{:<{}}{:>10}{:>10}{:>10}{:>10}  {}".format("stage", width, "wall", "cpu", "child cpu", "peak MB",
+                                                      "counters"))
+    for name, r in zip(names, report["stages"]):
+        print("{:<{}}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.1f}  {}".format(
+            name, width, r["wall"], r["cpu"], r["child_cpu"], r["peak_rss_mb"],
+            " ".join("{}={}".format(k, v) for k, v in sorted(r["counters"].items()))))
+
+
+def main():
+    parser = argparse.ArgumentParser("Print a stage report written with --report.")
+    parser.add_argument("--report", help="Path to the JSON report.", required=True)
+    args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
+    with open(args.report, 'r') as f:
+        print_report(json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""This script keeps track of the cross-validation stages that are up to date, using content hashes."""
+
+__author__ = "Shubham Chatterjee"
+__version__ = "10/18/26"
+
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional
+import argparse
+import json
+import os
+import sys
+import run_cache
+
+# Stages of cross_validation.py, in pipeline order.
+STAGES = ["copy", "folds", "test", "train", "models", "combine", "evaluate"]
+
+MANIFEST_FILE = "manifest.json"
+
+# Bumped whenever the layout of the manifest changes; manifests of other versions are ignored.
+FORMAT_VERSION = 1
+
+
+class Manifest:
+    """
+    Records, for every step of the pipeline (a stage, or one fold of a stage), the content hashes of its input
+    and output files and the parameters it ran with. A step is up to date, and can be skipped, if its inputs and
+    parameters are the same as when it last finished and its outputs are still the files it wrote.
+
+    File hashes are kept with the size and mtime they were computed for, so a file is only hashed again after it
+    changed on disk.
+    """
+
+    def __init__(self, cv_dir: str, from_stage: Optional[str] = None):
+        if from_stage is not None and from_stage not in STAGES:
+            raise ValueError("Unknown stage '{}'. Choose from: {}".format(from_stage, ", ".join(STAGES)))
+        self.cv_dir = cv_dir
+        self.path = os.path.join(cv_dir, MANIFEST_FILE)
+        self.from_stage = from_stage
+        self.files: Dict[str, list] = {}
+        self.steps: Dict[str, dict] = {}
+        self.report: Dict[str, List[int]] = OrderedDict((stage, [0, 0]) for stage in STAGES)
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    data = json.load(f)
+            except ValueError:
+                data = {}
+            if data.get("version") == FORMAT_VERSION:
+                self.files = data["files"]
+                self.steps = data["steps"]
+
+    def _key(self, path: str) -> str:
+        # Paths inside the CV directory are kept relative, so that the directory can be moved
+        rel = os.path.relpath(os.path.abspath(path), os.path.abspath(self.cv_dir))
+        return os.path.abspath(path) if rel.startswith(os.pardir) else rel
+
+    def _path(self, key: str) -> str:
+        return key if os.path.isabs(key) else os.path.join(self.cv_dir, key)
+
+    def hash(self, path: str) -> Optional[str]:
+        """The content hash of a file, or None if it does not exist."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        key = self._key(path)
+        known = self.files.get(key)
+        if known is not None and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+            return known[2]
+        digest = run_cache.file_hash(path)
+        self.files[key] = [st.st_size, st.st_mtime_ns, digest]
+        return digest
+
+    def fingerprint(self, paths: Iterable[str]) -> Dict[str, Optional[str]]:
+        return {self._key(path): self.hash(path) for path in sorted(paths)}
+
+    def forced(self, stage: str) -> bool:
+        return self.from_stage is not None and STAGES.index(stage) >= STAGES.index(self.from_stage)
+
+    def up_to_date(self, step: str, stage: str, inputs: Iterable[str], params: Optional[dict] = None) -> bool:
+        record = self.steps.get(step)
+        if record is None or self.forced(stage):
+            return False
+        if record["inputs"] != self.fingerprint(inputs) or record["params"] != (params or {}):
+            return False
+        return all(self.hash(self._path(key)) == digest for key, digest in record["outputs"].items())
+
+    def invalidate(self, step: str):
+        if self.steps.pop(step, None) is not None:
+            self.save()
+
+    def record(self, step: str, stage: str, inputs: Iterable[str], outputs: Iterable[str],
+               params: Optional[dict] = None):
+        self.steps[step] = {"stage": stage, "inputs": self.fingerprint(inputs), "params": params or {},
+                            "outputs": self.fingerprint(outputs)}
+        self.save()
+
+    def run(self, step: str, stage: str, inputs: Iterable[str], action: Callable[[], None],
+            outputs: Callable[[], Iterable[str]], params: Optional[dict] = None) -> bool:
+        """
+        Run action() unless the step is up to date, then record the files that outputs() lists.
+        The old record is dropped before action() runs, so a step that crashes is redone next time.
+        :return: whether the step ran
+        """
+        inputs = list(inputs)
+        if self.up_to_date(step, stage, inputs, params):
+            self.reused(stage)
+            return False
+        self.invalidate(step)
+        action()
+        self.record(step, stage, inputs, outputs(), params)
+        self.rebuilt(stage)
+        return True
+
+    def reused(self, stage: str):
+        self.report[stage][0] += 1
+
+    def rebuilt(self, stage: str):
+        self.report[stage][1] += 1
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump({"version": FORMAT_VERSION, "files": self.files, "steps": self.steps}, f, indent=1,
+                      sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def print_report(self):
+        print("{:<10}{:>8}{:>8}".format("stage", "reused", "rebuilt"))
+        for stage, (reused, rebuilt) in self.report.items():
+            if reused or rebuilt:
+                print("{:<10}{:>8}{:>8}".format(stage, reused, rebuilt))
+
+
+def list_files(directory: str) -> List[str]:
+    """Every file under a directory, recursively."""
+    out = []
+    for root, _, files in os.walk(directory):
+        out.extend(os.path.join(root, f) for f in files)
+    return sorted(out)
+
+
+def main():
+    parser = argparse.ArgumentParser("Show which steps of a cross-validation directory are recorded as done.")
+    parser.add_argument("--cvdir", help="Path to the directory where all CV data is stored.", required=True)
+    args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
+    manifest = Manifest(args.cvdir)
+    for step, record in sorted(manifest.steps.items(), key=lambda kv: (STAGES.index(kv[1]["stage"]), kv[0])):
+        print("{:<12}{:<16}{:>6} inputs{:>6} outputs".format(record["stage"], step, len(record["inputs"]),
+                                                             len(record["outputs"])))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,24 +3,17 @@
 __author__ = "Shubham Chatterjee"
 __version__ = "8/16/19"
 
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 import sys
 import argparse
+import numpy as np
+import qrel_index
+import run_cache
+import run_loader
 
 
 def get_rankings(file_path: str) -> Dict[str, List[str]]:
-    rankings: Dict[str, List[str]] = {}
-    with open(file_path, 'r') as file:
-        for line in file:
-            line_parts = line.split(" ")
-            queryID = line_parts[0]
-            field2 = line_parts[2]
-            _list: List[str] = []
-            if queryID in rankings.keys():
-                _list = rankings[queryID]
-            _list.append(field2)
-            rankings[queryID] = _list
-    return rankings
+    return run_loader.read_rankings(file_path)
 
 
 def average_prec(ret_para_list: List[str], rel_para_list: List[str]) -> float:
@@ -28,10 +21,11 @@ def average_prec(ret_para_list: List[str], rel_para_list: List[str]) -> float:
     rel_i: int = 0
     s: float = 0.0
     avg_prec_list: List[float] = []
+    rel_para_set = set(rel_para_list)
 
     for paraID in ret_para_list:
         ret_i = ret_i + 1
-        if paraID in rel_para_list:
+        if paraID in rel_para_set:
             rel_i = rel_i + 1
             avg_prec_list.append(rel_i / ret_i)
 
@@ -71,21 +65,173 @@ def num_rel_ret(ret_para_list, rel_para_list):
     return len(list(set(ret_para_list) & set(rel_para_list)))
 
 
+# Measures understood by Evaluator. "@k" measures take a cutoff, e.g. P@5 or ndcg@10.
+MEASURES: List[str] = ["map", "P@k", "Rprec", "ndcg", "ndcg@k", "recip_rank", "recall", "recall@k",
+                       "num_ret", "num_rel", "num_rel_ret"]
+
+# Alternative names of measures.
+ALIASES: Dict[str, str] = {"MAP": "map", "R-Prec": "Rprec", "MRR": "recip_rank", "mrr": "recip_rank",
+                           "NDCG": "ndcg"}
+
+DEFAULT_MEASURES: List[str] = ["map", "P@1", "P@5", "Rprec", "ndcg@10", "recip_rank", "recall@100"]
+
+
+def parse_measure(measure: str) -> Tuple[str, Optional[int]]:
+    """Split a measure name such as "P@5" into ("P", 5)."""
+    name, _, k = measure.partition("@")
+    name = ALIASES.get(name, name)
+    if (name + "@k" if k else name) not in MEASURES:
+        raise ValueError("Unknown measure '{}'. Known measures: {}".format(measure, ", ".join(MEASURES)))
+    return name, int(k) if k else None
+
+
+class Evaluator:
+    """
+    Evaluates runs against one qrel file. The qrels are indexed once (see qrel_index.QrelIndex), so evaluating a
+    run is a handful of array operations over all its lines.
+    Like trec_eval, paragraphs with grade > 0 are relevant, and a query's ranking is the order of its lines.
+    """
+
+    def __init__(self, qrels: run_loader.QrelTable):
+        self.index = qrel_index.QrelIndex(qrels)
+        self.queries = qrels.queries
+        self.docs = qrels.docs
+        self.num_rel = self.index.num_rel
+        self._qrels = qrels
+        self._ideal_dcg: Dict[Optional[int], np.ndarray] = {}
+
+    @classmethod
+    def from_file(cls, qrel_file: str) -> 'Evaluator':
+        return cls(run_loader.read_qrels(qrel_file))
+
+    def ideal_dcg(self, k: Optional[int]) -> np.ndarray:
+        """Per qrel query, the DCG (at k) of the ideal ranking."""
+        if k not in self._ideal_dcg:
+            qrels = self._qrels
+            gains = qrels.relevance.astype(np.float64)
+            order = np.lexsort((-gains, qrels.query_idx))
+            query_idx = qrels.query_idx[order]
+            gains = gains[order]
+            pos = _positions(query_idx)
+            keep = (gains > 0) & (pos <= k) if k else gains > 0
+            self._ideal_dcg[k] = np.bincount(query_idx[keep], weights=gains[keep] / np.log2(pos[keep] + 1),
+                                             minlength=len(self.queries))
+        return self._ideal_dcg[k]
+
+    def evaluate_file(self, run_file: str, measures: List[str] = DEFAULT_MEASURES, complete: bool = False):
+        return self.evaluate(run_loader.read_table(run_file), measures, complete)
+
+    def evaluate(self, run: run_loader.Table, measures: List[str] = DEFAULT_MEASURES, complete: bool = False):
+        """
+        Compute all measures for a run in one pass over its lines.
+        :param complete: average over every query of the qrels (a query the run misses scores 0), like
+                         trec_eval -c. By default only the queries in both the run and the qrels count.
+        :return: ({measure: mean}, {measure: {query: value}})
+        """
+        parsed = [parse_measure(m) for m in measures]
+
+        # Translate the run's own ID indices into the qrels' ID tables and drop queries without qrels
+        query_map, doc_map = self.index.lookup_ids(run.queries.ids, run.docs.ids)
+        order, run_queries, starts, ends = run.group_by_query()
+        seg_queries = query_map[run_queries]
+        judged = seg_queries >= 0
+        counts = (ends - starts)[judged]
+        order = order[np.repeat(judged, ends - starts)]
+        seg_queries = seg_queries[judged]
+
+        num_seg = len(seg_queries)
+        seg = np.repeat(np.arange(num_seg), counts)
+        row_query = seg_queries[seg]
+        row_doc = doc_map[run.doc_idx[order]]
+        pos = _positions(seg)
+
+        # Relevance grade of every retrieved paragraph, by binary search in the sorted qrel keys
+        grades = self.index.grade(row_query, row_doc).astype(np.float64)
+        rel = (grades > 0).astype(np.float64)
+
+        # Number of relevant paragraphs up to and including each line of a query
+        num_rel = self.num_rel[seg_queries]
+        cum_rel = np.cumsum(rel)
+        if len(seg):
+            seg_starts = np.cumsum(counts) - counts
+            cum_rel -= np.repeat(cum_rel[seg_starts] - rel[seg_starts], counts)
+        rel_ret = np.bincount(seg, weights=rel, minlength=num_seg)
+
+        values: Dict[str, np.ndarray] = {}
+        for measure, (name, k) in zip(measures, parsed):
+            if name == "map":
+                value = _divide(np.bincount(seg, weights=rel * cum_rel / pos, minlength=num_seg), num_rel)
+            elif name == "P":
+                value = np.bincount(seg, weights=rel * (pos <= k), minlength=num_seg) / k
+            elif name == "Rprec":
+                value = _divide(np.bincount(seg, weights=rel * (pos <= num_rel[seg]), minlength=num_seg), num_rel)
+            elif name == "ndcg":
+                cut = pos <= k if k else np.ones(len(seg), dtype=bool)
+                dcg = np.bincount(seg, weights=cut * grades / np.log2(pos + 1), minlength=num_seg)
+                value = _divide(dcg, self.ideal_dcg(k)[seg_queries])
+            elif name == "recip_rank":
+                first = np.full(num_seg, np.inf)
+                np.minimum.at(first, seg[rel > 0], pos[rel > 0])
+                value = 1.0 / first
+            elif name == "recall":
+                cut = pos <= k if k else np.ones(len(seg), dtype=bool)
+                value = _divide(np.bincount(seg, weights=rel * cut, minlength=num_seg), num_rel)
+            elif name == "num_ret":
+                value = counts.astype(np.float64)
+            elif name == "num_rel":
+                value = num_rel.astype(np.float64)
+            else:
+                value = rel_ret
+            values[measure] = value
+
+        query_ids = self.queries.ids
+        seg_query_ids = [query_ids[q] for q in seg_queries.tolist()]
+        num_queries = len(self.queries) if complete else num_seg
+        aggregate = {m: (float(v.sum()) / num_queries if num_queries else 0.0) for m, v in values.items()}
+        for m, (name, _) in zip(measures, parsed):
+            if name.startswith("num_"):
+                aggregate[m] = float(values[m].sum())
+        per_query = {m: dict(zip(seg_query_ids, v.tolist())) for m, v in values.items()}
+        return aggregate, per_query
+
+
+def _positions(group: np.ndarray) -> np.ndarray:
+    """1-based position of every element inside its run of equal consecutive values."""
+    if not len(group):
+        return np.zeros(0, dtype=np.float64)
+    starts = np.flatnonzero(np.diff(group, prepend=group[0] - 1))
+    counts = np.diff(np.append(starts, len(group)))
+    return (np.arange(len(group)) - np.repeat(starts, counts) + 1).astype(np.float64)
+
+
+def _divide(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    out = np.zeros(len(a), dtype=np.float64)
+    np.divide(a, b, out=out, where=b > 0)
+    return out
+
+
 def main():
-    parser = argparse.ArgumentParser("Calculate Precision at 1 for a TREC-CAR run file")
+    parser = argparse.ArgumentParser("Evaluate a TREC-CAR run file")
     parser.add_argument("--filepath", help="Path to the run file.", required=True)
     parser.add_argument("--qrelpath", help="Path to the ground truth (qrel) file.", required=True)
     parser.add_argument("--q", help="Whether per query or not. Default is False.",  action="store_true")
+    parser.add_argument("--measures", help="Comma separated measures to compute ({}). Defaults to map."
+                        .format(", ".join(MEASURES)), default="map")
+    parser.add_argument("--c", help="Average over all queries in the qrels, not only the ones in the run. "
+                                    "Default is False.", action="store_true")
+    run_cache.add_arguments(parser)
     args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
-    p, prec_dict = mean_average_precision(args.filepath, args.qrelpath)
+    run_cache.configure_from_args(args)
+    measures = args.measures.split(",")
+    aggregate, per_query = Evaluator.from_file(args.qrelpath).evaluate_file(args.filepath, measures, args.c)
 
-    if args.q:
-        for queryID in prec_dict:
-            _map = prec_dict[queryID]
-            print_string = "map" + "\t\t\t" + queryID + "\t" + "{:.4f}".format(_map)
-            print(print_string)
+    for measure in measures:
+        if args.q:
+            for queryID, value in per_query[measure].items():
+                print_string = measure + "\t\t\t" + queryID + "\t" + "{:.4f}".format(value)
+                print(print_string)
 
-    print("map" + "\t\t\t" + "all" + "\t" + "{:.4f}".format(p))
+        print(measure + "\t\t\t" + "all" + "\t" + "{:.4f}".format(aggregate[measure]))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+"""This script normalizes the features of a candidates x runs feature matrix, globally or per query."""
+
+__author__ = "Shubham Chatterjee"
+__version__ = "10/18/26"
+
+from typing import List, Optional
+import argparse
+import json
+import sys
+import numpy as np
+import feature_matrix
+
+# none: raw scores; zscore: (x - mean) / std of every feature over all candidates; query-zscore: the same within
+# every query; query-minmax: (x - min) / (max - min) within every query; rank: the position of the candidate in
+# its query by the feature, scaled to [0, 1] (ties share their average position).
+MODES = ["none", "zscore", "query-zscore", "query-minmax", "rank"]
+
+# Bumped whenever the layout of a statistics file changes.
+FORMAT_VERSION = 1
+
+
+class Normalizer:
+    """
+    The statistics of one normalization mode: a center and a scale per feature (zscore), or per query and
+    feature (query-zscore, query-minmax), with x' = (x - center) / scale and x' = 0 where the scale is 0.
+
+    Statistics fitted on one matrix (e.g. a training fold) can be saved and applied to another (e.g. a test
+    fold). Per-query statistics only apply to the queries they were fitted on; other queries get their own.
+    """
+
+    def __init__(self, mode: str, center: Optional[np.ndarray] = None, scale: Optional[np.ndarray] = None,
+                 count: Optional[np.ndarray] = None, query_ids: Optional[List[str]] = None):
+        if mode not in MODES:
+            raise ValueError("Unknown normalization '{}'. Choose from: {}".format(mode, ", ".join(MODES)))
+        self.mode = mode
+        self.center = center
+        self.scale = scale
+        self.count = count
+        self.query_ids = query_ids
+
+    @property
+    def per_query(self) -> bool:
+        return self.mode in ("query-zscore", "query-minmax")
+
+    def fit(self, matrix: feature_matrix.FeatureMatrix) -> 'Normalizer':
+        values = matrix.values
+        if self.mode == "zscore":
+            # Same arithmetic as scipy.stats.zscore (population std), so scores do not change in the last digit
+            self.center = values.mean(axis=0)
+            self.scale = values.std(axis=0)
+            self.count = np.array([len(values)], dtype=np.int64)
+        elif self.per_query:
+            starts = matrix.offsets[:-1]
+            self.count = np.diff(matrix.offsets)
+            if self.mode == "query-zscore":
+                self.center, self.scale = segment_mean_std(values, starts, self.count)
+            else:
+                self.center, self.scale = segment_min_range(values, starts)
+            query_ids = matrix.queries.ids
+            self.query_ids = [query_ids[q] for q in matrix.query_list.tolist()]
+        return self
+
+    def transform(self, matrix: feature_matrix.FeatureMatrix) -> feature_matrix.FeatureMatrix:
+        if self.mode == "none":
+            return matrix
+        if self.mode == "rank":
+            return matrix.with_values(query_ranks(matrix.values, matrix.offsets))
+        if self.center is None:
+            self.fit(matrix)
+        center, scale = self.center, self.scale
+        if self.per_query:
+            center, scale = self._query_stats(matrix)
+            counts = np.diff(matrix.offsets)
+            center = np.repeat(center, counts, axis=0)
+            scale = np.repeat(scale, counts, axis=0)
+        values = np.empty_like(matrix.values)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            np.divide(matrix.values - center, scale, out=values)
+        values[np.broadcast_to(scale == 0, values.shape)] = 0.0
+        return matrix.with_values(values)
+
+    def _query_stats(self, matrix: feature_matrix.FeatureMatrix):
+        """Per-query statistics of the matrix's queries, in its order: the fitted ones, or fitted on the spot."""
+        own = Normalizer(self.mode).fit(matrix)
+        if self.query_ids == own.query_ids:
+            return self.center, self.scale
+        known = {q: i for i, q in enumerate(self.query_ids)}
+        center, scale = own.center.copy(), own.scale.copy()
+        for i, q in enumerate(own.query_ids):
+            k = known.get(q)
+            if k is not None:
+                center[i], scale[i] = self.center[k], self.scale[k]
+        return center, scale
+
+    def to_dict(self) -> dict:
+        data = {"version": FORMAT_VERSION, "mode": self.mode}
+        for key in ("center", "scale", "count"):
+            value = getattr(self, key)
+            if value is not None:
+                data[key] = value.tolist()
+        if self.query_ids is not None:
+            data["query_ids"] = self.query_ids
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Normalizer':
+        if data.get("version") != FORMAT_VERSION:
+            raise ValueError("Unsupported normalization statistics version: {}".format(data.get("version")))
+        arrays = {key: np.array(data[key], dtype=np.int64 if key == "count" else np.float64)
+                  for key in ("center", "scale", "count") if key in data}
+        return cls(data["mode"], query_ids=data.get("query_ids"), **arrays)
+
+    def save(self, stats_file: str):
+        with open(stats_file, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, stats_file: str) -> 'Normalizer':
+        with open(stats_file, 'r') as f:
+            return cls.from_dict(json.load(f))
+
+
+def merge(parts: List[Normalizer]) -> Normalizer:
+    """
+    The statistics of the union of disjoint sets of queries (e.g. shards), from the statistics fitted on each.
+    zscore means and stds are pooled (Chan et al.), so they equal those fitted on the union up to rounding;
+    per-query statistics are concatenated.
+    """
+    modes = set(part.mode for part in parts)
+    if len(modes) != 1:
+        raise ValueError("Cannot merge statistics of different modes: {}".format(", ".join(sorted(modes))))
+    mode = modes.pop()
+    if mode == "zscore":
+        parts = [part for part in parts if part.count is not None and int(part.count[0]) > 0]
+        if not parts:
+            return Normalizer(mode)
+        counts = np.array([float(part.count[0]) for part in parts])
+        centers = np.array([part.center for part in parts])
+        scales = np.array([part.scale for part in parts])
+        total = counts.sum()
+        mean = (counts[:, None] * centers).sum(axis=0) / total
+        m2 = (counts[:, None] * (scales * scales + (centers - mean) ** 2)).sum(axis=0)
+        return Normalizer(mode, mean, np.sqrt(m2 / total), np.array([int(total)], dtype=np.int64))
+    if mode in ("query-zscore", "query-minmax"):
+        parts = [part for part in parts if part.query_ids]
+        if not parts:
+            return Normalizer(mode)
+        return Normalizer(mode, np.concatenate([part.center for part in parts]),
+                          np.concatenate([part.scale for part in parts]),
+                          np.concatenate([part.count for part in parts]),
+                          [q for part in parts for q in part.query_ids])
+    return Normalizer(mode)
+
+
+def segment_mean_std(values: np.ndarray, starts: np.ndarray, counts: np.ndarray):
+    """Mean and population std of every feature over every segment of rows (segments must not be empty)."""
+    if not len(starts):
+        return np.empty((0, values.shape[1])), np.empty((0, values.shape[1]))
+    mean = np.add.reduceat(values, starts, axis=0) / counts[:, None]
+    dev = values - np.repeat(mean, counts, axis=0)
+    std = np.sqrt(np.add.reduceat(dev * dev, starts, axis=0) / counts[:, None])
+    return mean, std
+
+
+def segment_min_range(values: np.ndarray, starts: np.ndarray):
+    """Minimum and max - min of every feature over every segment of rows (segments must not be empty)."""
+    if not len(starts):
+        return np.empty((0, values.shape[1])), np.empty((0, values.shape[1]))
+    low = np.minimum.reduceat(values, starts, axis=0)
+    return low, np.maximum.reduceat(values, starts, axis=0) - low
+
+
+def query_ranks(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+    Every value replaced by its ascending position within its query (rows offsets[k]:offsets[k + 1]), ties
+    sharing the average of their positions, scaled to [0, 1]. A query with one candidate gets 0.
+    """
+    counts = np.diff(offsets)
+    seg = np.repeat(np.arange(len(counts)), counts)
+    pos = np.arange(len(seg)) - np.repeat(offsets[:-1], counts)
+    denom = np.maximum(counts - 1, 1)[seg].astype(np.float64)
+    out = np.empty_like(values, dtype=np.float64)
+    for j in range(values.shape[1]):
+        col = values[:, j]
+        order = np.lexsort((col, seg))
+        sorted_col = col[order]
+        # A tie group starts where the query or the value changes
+        new_group = np.ones(len(order), dtype=bool)
+        new_group[1:] = (seg[1:] != seg[:-1]) | (sorted_col[1:] != sorted_col[:-1])
+        group = np.cumsum(new_group) - 1
+        starts = np.flatnonzero(new_group)
+        first = pos[starts]
+        last = pos[np.append(starts[1:], len(order)) - 1]
+        out[order, j] = ((first + last) / 2.0)[group] / denom
+    return out
+
+
+def normalize(matrix: feature_matrix.FeatureMatrix, mode: str, stats_in: Optional[str] = None,
+              stats_out: Optional[str] = None) -> feature_matrix.FeatureMatrix:
+    """
+    Normalize the matrix with statistics loaded from stats_in (e.g. those of the training data), or fitted on
+    the matrix itself. The statistics used are written to stats_out.
+    """
+    if stats_in:
+        normalizer = Normalizer.load(stats_in)
+        if normalizer.mode != mode:
+            raise ValueError("{} holds {} statistics, not {}.".format(stats_in, normalizer.mode, mode))
+    else:
+        normalizer = Normalizer(mode).fit(matrix)
+    normalized = normalizer.transform(matrix)
+    if stats_out:
+        normalizer.save(stats_out)
+    return normalized
+
+
+def mode_of(zscore: bool, mode: Optional[str]) -> str:
+    """The normalization asked for by a --normalize mode, or by the older --zscore flag."""
+    if mode is not None:
+        return mode
+    return "zscore" if zscore else "none"
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """The normalization options of the scripts that write feature files."""
+    parser.add_argument("--normalize", help="How to normalize the features ({}). Defaults to none.".format(
+        ", ".join(MODES)), choices=MODES)
+    parser.add_argument("--zscore", help="Z-score normalize the features; the same as --normalize zscore.",
+                        action="store_true")
+
+
+def main():
+    parser = argparse.ArgumentParser("Show the normalization statistics saved in a file.")
+    parser.add_argument("--stats", help="Path to the statistics file.", required=True)
+    args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
+    normalizer = Normalizer.load(args.stats)
+    print("Mode: " + normalizer.mode)
+    if normalizer.center is None:
+        return
+    if normalizer.per_query:
+        print("Queries: {}".format(len(normalizer.query_ids)))
+        center = normalizer.center.mean(axis=0)
+        scale = normalizer.scale.mean(axis=0)
+        print("Averaged over queries:")
+    else:
+        center, scale = normalizer.center, normalizer.scale
+        print("Candidates: {}".format(int(normalizer.count[0])))
+    print("{:<10}{:>16}{:>16}".format("feature", "center", "scale"))
+    for j, (c, s) in enumerate(zip(center.tolist(), scale.tolist()), start=1):
+        print("{:<10}{:>16.6g}{:>16.6g}".format(j, c, s))
+
+
+if __name__ == '__main__':
+    main()
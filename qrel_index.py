@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""This script indexes a qrel file for fast, batched relevance lookups of (query, paragraph) pairs."""
+
+__author__ = "Shubham Chatterjee"
+__version__ = "10/18/26"
+
+from typing import List, Optional, Tuple
+import argparse
+import sys
+import numpy as np
+import run_loader
+
+
+class QrelIndex:
+    """
+    The judged paragraphs of every query with their relevance grades, as (query, paragraph) integer keys sorted
+    once. Looking up a whole array of candidates is one binary search per candidate, done in a single NumPy call.
+
+    Like trec_eval, a paragraph is relevant if its grade is > 0; a pair listed more than once keeps its first
+    grade. Lookups take query and paragraph indices into the index's own ID tables: read the runs with the same
+    tables (see run_loader.read_qrels()), or translate other tables with lookup_ids().
+    """
+
+    def __init__(self, qrels: run_loader.QrelTable):
+        self.queries = qrels.queries
+        self.docs = qrels.docs
+        # Paragraphs interned after the index was built (e.g. by a run read later) are never judged
+        self.num_docs = max(len(qrels.docs), 1)
+        self.num_judged_docs = len(qrels.docs)
+        keys = qrels.query_idx.astype(np.int64) * self.num_docs + qrels.doc_idx
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.grades = qrels.relevance[order]
+        self.num_rel = np.bincount(qrels.query_idx, weights=qrels.relevance > 0, minlength=len(qrels.queries))
+        self.qrels = qrels
+
+    @classmethod
+    def from_file(cls, qrel_file: str, queries: Optional[run_loader.IdTable] = None,
+                  docs: Optional[run_loader.IdTable] = None) -> 'QrelIndex':
+        return cls(run_loader.read_qrels(qrel_file, queries, docs))
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def num_queries(self) -> int:
+        """Number of queries with at least one judged paragraph."""
+        return len(np.unique(self.qrels.query_idx))
+
+    def lookup(self, query_idx: np.ndarray, doc_idx: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find every (query_idx[i], doc_idx[i]) pair; IDs unknown to the qrels (negative indices, or paragraphs
+        interned after the index was built) are never found.
+        :return: (whether each pair is judged, its position in keys and grades, valid where judged)
+        """
+        query_idx = np.asarray(query_idx, dtype=np.int64)
+        doc_idx = np.asarray(doc_idx, dtype=np.int64)
+        found = np.zeros(len(query_idx), dtype=bool)
+        at = np.zeros(len(query_idx), dtype=np.int64)
+        known = np.flatnonzero((query_idx >= 0) & (doc_idx >= 0) & (doc_idx < self.num_judged_docs))
+        if len(self.keys) and len(known):
+            keys = query_idx[known] * self.num_docs + doc_idx[known]
+            pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+            hit = self.keys[pos] == keys
+            found[known[hit]] = True
+            at[known[hit]] = pos[hit]
+        return found, at
+
+    def judged(self, query_idx: np.ndarray, doc_idx: np.ndarray) -> np.ndarray:
+        """Whether every pair is in the qrels, at any grade."""
+        return self.lookup(query_idx, doc_idx)[0]
+
+    def relevant(self, query_idx: np.ndarray, doc_idx: np.ndarray) -> np.ndarray:
+        """Whether every pair is in the qrels with a grade > 0."""
+        return self.grade(query_idx, doc_idx) > 0
+
+    def grade(self, query_idx: np.ndarray, doc_idx: np.ndarray, default: int = 0) -> np.ndarray:
+        """The grade of every pair, or default for pairs that are not judged."""
+        found, at = self.lookup(query_idx, doc_idx)
+        grades = np.full(len(found), default, dtype=self.grades.dtype)
+        grades[found] = self.grades[at[found]]
+        return grades
+
+    def lookup_ids(self, query_ids: List[str], doc_ids: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Indices of other ID tables' IDs in the index's tables, -1 for IDs the qrels do not have."""
+        return self.queries.lookup(query_ids), self.docs.lookup(doc_ids)
+
+    def relevant_docs(self, query_id: str) -> List[str]:
+        """The paragraphs of a query with a grade > 0, in the order of the qrel file."""
+        q = self.queries.lookup([query_id])[0]
+        rows = np.flatnonzero((self.qrels.query_idx == q) & (self.qrels.relevance > 0)) if q >= 0 else []
+        doc_ids = self.docs.ids
+        return [doc_ids[d] for d in self.qrels.doc_idx[rows].tolist()]
+
+
+def main():
+    parser = argparse.ArgumentParser("Summarize the relevance grades of a qrel file.")
+    parser.add_argument("--qrel", help="Path to the ground truth (qrel) file.", required=True)
+    args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
+    index = QrelIndex.from_file(args.qrel)
+    print("Queries: {}".format(index.num_queries))
+    print("Judged pairs: {}".format(len(index)))
+    grades, counts = np.unique(index.grades, return_counts=True)
+    for grade, count in zip(grades.tolist(), counts.tolist()):
+        print("Grade {}: {}".format(grade, count))
+    print("Relevant per query: {:.2f}".format(float(index.num_rel.sum()) / max(index.num_queries, 1)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,42 +1,305 @@
 #!/usr/bin/env python
-"""This script runs the RankLib JAR with Coordinate Ascent, optimized for Mean Average Precision."""
+"""This script runs the RankLib JAR: Coordinate Ascent (or another of its rankers), optimized for a metric."""
 import argparse
 
 __author__ = "Shubham Chatterjee"
 __version__ = "4/14/20"
 
+import asyncio
+import signal
 import subprocess as sp
 import os
 import sys
+import time
+from typing import Callable, Dict, List, Optional
+import instrumentation
 
 
-def run(rlib_path, feature_file, model_file, metric):
-    if not os.path.exists(feature_file):
-        print("Feature file does not exist.")
-        sys.exit(-1)
+# RankLib's -ranker numbers.
+RANKERS: Dict[str, str] = {"0": "MART", "1": "RankNet", "2": "RankBoost", "3": "AdaRank", "4": "Coordinate Ascent",
+                           "6": "LambdaMART", "7": "ListNet", "8": "Random Forests", "9": "Linear Regression"}
 
-    rlib_command = 'java -jar {} -train {} -ranker 4 -metric2t {} -save {}'.format(rlib_path, feature_file,
-                                                                                   metric, model_file)
-    process = sp.Popen(rlib_command.split(), stdout=sp.PIPE)
-    for line in process.stdout:
-        sys.stdout.write(line.decode('utf-8'))
-    exitcode = process.wait()
-    if exitcode == 0:
-        print("Sub process exited gracefully")
-    else:
-        print("RankLib process did not exit gracefully, exiting the program")
-        sys.exit(-1)
+# Rankers whose model is a weight per feature, in the format combine.get_weights() reads.
+LINEAR_RANKERS = ["4"]
+
+# Bytes of a job's stdout or stderr copied to its log at a time.
+PUMP_BYTES: int = 1 << 16
+
+# Seconds a job that is stopped (timed out, or killed after another failed) gets to exit before it is killed.
+KILL_GRACE: float = 5.0
+
+
+class RankLibError(Exception):
+    """Raised when one or more RankLib training jobs fail; results holds the result of every job."""
+
+    def __init__(self, message: str, results: Optional[List['JobResult']] = None):
+        super().__init__(message)
+        self.results = results or []
+
+
+class TrainJob:
+    """
+    One RankLib training run: a feature file in, a model file out, the JVM's output to a log file.
+    :param log_file: None to copy the output to this process's stdout
+    :param metric: metric to optimize for; None for the one train_all() is given
+    """
+
+    def __init__(self, name: str, feature_file: str, model_file: str, log_file: Optional[str], ranker: str = "4",
+                 metric: Optional[str] = None):
+        self.name = name
+        self.feature_file = feature_file
+        self.model_file = model_file
+        self.log_file = log_file
+        self.ranker = ranker
+        self.metric = metric
+
+
+def _java(heap: Optional[str] = None) -> List[str]:
+    return ['java'] + (['-Xmx' + heap] if heap else [])
+
+
+def ranklib_command(rlib_path: str, feature_file: str, model_file: str, metric: str,
+                    heap: Optional[str] = None, ranker: str = "4") -> List[str]:
+    return _java(heap) + ['-jar', rlib_path, '-train', feature_file, '-ranker', str(ranker), '-metric2t', metric,
+                          '-save', model_file]
+
+
+def score_command(rlib_path: str, model_file: str, feature_file: str, score_file: str,
+                  heap: Optional[str] = None) -> List[str]:
+    return _java(heap) + ['-jar', rlib_path, '-load', model_file, '-rank', feature_file, '-score', score_file]
+
+
+def score(rlib_path: str, model_file: str, feature_file: str, score_file: str, log_file: str,
+          heap: Optional[str] = None):
+    """
+    Score a feature file with a saved model of any ranker; the score file has a "qid<TAB>row<TAB>score" line for
+    every line of the feature file, in the same order.
+    :raise RankLibError: if RankLib failed
+    """
+    with instrumentation.stage("ranklib_score"):
+        with open(log_file, 'w') as log:
+            exitcode = sp.call(score_command(rlib_path, model_file, feature_file, score_file, heap),
+                               stdout=log, stderr=sp.STDOUT)
+    if exitcode != 0:
+        raise RankLibError("RankLib scoring of {} failed: exit code {}, see {}".format(feature_file, exitcode,
+                                                                                     log_file))
+
+
+class JobResult:
+    """
+    What became of a TrainJob. status is done, failed (non-zero exit code, or the JVM could not be started),
+    timeout, killed (stopped because another job failed) or skipped (never started for that reason).
+    """
+
+    def __init__(self, job: TrainJob, status: str, exit_code: Optional[int] = None, duration: float = 0.0,
+                 error: Optional[str] = None):
+        self.job = job
+        self.status = status
+        self.exit_code = exit_code
+        self.duration = duration
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.status == "done"
+
+    @property
+    def model_file(self) -> str:
+        return self.job.model_file
+
+    def describe(self) -> str:
+        if self.error:
+            return "{}: {}".format(self.status, self.error)
+        log = self.job.log_file or "the output above"
+        if self.status == "failed":
+            return "failed: exit code {}, see {}".format(self.exit_code, log)
+        if self.status == "timeout":
+            return "timeout: killed after {:.0f} seconds, see {}".format(self.duration, log)
+        return self.status
+
+
+async def _pump(stream: asyncio.StreamReader, out):
+    while True:
+        block = await stream.read(PUMP_BYTES)
+        if not block:
+            return
+        out.write(block)
+        out.flush()
+
+
+def _signal(process, sig):
+    # Every job is started in its own process group (on POSIX), so that its children are stopped with it
+    try:
+        if os.name == "posix":
+            os.killpg(process.pid, sig)
+        elif sig == signal.SIGTERM:
+            process.terminate()
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+
+
+async def _stop(process):
+    """Terminate a process, and kill it if it has not exited after KILL_GRACE seconds."""
+    if process.returncode is None:
+        _signal(process, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(process.wait(), KILL_GRACE)
+            return
+        except asyncio.TimeoutError:
+            pass
+    # Also kills what the process left behind in its group, which may hold its output pipes open
+    _signal(process, signal.SIGKILL if os.name == "posix" else signal.SIGTERM)
+    await process.wait()
+
+
+async def run_job(rlib_path: str, job: TrainJob, metric: Optional[str] = None, heap: Optional[str] = None,
+                  timeout: Optional[float] = None, stop: Optional[asyncio.Event] = None) -> JobResult:
+    """
+    Train one job, with the JVM's stdout and stderr copied to the job's log file as they come.
+    :param timeout: seconds after which the job is stopped
+    :param stop: the job is stopped (or not started) once this is set
+    """
+    if stop is not None and stop.is_set():
+        return JobResult(job, "skipped")
+    if not os.path.exists(job.feature_file):
+        return JobResult(job, "failed", error="feature file {} does not exist".format(job.feature_file))
+    command = ranklib_command(rlib_path, job.feature_file, job.model_file, job.metric or metric, heap, job.ranker)
+    start = time.perf_counter()
+    log = open(job.log_file, 'wb') if job.log_file else None
+    try:
+        try:
+            process = await asyncio.create_subprocess_exec(*command, stdout=sp.PIPE, stderr=sp.PIPE,
+                                                           start_new_session=os.name == "posix")
+        except OSError as e:
+            return JobResult(job, "failed", error="could not start {}: {}".format(command[0], e))
+        out = log if log is not None else sys.stdout.buffer
+        pumps = asyncio.gather(_pump(process.stdout, out), _pump(process.stderr, out))
+        exited = asyncio.ensure_future(process.wait())
+        waiters = [exited] + ([asyncio.ensure_future(stop.wait())] if stop is not None else [])
+        try:
+            await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            await _stop(process)
+            # Neither the output copies nor the wait may outlive the job (or write to its log once it is closed)
+            pumps.cancel()
+            exited.cancel()
+            await asyncio.gather(pumps, exited, return_exceptions=True)
+            raise
+        finally:
+            for waiter in waiters[1:]:
+                waiter.cancel()
+        if exited.done():
+            status = "done" if process.returncode == 0 else "failed"
+        else:
+            status = "killed" if stop is not None and stop.is_set() else "timeout"
+            await _stop(process)
+        duration = time.perf_counter() - start
+        try:
+            await asyncio.wait_for(asyncio.shield(pumps), KILL_GRACE)
+        except asyncio.TimeoutError:
+            # A child the job left running still holds its output pipes open
+            _signal(process, signal.SIGKILL if os.name == "posix" else signal.SIGTERM)
+            await pumps
+        return JobResult(job, status, process.returncode, duration)
+    finally:
+        if log is not None:
+            log.close()
+
+
+async def run_jobs(rlib_path: str, jobs: List[TrainJob], metric: Optional[str] = None, workers: int = 1,
+                   heap: Optional[str] = None, timeout: Optional[float] = None,
+                   on_done: Optional[Callable[[TrainJob], None]] = None, fail_fast: bool = True) -> List[JobResult]:
+    """
+    Run the training jobs, up to workers JVMs at a time (see run_job()).
+    :param on_done: called with every job that finished successfully, as soon as it finishes, one job at a time
+                    and in a worker thread, so that the running jobs' output is still copied meanwhile
+    :param fail_fast: once a job failed or timed out, stop the running jobs and skip the pending ones
+    :return: the result of every job, in the order of jobs
+    """
+    semaphore = asyncio.Semaphore(max(1, workers))
+    stop = asyncio.Event()
+    callbacks = asyncio.Lock()
+    loop = asyncio.get_running_loop()
+
+    async def run_one(job: TrainJob) -> JobResult:
+        async with semaphore:
+            result = await run_job(rlib_path, job, metric, heap, timeout, stop if fail_fast else None)
+        if result.status in ("failed", "timeout") and fail_fast:
+            stop.set()
+        if result.ok and on_done is not None:
+            async with callbacks:
+                try:
+                    await loop.run_in_executor(None, on_done, job)
+                except BaseException:
+                    stop.set()
+                    raise
+        return result
+
+    return list(await asyncio.gather(*[run_one(job) for job in jobs]))
+
+
+def run_all(rlib_path: str, jobs: List[TrainJob], metric: Optional[str] = None, workers: int = 1,
+            heap: Optional[str] = None, timeout: Optional[float] = None,
+            on_done: Optional[Callable[[TrainJob], None]] = None, fail_fast: bool = True) -> List[JobResult]:
+    """run_jobs() for callers that are not coroutines."""
+    return asyncio.run(run_jobs(rlib_path, jobs, metric, workers, heap, timeout, on_done, fail_fast))
+
+
+def run(rlib_path, feature_file, model_file, metric, ranker="4", log_file=None, timeout=None) -> JobResult:
+    """Train one model, with RankLib's output copied to log_file (or to stdout)."""
+    job = TrainJob(os.path.basename(model_file), feature_file, model_file, log_file, ranker, metric)
+    return run_all(rlib_path, [job], timeout=timeout)[0]
+
+
+def train_all(rlib_path: str, jobs: List[TrainJob], metric: str, workers: int = 1, heap: Optional[str] = None,
+              on_done: Optional[Callable[[TrainJob], None]] = None,
+              timeout: Optional[float] = None, fail_fast: bool = True) -> List[JobResult]:
+    """
+    Run the training jobs, up to workers JVMs at a time, each with its output in its own log file. Every job is
+    trained with its own ranker, and its own metric if it has one (metric otherwise).
+    With fail_fast, as soon as one job fails (or runs longer than timeout seconds) the running jobs are killed and
+    the pending ones are not started; otherwise every job runs to its end.
+    :param on_done: called with every job that finished successfully, as soon as it finishes
+    :raise RankLibError: with a per-job summary if any job failed
+    """
+    with instrumentation.stage("ranklib", jobs=len(jobs)):
+        instrumentation.count("bytes_read", sum(instrumentation.file_size(job.feature_file) for job in jobs))
+        results = run_all(rlib_path, jobs, metric, workers, heap, timeout, on_done, fail_fast)
+        for result in results:
+            instrumentation.count(result.status)
+
+    if not all(result.ok for result in results):
+        raise RankLibError("RankLib training failed:\n" +
+                           "\n".join("  {}: {}".format(r.job.name, r.describe()) for r in results), results)
+    return results
 
 
 def main():
-    parser = argparse.ArgumentParser("Run RankLib with Coordinate Ascent, optimized for Mean Average Precision.")
+    parser = argparse.ArgumentParser("Run RankLib with Coordinate Ascent (or another ranker), optimized for a metric.")
     parser.add_argument("--jar", help="Path to the RankLib JAR file.", required=True)
     parser.add_argument("--feature", help="Path to the RankLib compatible feature file (training data).", required=True)
     parser.add_argument("--model", help="Path to the model file.", required=True)
     parser.add_argument("--metric", help="Metric to optimize for (MAP|NDCG@k|DCG@k|P@k|RR@k|ERR@k)", required=True)
+    parser.add_argument("--ranker", help="RankLib ranker ({}). Defaults to 4.".format(
+        ", ".join("{}: {}".format(r, name) for r, name in RANKERS.items())), choices=list(RANKERS), default="4")
+    parser.add_argument("--log", help="Path to a file to write RankLib's output to. Defaults to the console.")
+    parser.add_argument("--timeout", help="Seconds after which RankLib is killed. Defaults to no limit.")
+    instrumentation.add_arguments(parser)
     args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
-    run(args.jar, args.feature, args.model, args.metric)
+    instrumentation.configure_from_args(args)
+    with instrumentation.stage("ranklib", jobs=1):
+        instrumentation.count("bytes_read", instrumentation.file_size(args.feature))
+        result = run(args.jar, args.feature, args.model, args.metric, args.ranker, args.log,
+                     float(args.timeout) if args.timeout else None)
+        instrumentation.count(result.status)
+    instrumentation.finish()
+    if not result.ok:
+        print("RankLib did not finish: " + result.describe())
+        sys.exit(-1)
+    print("Model written to {} in {:.1f} seconds.".format(result.model_file, result.duration))
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+"""This script reads and writes RankLib (SVMlight style) feature files, and converts them to and from a binary format."""
+
+__author__ = "Shubham Chatterjee"
+__version__ = "10/18/26"
+
+from typing import List, Tuple
+import argparse
+import json
+import mmap
+import os
+import sys
+from multiprocessing import Pool
+import numpy as np
+import compressed_io
+from feature_matrix import FeatureMatrix
+
+# Number of rows formatted and written at a time.
+CHUNK_ROWS: int = 1 << 14
+
+# Size of the write buffer of the feature file.
+BUFFER_SIZE: int = 1 << 22
+
+# First bytes of a binary feature file, followed by the length of its JSON header as 8 little-endian bytes.
+BINARY_MAGIC = b"RLIBFEAT"
+
+# Bumped whenever the layout of a binary feature file changes.
+BINARY_VERSION = 1
+
+# Sections of a binary feature file start at multiples of this many bytes.
+BINARY_ALIGN = 64
+
+# Text feature files smaller than this are parsed in one process even when more workers are asked for.
+PARALLEL_MIN_BYTES: int = 1 << 24
+
+
+def write_feature_file(out_fet_file: str, matrix: FeatureMatrix, labels: np.ndarray, sparse: bool = False,
+                       chunk_rows: int = CHUNK_ROWS) -> int:
+    """
+    Stream a feature matrix to a RankLib feature file, formatting chunk_rows lines at a time.
+
+    Line i is "<labels[i]> qid:<k> 1:<v> 2:<v> ... #<query>_<paragraph>", with the k-th query of the
+    matrix numbered k (from 1). Values are written with str(), like the old line builder did.
+    :param sparse: leave out features whose value is 0, which RankLib reads as 0 anyway
+    :return: the number of lines written
+    """
+    values = matrix.values
+    num_rows = len(matrix)
+    fet_names = [str(fet) + ":" for fet in range(1, matrix.num_features + 1)]
+    counts = np.diff(matrix.offsets)
+    row_qid = np.repeat(np.arange(1, len(counts) + 1), counts)
+    row_query = np.asarray(matrix.queries.ids, dtype=object)[np.repeat(matrix.query_list, counts)]
+    doc_ids = np.asarray(matrix.docs.ids, dtype=object)
+    labels = np.asarray(labels)
+
+    with compressed_io.open_file(out_fet_file, 'w', buffering=BUFFER_SIZE) as file:
+        for start in range(0, num_rows, chunk_rows):
+            end = min(start + chunk_rows, num_rows)
+            rows = values[start:end].tolist()
+            if sparse:
+                features = [" ".join([name + str(val) for name, val in zip(fet_names, row) if val != 0.0])
+                            for row in rows]
+            else:
+                features = [" ".join(map(str.__add__, fet_names, map(str, row))) for row in rows]
+            lines = ["{} qid:{} {} #{}_{}\n".format(label, qid, fet, query, para) if fet else
+                     "{} qid:{} #{}_{}\n".format(label, qid, query, para)
+                     for label, qid, fet, query, para in zip(labels[start:end].tolist(), row_qid[start:end].tolist(),
+                                                             features, row_query[start:end].tolist(),
+                                                             doc_ids[matrix.cand_doc[start:end]].tolist())]
+            file.write("".join(lines))
+    return num_rows
+
+
+class FeatureData:
+    """
+    The rows of a RankLib feature file. Consecutive rows with the same qid form a query segment; the rows of
+    segment k are offsets[k]:offsets[k + 1] and qids[k] is its qid. Feature f is column f - 1 of values.
+    """
+
+    def __init__(self, values: np.ndarray, labels: np.ndarray, offsets: np.ndarray, qids: List[str],
+                 comments: List[str]):
+        self.values = values
+        self.labels = labels
+        self.offsets = offsets
+        self.qids = qids
+        self.comments = comments
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    @property
+    def num_features(self) -> int:
+        return self.values.shape[1]
+
+
+def read_feature_file(fet_file: str, num_features: int = 0, dtype=None, workers: int = 1) -> FeatureData:
+    """
+    Read a (dense or sparse) RankLib feature file into a dense matrix; missing features are 0. Binary feature
+    files (see write_binary_file()) are recognized by their first bytes and memory-mapped instead.
+    :param num_features: minimum number of columns, e.g. the number of weights of a model
+    :param dtype: type of the values. Defaults to float64 for text files and the stored type for binary files.
+    :param workers: parse a large uncompressed text file in this many processes (see read_text_parallel())
+    """
+    if is_binary_file(fet_file):
+        return read_binary_file(fet_file, num_features, dtype)
+    dtype = np.float64 if dtype is None else dtype
+    if workers > 1 and not compressed_io.compression_of(fet_file) and \
+            os.path.getsize(fet_file) >= PARALLEL_MIN_BYTES:
+        return read_text_parallel(fet_file, workers, num_features, dtype)
+    batches: List[_Batch] = []
+    num_rows = 0
+    with compressed_io.open_file(fet_file, 'r', buffering=BUFFER_SIZE) as f:
+        while True:
+            lines = f.readlines(BUFFER_SIZE)
+            if not lines:
+                break
+            batches.append(_parse_batch(lines, num_rows, fet_file))
+            num_rows += len(batches[-1].labels)
+    return _to_feature_data(batches, num_rows, num_features, dtype)
+
+
+def parse_feature_lines(lines: List[str], num_features: int = 0, dtype=np.float64, source: str = "") -> FeatureData:
+    """Like read_feature_file(), for lines already in memory (e.g. one group of queries of a larger file)."""
+    batch = _parse_batch(lines, 0, source)
+    return _to_feature_data([batch], len(batch.labels), num_features, dtype)
+
+
+class _Batch:
+    """The parsed lines of one batch, with the features as (row, fid, value) triplets."""
+
+    def __init__(self, labels: List[str], qids: List[str], comments: List[str], rows: np.ndarray, fids: np.ndarray,
+                 vals: np.ndarray):
+        self.labels = labels
+        self.qids = qids
+        self.comments = comments
+        self.rows = rows
+        self.fids = fids
+        self.vals = vals
+
+
+def _parse_batch(lines: List[str], first_row: int, source: str) -> _Batch:
+    labels: List[str] = []
+    qids: List[str] = []
+    comments: List[str] = []
+    row_features: List[str] = []
+    counts: List[int] = []
+    for line in lines:
+        body, _, comment = line.partition("#")
+        parts = body.split()
+        if not parts:
+            continue
+        labels.append(parts[0])
+        qids.append(parts[1][4:])
+        comments.append(comment.strip())
+        row_features.extend(parts[2:])
+        counts.append(len(parts) - 2)
+    # Parse all "fid:value" tokens of the batch at once
+    tokens = np.fromstring(" ".join(row_features).replace(":", " "), dtype=np.float64, sep=" ")
+    if len(tokens) != 2 * len(row_features):
+        raise ValueError("Malformed feature in {} near line {}".format(source, first_row + 1))
+    rows = np.repeat(np.arange(first_row, first_row + len(counts)), counts)
+    return _Batch(labels, qids, comments, rows, tokens[0::2].astype(np.int64), tokens[1::2])
+
+
+def _to_feature_data(batches: List[_Batch], num_rows: int, num_features: int, dtype) -> FeatureData:
+    row = np.concatenate([b.rows for b in batches]) if batches else np.empty(0, dtype=np.int64)
+    fid = np.concatenate([b.fids for b in batches]) if batches else np.empty(0, dtype=np.int64)
+    val = np.concatenate([b.vals for b in batches]) if batches else np.empty(0, dtype=np.float64)
+    width = max(num_features, int(fid.max()) if len(fid) else 0)
+    values = np.zeros((num_rows, width), dtype=dtype)
+    values[row, fid - 1] = val
+
+    qid_array = np.array([qid for b in batches for qid in b.qids], dtype=object)
+    starts = np.flatnonzero(np.concatenate(([True], qid_array[1:] != qid_array[:-1]))) if num_rows else \
+        np.empty(0, dtype=np.int64)
+    offsets = np.append(starts, num_rows).astype(np.int64)
+    labels = np.array([label for b in batches for label in b.labels], dtype=np.float64)
+    return FeatureData(values, labels, offsets, qid_array[starts].tolist(), [c for b in batches for c in b.comments])
+
+
+def concat_feature_data(parts: List[FeatureData]) -> FeatureData:
+    """
+    The rows of several feature files one after the other, as if the files had been concatenated (each file keeps
+    its own query segments). Features missing from a part are 0.
+    """
+    width = max([part.num_features for part in parts] + [0])
+    values = np.zeros((sum(len(part) for part in parts), width), dtype=parts[0].values.dtype if parts else np.float64)
+    offsets = [np.zeros(1, dtype=np.int64)]
+    start = 0
+    for part in parts:
+        values[start:start + len(part), :part.num_features] = part.values
+        offsets.append(part.offsets[1:] + start)
+        start += len(part)
+    return FeatureData(values, np.concatenate([part.labels for part in parts]) if parts else np.empty(0),
+                       np.concatenate(offsets), [qid for part in parts for qid in part.qids],
+                       [comment for part in parts for comment in part.comments])
+
+
+def _text_ranges(fet_file: str, parts: int) -> List[Tuple[int, int]]:
+    """About equal byte ranges of a text file that start and end at line boundaries."""
+    size = os.path.getsize(fet_file)
+    bounds = [0]
+    with open(fet_file, 'rb') as f:
+        for i in range(1, parts):
+            at = max(size * i // parts, bounds[-1])
+            if at <= 0:
+                continue
+            # Move to the start of the first line at or after the cut
+            f.seek(at - 1)
+            f.readline()
+            bounds.append(min(f.tell(), size))
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def _parse_range(fet_file: str, start: int, end: int) -> _Batch:
+    with open(fet_file, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode("utf-8")
+    return _parse_batch(text.split("\n"), 0, "{} (bytes {}-{})".format(fet_file, start, end))
+
+
+def read_text_parallel(fet_file: str, workers: int, num_features: int = 0, dtype=np.float64) -> FeatureData:
+    """
+    Parse an uncompressed text feature file in workers processes: the file is cut at line boundaries into a few
+    ranges per worker, every range is parsed on its own, and the parsed ranges are put back together in order.
+    """
+    ranges = _text_ranges(fet_file, 2 * workers)
+    with Pool(min(workers, max(len(ranges), 1))) as pool:
+        batches = pool.starmap(_parse_range, [(fet_file, start, end) for start, end in ranges])
+    num_rows = 0
+    for batch in batches:
+        batch.rows += num_rows
+        num_rows += len(batch.labels)
+    return _to_feature_data(batches, num_rows, num_features, dtype)
+
+
+def matrix_feature_data(matrix: FeatureMatrix, labels: np.ndarray) -> FeatureData:
+    """A labelled feature matrix as the rows write_feature_file() would write for it."""
+    counts = np.diff(matrix.offsets)
+    row_query = np.asarray(matrix.queries.ids, dtype=object)[np.repeat(matrix.query_list, counts)]
+    doc_ids = np.asarray(matrix.docs.ids, dtype=object)[matrix.cand_doc]
+    comments = [query + "_" + para for query, para in zip(row_query.tolist(), doc_ids.tolist())]
+    return FeatureData(matrix.values, np.asarray(labels, dtype=np.float64), matrix.offsets,
+                       [str(k) for k in range(1, len(counts) + 1)], comments)
+
+
+def is_binary_file(fet_file: str) -> bool:
+    """Whether a feature file is in the binary format (compressed files never are)."""
+    if compressed_io.compression_of(fet_file) or not os.path.isfile(fet_file):
+        return False
+    with open(fet_file, 'rb') as f:
+        return f.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+
+def _string_table(strings: List[str]) -> bytes:
+    # IDs and comments come from single lines of text, so they never hold a newline
+    return "".join(s + "\n" for s in strings).encode("utf-8")
+
+
+def _aligned(size: int) -> int:
+    return -(-size // BINARY_ALIGN) * BINARY_ALIGN
+
+
+def write_binary_file(out_fet_file: str, data: FeatureData, dtype=np.float32) -> int:
+    """
+    Write feature data in the binary format: a JSON header (rows, features, queries, value type and the place
+    of every section) after BINARY_MAGIC, then the sections, each aligned to BINARY_ALIGN bytes:
+    values (rows x features, column-major, of dtype), labels (float64), offsets of the query segments (int64),
+    and the qids and the comments ("<query>_<paragraph>") as newline separated UTF-8 text.
+    The file is read by memory-mapping it (see read_binary_file()), so it cannot be compressed.
+    :return: the number of rows written
+    """
+    if compressed_io.compression_of(out_fet_file):
+        raise ValueError("Binary feature files are memory-mapped and cannot be compressed: " + out_fet_file)
+    dtype = np.dtype(dtype)
+    num_rows, num_features = len(data), data.num_features
+    labels = np.ascontiguousarray(data.labels, dtype="<f8").tobytes()
+    offsets = np.ascontiguousarray(data.offsets, dtype="<i8").tobytes()
+    qids = _string_table(data.qids)
+    comments = _string_table(data.comments)
+    blobs = {"labels": labels, "offsets": offsets, "qids": qids, "comments": comments}
+    sizes = [("values", num_rows * num_features * dtype.itemsize)] + [(name, len(blob)) for name, blob in blobs.items()]
+    sections = {}
+    at = 0
+    for name, size in sizes:
+        sections[name] = [at, size]
+        at += _aligned(size)
+    header = json.dumps({"version": BINARY_VERSION, "rows": num_rows, "features": num_features,
+                         "queries": len(data.qids), "dtype": dtype.newbyteorder("<").str,
+                         "sections": sections}).encode("utf-8")
+    start = _aligned(len(BINARY_MAGIC) + 8 + len(header))
+    header += b" " * (start - len(BINARY_MAGIC) - 8 - len(header))
+
+    with open(out_fet_file, 'wb', buffering=BUFFER_SIZE) as f:
+        f.write(BINARY_MAGIC + len(header).to_bytes(8, "little") + header)
+        for name, size in sizes:
+            if name == "values":
+                # One column at a time, so that no converted copy of the whole matrix is made
+                for j in range(num_features):
+                    f.write(np.ascontiguousarray(data.values[:, j], dtype=dtype.newbyteorder("<")).tobytes())
+            else:
+                f.write(blobs[name])
+            f.write(b"\0" * (_aligned(size) - size))
+    return num_rows
+
+
+def read_binary_file(fet_file: str, num_features: int = 0, dtype=None) -> FeatureData:
+    """
+    Memory-map a binary feature file. The values are a read-only view of the file, paged in as they are used,
+    unless a wider matrix (num_features) or another dtype is asked for, which makes a copy.
+    """
+    with open(fet_file, 'rb') as f:
+        if f.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            raise ValueError("{} is not a binary feature file.".format(fet_file))
+        header_size = int.from_bytes(f.read(8), "little")
+        header = json.loads(f.read(header_size).decode("utf-8"))
+        if header.get("version") != BINARY_VERSION:
+            raise ValueError("Unsupported binary feature file version: {}".format(header.get("version")))
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    start = len(BINARY_MAGIC) + 8 + header_size
+    sections = {name: (start + at, size) for name, (at, size) in header["sections"].items()}
+    num_rows, width = header["rows"], header["features"]
+
+    def array(name: str, array_dtype) -> np.ndarray:
+        at, size = sections[name]
+        return np.frombuffer(buf, dtype=array_dtype, count=size // np.dtype(array_dtype).itemsize, offset=at)
+
+    def strings(name: str) -> List[str]:
+        at, size = sections[name]
+        return buf[at:at + size].decode("utf-8").split("\n")[:-1]
+
+    values = array("values", header["dtype"]).reshape((num_rows, width), order='F')
+    dtype = values.dtype if dtype is None else np.dtype(dtype)
+    if num_features > width or dtype != values.dtype:
+        wide = np.zeros((num_rows, max(num_features, width)), dtype=dtype, order='F')
+        wide[:, :width] = values
+        values = wide
+    return FeatureData(values, array("labels", "<f8"), array("offsets", "<i8"), strings("qids"),
+                       strings("comments"))
+
+
+def write_text_file(out_fet_file: str, data: FeatureData, sparse: bool = False, chunk_rows: int = CHUNK_ROWS) -> int:
+    """
+    Write feature data as a RankLib text feature file, in the same line format as write_feature_file(). Whole
+    number labels are written without a decimal point.
+    :return: the number of lines written
+    """
+    num_rows = len(data)
+    fet_names = [str(fet) + ":" for fet in range(1, data.num_features + 1)]
+    row_qid = np.repeat(np.asarray(data.qids, dtype=object), np.diff(data.offsets))
+    labels = np.asarray(data.labels)
+    if np.all(labels == np.round(labels)):
+        labels = labels.astype(np.int64)
+
+    with compressed_io.open_file(out_fet_file, 'w', buffering=BUFFER_SIZE) as file:
+        for start in range(0, num_rows, chunk_rows):
+            end = min(start + chunk_rows, num_rows)
+            rows = np.asarray(data.values[start:end], dtype=np.float64).tolist()
+            if sparse:
+                features = [" ".join([name + str(val) for name, val in zip(fet_names, row) if val != 0.0])
+                            for row in rows]
+            else:
+                features = [" ".join(map(str.__add__, fet_names, map(str, row))) for row in rows]
+            lines = ["{} qid:{} {} #{}\n".format(label, qid, fet, comment) if fet else
+                     "{} qid:{} #{}\n".format(label, qid, comment)
+                     for label, qid, fet, comment in zip(labels[start:end].tolist(), row_qid[start:end].tolist(),
+                                                         features, data.comments[start:end])]
+            file.write("".join(lines))
+    return num_rows
+
+
+def main():
+    parser = argparse.ArgumentParser("Convert a RankLib text feature file to the binary format, or back.")
+    parser.add_argument("--input", help="Path to the feature file to convert (its format is recognized).",
+                        required=True)
+    parser.add_argument("--output", help="Path to the converted feature file.", required=True)
+    parser.add_argument("--dtype", help="Type of the values of a binary file: float32 (half the size) or float64 "
+                                        "(exact). Defaults to float32.", choices=["float32", "float64"],
+                        default="float32")
+    parser.add_argument("--sparse", help="Leave out features with value 0 when writing a text file.",
+                        action="store_true")
+    parser.add_argument("--workers", help="Number of processes parsing a text file. Defaults to 1.", default=1)
+    args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
+    if is_binary_file(args.input):
+        num_rows = write_text_file(args.output, read_binary_file(args.input), args.sparse)
+        print("Wrote {} rows as text to: {}".format(num_rows, args.output))
+    else:
+        data = read_feature_file(args.input, workers=int(args.workers))
+        num_rows = write_binary_file(args.output, data, np.dtype(args.dtype))
+        print("Wrote {} rows as binary ({}) to: {}".format(num_rows, args.dtype, args.output))
+
+
+if __name__ == '__main__':
+    main()
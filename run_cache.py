@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+"""This script keeps a binary on-disk cache of parsed TREC-CAR run and qrel files."""
+
+__author__ = "Shubham Chatterjee"
+__version__ = "10/18/26"
+
+from typing import Dict, List, Optional, Tuple
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+
+# Environment variables that configure the default cache, so that worker processes pick it up too.
+ENV_DIR = "RUN_CACHE_DIR"
+ENV_BUDGET = "RUN_CACHE_BUDGET"
+ENV_MODE = "RUN_CACHE_MODE"
+ENV_VERIFY = "RUN_CACHE_VERIFY"
+
+# off: never cache; use: load cached entries and store missing ones; rebuild: parse again and replace entries.
+MODES = ["off", "use", "rebuild"]
+
+# stat: an entry is valid while the file keeps its size and mtime; hash: also accept a file whose size and
+# mtime changed (e.g. a copy or a touch) if its content hash is still the same.
+VERIFY = ["stat", "hash"]
+
+DEFAULT_BUDGET: int = 10 << 30
+
+# Bumped whenever the layout of an entry changes; entries of other versions are rebuilt.
+FORMAT_VERSION = 1
+
+META_FILE = "meta.json"
+HASH_BLOCK: int = 1 << 22
+
+
+def parse_size(size: str) -> int:
+    """Parse a size such as 512m, 10g or 1048576 into bytes."""
+    size = str(size).strip().lower()
+    units = {"k": 1 << 10, "m": 1 << 20, "g": 1 << 30, "t": 1 << 40}
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def file_hash(file_path: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class Entry:
+    """A cached file: its ID lists (in first-appearance order) and its arrays, memory-mapped read-only."""
+
+    def __init__(self, ids: Dict[str, List[str]], arrays: Dict[str, np.ndarray]):
+        self.ids = ids
+        self.arrays = arrays
+
+
+class RunCache:
+    """
+    Parsed files stored as one directory per (file, kind) under cache_dir: a meta.json with the size, mtime and
+    content hash of the source file, one text file of IDs per ID table and one .npy file per column. Entries are
+    evicted least recently used first once the cache is larger than budget bytes.
+    """
+
+    def __init__(self, cache_dir: str, budget: int = DEFAULT_BUDGET, mode: str = "use", verify: str = "stat"):
+        if mode not in MODES:
+            raise ValueError("Unknown cache mode '{}'. Choose from: {}".format(mode, ", ".join(MODES)))
+        if verify not in VERIFY:
+            raise ValueError("Unknown cache check '{}'. Choose from: {}".format(verify, ", ".join(VERIFY)))
+        self.cache_dir = cache_dir
+        self.budget = budget
+        self.mode = mode
+        self.verify = verify
+
+    def entry_dir(self, file_path: str, kind: str) -> str:
+        key = hashlib.sha1((kind + "\0" + os.path.abspath(file_path)).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, file_path: str, kind: str) -> Optional[Entry]:
+        """The cached entry of a file, or None if there is none or the file changed since it was stored."""
+        if self.mode != "use":
+            return None
+        entry_dir = self.entry_dir(file_path, kind)
+        meta_path = os.path.join(entry_dir, META_FILE)
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            st = os.stat(file_path)
+        except (OSError, ValueError):
+            return None
+        if meta.get("version") != FORMAT_VERSION or meta.get("kind") != kind:
+            return None
+        if (meta["size"], meta["mtime_ns"]) != (st.st_size, st.st_mtime_ns):
+            if self.verify != "hash" or meta["size"] != st.st_size or meta["hash"] != file_hash(file_path):
+                return None
+            meta["mtime_ns"] = st.st_mtime_ns
+            self._write_meta(entry_dir, meta)
+        try:
+            ids = {}
+            for name in meta["ids"]:
+                with open(os.path.join(entry_dir, name + ".txt"), 'r') as f:
+                    text = f.read()
+                ids[name] = text.split("\n") if text else []
+            arrays = {name: np.load(os.path.join(entry_dir, name + ".npy"), mmap_mode='r')
+                      for name in meta["arrays"]}
+        except (OSError, ValueError):
+            return None
+        # The mtime of meta.json is the last use of the entry
+        os.utime(meta_path)
+        return Entry(ids, arrays)
+
+    def put(self, file_path: str, kind: str, ids: Dict[str, List[str]], arrays: Dict[str, np.ndarray]):
+        """Store a parsed file. The entry is written to a temporary directory and renamed into place."""
+        if self.mode == "off":
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        st = os.stat(file_path)
+        meta = {"version": FORMAT_VERSION, "kind": kind, "path": os.path.abspath(file_path), "size": st.st_size,
+                "mtime_ns": st.st_mtime_ns, "hash": file_hash(file_path), "ids": list(ids), "arrays": list(arrays)}
+        tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=self.cache_dir)
+        try:
+            for name, values in ids.items():
+                with open(os.path.join(tmp_dir, name + ".txt"), 'w') as f:
+                    f.write("\n".join(values))
+            for name, values in arrays.items():
+                np.save(os.path.join(tmp_dir, name + ".npy"), np.ascontiguousarray(values))
+            self._write_meta(tmp_dir, meta)
+            entry_dir = self.entry_dir(file_path, kind)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            try:
+                os.rename(tmp_dir, entry_dir)
+            except OSError:
+                # Another process stored the same file at the same time; keep its entry
+                pass
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict()
+
+    @staticmethod
+    def _write_meta(entry_dir: str, meta: dict):
+        with open(os.path.join(entry_dir, META_FILE), 'w') as f:
+            json.dump(meta, f)
+
+    def entries(self) -> List[Tuple[float, int, str]]:
+        """(last use, size in bytes, directory) of every entry, least recently used first."""
+        out = []
+        if not os.path.isdir(self.cache_dir):
+            return out
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            meta_path = os.path.join(entry_dir, META_FILE)
+            if name.startswith(".") or not os.path.isfile(meta_path):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry_dir, f)) for f in os.listdir(entry_dir))
+            out.append((os.path.getmtime(meta_path), size, entry_dir))
+        return sorted(out)
+
+    def evict(self) -> int:
+        """Remove least recently used entries until the cache fits its budget. :return: bytes freed"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        freed = 0
+        for _, size, entry_dir in entries:
+            if total - freed <= self.budget:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            freed += size
+        return freed
+
+    def clear(self):
+        for _, _, entry_dir in self.entries():
+            shutil.rmtree(entry_dir, ignore_errors=True)
+
+
+def default_cache() -> Optional[RunCache]:
+    """The cache configured through the environment (see configure()), or None if caching is off."""
+    cache_dir = os.environ.get(ENV_DIR)
+    mode = os.environ.get(ENV_MODE, "use")
+    if not cache_dir or mode == "off":
+        return None
+    return RunCache(cache_dir, parse_size(os.environ.get(ENV_BUDGET, DEFAULT_BUDGET)), mode,
+                    os.environ.get(ENV_VERIFY, "stat"))
+
+
+def configure(cache_dir: Optional[str] = None, budget: Optional[str] = None, mode: Optional[str] = None,
+              verify: Optional[str] = None):
+    """Set up the default cache. It is kept in the environment so that child processes use the same cache."""
+    for var, value in ((ENV_DIR, cache_dir), (ENV_BUDGET, budget), (ENV_MODE, mode), (ENV_VERIFY, verify)):
+        if value is not None:
+            os.environ[var] = str(value)
+    # Fail on bad settings now rather than in the first worker that loads a file
+    default_cache()
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """The cache options shared by the scripts that read run files."""
+    parser.add_argument("--cache-dir", help="Directory of the parsed run file cache. Defaults to ${}; without "
+                                            "either, files are not cached.".format(ENV_DIR))
+    parser.add_argument("--cache-budget", help="Disk budget of the cache, e.g. 10g. Defaults to 10g.")
+    parser.add_argument("--no-cache", help="Do not use the cache.", action="store_true")
+    parser.add_argument("--rebuild-cache", help="Parse all files again and replace their cache entries.",
+                        action="store_true")
+
+
+def configure_from_args(args: argparse.Namespace):
+    mode = "off" if args.no_cache else "rebuild" if args.rebuild_cache else None
+    configure(args.cache_dir, args.cache_budget, mode)
+
+
+def main():
+    parser = argparse.ArgumentParser("Inspect, fill or clear the parsed run file cache.")
+    parser.add_argument("--cache-dir", help="Directory of the cache.", required=True)
+    parser.add_argument("--warm", help="Parse and cache every run file in this directory.")
+    parser.add_argument("--qrels", help="Parse and cache this qrel file.")
+    parser.add_argument("--budget", help="Disk budget of the cache, e.g. 10g. Defaults to 10g.", default="10g")
+    parser.add_argument("--clear", help="Remove every entry.", action="store_true")
+    args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
+
+    cache = RunCache(args.cache_dir, parse_size(args.budget))
+    if args.clear:
+        cache.clear()
+        print("Cache cleared.")
+    if args.warm or args.qrels:
+        import run_loader
+        configure(args.cache_dir, args.budget, "use")
+        start = time.perf_counter()
+        if args.warm:
+            run_loader.read_runs(args.warm)
+        if args.qrels:
+            run_loader.read_qrels(args.qrels)
+        print("Cached in {:.1f} seconds.".format(time.perf_counter() - start))
+    entries = cache.entries()
+    print("Entries: {}".format(len(entries)))
+    print("Size: {:.1f} MB (budget {:.1f} MB)".format(sum(s for _, s, _ in entries) / 2 ** 20, cache.budget / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+"""This script loads TREC-CAR run and qrel files into compact columnar tables with interned IDs."""
+
+__author__ = "Shubham Chatterjee"
+__version__ = "10/18/26"
+
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import argparse
+import gc
+import itertools
+import operator
+import os
+import sys
+import numpy as np
+import compressed_io
+import run_cache
+
+# Number of bytes of text handed to one readlines() batch while parsing.
+CHUNK_SIZE: int = 1 << 22
+
+# ASCII characters str.split() splits on besides spaces, tabs and line ends.
+OTHER_WHITESPACE = "\x0b\x0c\x1c\x1d\x1e\x1f"
+
+
+class IdTable:
+    """
+    Interns string IDs (queries, paragraphs) to dense integer indices, in order of first appearance.
+    One table can be shared by many files so that the same ID always gets the same index.
+    """
+
+    def __init__(self, ids: Optional[Iterable[str]] = None):
+        self.index: Dict[str, int] = {}
+        self._ids: List[str] = []
+        if ids is not None:
+            self.intern_all(ids)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, _id: str) -> bool:
+        return _id in self.index
+
+    def __getitem__(self, i: int) -> str:
+        return self.ids[i]
+
+    @property
+    def ids(self) -> List[str]:
+        """The interned IDs; ids[i] is the ID with index i."""
+        if len(self._ids) != len(self.index):
+            self._ids = list(self.index)
+        return self._ids
+
+    def intern(self, _id: str) -> int:
+        return self.index.setdefault(_id, len(self.index))
+
+    def intern_all(self, ids: Iterable[str]) -> np.ndarray:
+        index = self.index
+        setdefault = index.setdefault
+        return np.array([setdefault(_id, len(index)) for _id in ids], dtype=np.int32)
+
+    def intern_grouped(self, ids: List[str]) -> np.ndarray:
+        """
+        Like intern_all(), for columns where equal IDs come in long consecutive runs (the query
+        column of a run file): only the first ID of every run is interned.
+        """
+        if len(ids) < 2:
+            return self.intern_all(ids)
+        changed = np.fromiter(map(operator.ne, ids[1:], ids[:-1]), dtype=bool, count=len(ids) - 1)
+        starts = np.concatenate(([0], np.flatnonzero(changed) + 1))
+        lengths = np.diff(np.append(starts, len(ids)))
+        return np.repeat(self.intern_all([ids[i] for i in starts.tolist()]), lengths)
+
+    def lookup(self, ids: Iterable[str]) -> np.ndarray:
+        """Indices of the given IDs without interning them; unknown IDs map to -1."""
+        get = self.index.get
+        return np.array([get(_id, -1) for _id in ids], dtype=np.int32)
+
+
+class Table:
+    """(query, paragraph) pairs of a TREC file, stored as index arrays into shared ID tables."""
+
+    def __init__(self, queries: IdTable, docs: IdTable, query_idx: np.ndarray, doc_idx: np.ndarray, name: str = ""):
+        self.queries = queries
+        self.docs = docs
+        self.query_idx = query_idx
+        self.doc_idx = doc_idx
+        self.name = name
+
+    def __len__(self) -> int:
+        return len(self.query_idx)
+
+    def query_order(self) -> np.ndarray:
+        """Query indices present in this table, in order of first appearance in the file."""
+        uniq, first = np.unique(self.query_idx, return_index=True)
+        return uniq[np.argsort(first, kind="stable")]
+
+    def group_by_query(self):
+        """
+        Row permutation that groups the rows by query (file order is kept inside a query) and
+        the [start, end) offsets of every query segment in that permutation.
+        :return: (order, query indices in first-appearance order, segment starts, segment ends)
+        """
+        queries = self.query_order()
+        # Re-key each row by the rank of its query's first appearance so that a stable sort
+        # yields the segments in first-appearance order.
+        rank_of = np.empty(len(self.queries), dtype=np.int32)
+        rank_of[queries] = np.arange(len(queries), dtype=np.int32)
+        keys = rank_of[self.query_idx]
+        order = np.argsort(keys, kind="stable")
+        counts = np.bincount(keys, minlength=len(queries))
+        ends = np.cumsum(counts)
+        starts = ends - counts
+        return order, queries, starts, ends
+
+    def rankings(self) -> Dict[str, List[str]]:
+        """The legacy {query: [paragraph, ...]} view, in file order."""
+        order, queries, starts, ends = self.group_by_query()
+        doc_ids = np.asarray(self.docs.ids, dtype=object)[self.doc_idx[order]]
+        query_ids = self.queries.ids
+        return {query_ids[q]: doc_ids[s:e].tolist() for q, s, e in zip(queries.tolist(), starts, ends)}
+
+
+class RunTable(Table):
+    """A run file: query, paragraph, rank and score columns."""
+
+    def __init__(self, queries: IdTable, docs: IdTable, query_idx: np.ndarray, doc_idx: np.ndarray,
+                 rank: np.ndarray, score: np.ndarray, name: str = ""):
+        super().__init__(queries, docs, query_idx, doc_idx, name)
+        self.rank = rank
+        self.score = score
+
+    def scores(self) -> Dict[str, Dict[str, float]]:
+        """The legacy {query: {paragraph: score}} view. A repeated paragraph keeps its last score."""
+        order, queries, starts, ends = self.group_by_query()
+        doc_ids = np.asarray(self.docs.ids, dtype=object)[self.doc_idx[order]]
+        scores = self.score[order]
+        query_ids = self.queries.ids
+        return {query_ids[q]: dict(zip(doc_ids[s:e].tolist(), scores[s:e].tolist()))
+                for q, s, e in zip(queries.tolist(), starts, ends)}
+
+
+class QrelTable(Table):
+    """A qrel file: query, paragraph and relevance columns."""
+
+    def __init__(self, queries: IdTable, docs: IdTable, query_idx: np.ndarray, doc_idx: np.ndarray,
+                 relevance: np.ndarray, name: str = ""):
+        super().__init__(queries, docs, query_idx, doc_idx, name)
+        self.relevance = relevance
+
+
+def iter_columns(file_path: str, columns: List[int]) -> Iterator[List[List[str]]]:
+    """
+    Read the given whitespace separated columns of a TREC file in large batches of lines.
+    :return: an iterator over batches, each holding one list of strings per requested column
+    """
+    needed = max(columns) + 1
+    with compressed_io.open_file(file_path, 'r') as f:
+        while True:
+            lines = f.readlines(CHUNK_SIZE)
+            if not lines:
+                break
+            yield _split_columns(file_path, lines, needed, columns)
+
+
+def _split_columns(file_path: str, lines: List[str], needed: int, columns: List[int]) -> List[List[str]]:
+    # Fast path: every line has the same number of fields, so the fields of the whole batch
+    # can be split at once and sliced column-wise without building a list per line.
+    text = "".join(lines)
+    tokens = text.split()
+    width = len(tokens) // len(lines) if lines else 0
+    if width >= needed and width * len(lines) == len(tokens) and _fixed_width(text, lines, width):
+        return [tokens[c::width] for c in columns]
+
+    # Ragged or blank lines: split line by line. The per-line lists are short lived, so keep
+    # the cyclic garbage collector from repeatedly scanning them.
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        rows = [row for row in map(str.split, lines) if row]
+        cols = list(zip(*rows))
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    if rows and len(cols) < needed:
+        short = next(row for row in rows if len(row) < needed)
+        raise ValueError("{}: expected at least {} columns, got line '{}'".format(file_path, needed, " ".join(short)))
+    return [list(cols[c]) if rows else [] for c in columns]
+
+
+def _fixed_width(text: str, lines: List[str], width: int) -> bool:
+    """
+    Check that every line has width fields, given that all lines together have width fields per line. A line has
+    at most one field more than it has separators, so if the only whitespace besides line ends is spaces and tabs
+    and every line has width - 1 of them, no line can have fewer fields than width without another having more.
+    """
+    if not text.isascii() or text.count("\r") != text.count("\r\n") or any(c in text for c in OTHER_WHITESPACE):
+        return False
+    seps = np.fromiter(map(str.count, lines, itertools.repeat(" ")), dtype=np.int64, count=len(lines))
+    if "\t" in text:
+        seps += np.fromiter(map(str.count, lines, itertools.repeat("\t")), dtype=np.int64, count=len(lines))
+    return bool((seps == width - 1).all())
+
+
+def read_table(file_path: str, queries: Optional[IdTable] = None, docs: Optional[IdTable] = None) -> Table:
+    """Read only the query and paragraph columns of a run or qrel file."""
+    queries, docs, c = _read_columns(file_path, "table", queries, docs)
+    return Table(queries, docs, c["query_idx"], c["doc_idx"], os.path.basename(file_path))
+
+
+def read_run(file_path: str, queries: Optional[IdTable] = None, docs: Optional[IdTable] = None) -> RunTable:
+    queries, docs, c = _read_columns(file_path, "run", queries, docs)
+    return RunTable(queries, docs, c["query_idx"], c["doc_idx"], c["rank"], c["score"], os.path.basename(file_path))
+
+
+def read_runs(run_dir: str, queries: Optional[IdTable] = None, docs: Optional[IdTable] = None) -> List[RunTable]:
+    """Read every run file of a directory (sorted by name) into tables sharing one pair of ID tables."""
+    queries = IdTable() if queries is None else queries
+    docs = IdTable() if docs is None else docs
+    return [read_run(os.path.join(run_dir, fname), queries, docs) for fname in sorted(os.listdir(run_dir))]
+
+
+def read_qrels(file_path: str, queries: Optional[IdTable] = None, docs: Optional[IdTable] = None) -> QrelTable:
+    queries, docs, c = _read_columns(file_path, "qrels", queries, docs)
+    return QrelTable(queries, docs, c["query_idx"], c["doc_idx"], c["relevance"], os.path.basename(file_path))
+
+
+def _read_columns(file_path: str, kind: str, queries: Optional[IdTable], docs: Optional[IdTable]) \
+        -> Tuple[IdTable, IdTable, Dict[str, np.ndarray]]:
+    """
+    The columns of a file of the given kind (see EXTRA_COLUMNS), from the run cache if one is configured.
+    :return: (query ID table, paragraph ID table, {column name: array})
+    """
+    cache = run_cache.default_cache()
+    if cache is None:
+        return _parse_columns(file_path, kind, IdTable() if queries is None else queries,
+                              IdTable() if docs is None else docs)
+
+    entry = cache.get(file_path, kind)
+    if entry is None:
+        local_queries, local_docs, columns = _parse_columns(file_path, kind, IdTable(), IdTable())
+        cache.put(file_path, kind, {"queries": local_queries.ids, "docs": local_docs.ids}, columns)
+        query_ids, doc_ids = local_queries.ids, local_docs.ids
+    else:
+        query_ids, doc_ids, columns = entry.ids["queries"], entry.ids["docs"], entry.arrays
+    queries, columns["query_idx"] = _adopt(queries, query_ids, columns["query_idx"])
+    docs, columns["doc_idx"] = _adopt(docs, doc_ids, columns["doc_idx"])
+    return queries, docs, columns
+
+
+def _adopt(table: Optional[IdTable], ids: List[str], idx: np.ndarray) -> Tuple[IdTable, np.ndarray]:
+    # Cached indices point into the file's own IDs (in first-appearance order). Interning those IDs into an
+    # empty table gives every ID its cached index, so the (memory-mapped) indices are used as they are;
+    # a shared table that already holds IDs needs the indices remapped.
+    if table is None:
+        return IdTable(ids), idx
+    if not len(table):
+        table.intern_all(ids)
+        return table, idx
+    return table, table.intern_all(ids)[idx]
+
+
+def _parse_columns(file_path: str, kind: str, queries: IdTable, docs: IdTable) \
+        -> Tuple[IdTable, IdTable, Dict[str, np.ndarray]]:
+    extra = EXTRA_COLUMNS[kind]
+    names = ["query_idx", "doc_idx"] + [name for _, name, _ in extra]
+    arrays = _read_batches(file_path, [0, 2] + [col for col, _, _ in extra],
+                           [queries.intern_grouped, docs.intern_all] + [convert for _, _, convert in extra],
+                           len(names))
+    return queries, docs, dict(zip(names, arrays))
+
+
+def _read_batches(file_path: str, columns: List[int], converters: List[Callable], n: int) -> List[np.ndarray]:
+    # Convert every batch to arrays right away so that at most one batch of strings is alive.
+    parts: List[List[np.ndarray]] = [[] for _ in range(n)]
+    for batch in iter_columns(file_path, columns):
+        for part, convert, col in zip(parts, converters, batch):
+            part.append(convert(col))
+    return [np.concatenate(part) if part else convert([]) for part, convert in zip(parts, converters)]
+
+
+def _ints(col: List[str]) -> np.ndarray:
+    return np.fromiter(map(int, col), dtype=np.int32, count=len(col))
+
+
+def _floats(col: List[str]) -> np.ndarray:
+    return np.fromiter(map(float, col), dtype=np.float64, count=len(col))
+
+
+# Columns read by each kind of table besides the query and paragraph: (column number, name, converter).
+EXTRA_COLUMNS = {
+    "table": [],
+    "run": [(3, "rank", _ints), (4, "score", _floats)],
+    "qrels": [(3, "relevance", _ints)],
+}
+
+
+def read_rankings(file_path: str) -> Dict[str, List[str]]:
+    """Legacy {query: [paragraph, ...]} view of a run or qrel file."""
+    return read_table(file_path).rankings()
+
+
+def main():
+    parser = argparse.ArgumentParser("Load a TREC-CAR run file into a columnar table and print a summary.")
+    parser.add_argument("--run", help="Path to the run file.", required=True)
+    args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
+    run = read_run(args.run)
+    print("Lines: {}".format(len(run)))
+    print("Queries: {}".format(len(run.queries)))
+    print("Paragraphs: {}".format(len(run.docs)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,438 @@
+#!/usr/bin/env python
+"""This script splits run and qrel files into shards of queries, processes every shard on its own and merges them."""
+
+__author__ = "Shubham Chatterjee"
+__version__ = "10/18/26"
+
+from typing import Dict, Iterator, List, Optional, Tuple
+import argparse
+import itertools
+import json
+import os
+import sys
+import zlib
+from multiprocessing import Pool
+import numpy as np
+import combine
+import compressed_io
+import create_feature_file
+import instrumentation
+import map
+import normalization
+import ranklib_io
+import run_cache
+import run_loader
+
+# Description of a shard set, written by the split step once every shard file is complete.
+SHARD_INFO = "shards.json"
+
+# Every query of the runs, in the order the runs (taken by name) first retrieve them.
+QUERY_ORDER = "queries.txt"
+
+# Bumped whenever the layout of a shard set changes.
+FORMAT_VERSION = 1
+
+# Steps of the pipeline, in order. stats, features, combine and evaluate are done shard by shard.
+STEPS = ["split", "stats", "features", "combine", "evaluate", "merge"]
+SHARD_STEPS = ["stats", "features", "combine", "evaluate"]
+
+
+def shard_of(query_id: str, num_shards: int) -> int:
+    """The shard of a query: a hash of its ID that is the same in every process and on every machine."""
+    return zlib.crc32(query_id.encode("utf-8")) % num_shards
+
+
+class ShardSet:
+    """
+    The shards of a split: shard i holds the lines of every run (runs/), and of the qrels, whose query hashes to i
+    (see shard_of()), and the files the later steps write for it. Merged outputs are written to the root directory.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        info_file = os.path.join(root, SHARD_INFO)
+        if not os.path.exists(info_file):
+            raise FileNotFoundError("{} is not a shard set (or its split did not finish): {} is missing.".format(
+                root, SHARD_INFO))
+        with open(info_file, 'r') as f:
+            info = json.load(f)
+        if info.get("version") != FORMAT_VERSION:
+            raise ValueError("Unsupported shard set version: {}".format(info.get("version")))
+        self.num_shards: int = info["shards"]
+        self.runs: List[str] = info["runs"]
+        self.qrel: str = info["qrel"]
+        self.compress: Optional[str] = info.get("compress")
+
+    def shard_dir(self, i: int) -> str:
+        return os.path.join(self.root, "shard-{:04d}".format(i))
+
+    def run_dir(self, i: int) -> str:
+        return os.path.join(self.shard_dir(i), "runs")
+
+    def qrel_file(self, i: int) -> str:
+        return os.path.join(self.shard_dir(i), self.qrel)
+
+    def stats_file(self, i: int) -> str:
+        """The normalization statistics fitted on the shard alone."""
+        return os.path.join(self.shard_dir(i), "stats.json")
+
+    def norm_file(self, i: int) -> str:
+        """The normalization statistics of all shards, merged, which the shard's features are normalized with."""
+        return os.path.join(self.shard_dir(i), "norm.json")
+
+    def features(self, i: Optional[int] = None) -> str:
+        return compressed_io.output_path(os.path.join(self._dir(i), "features.txt"), self.compress)
+
+    def combined(self, i: Optional[int] = None) -> str:
+        return compressed_io.output_path(os.path.join(self._dir(i), "combined.run"), self.compress)
+
+    def evaluation(self, i: Optional[int] = None) -> str:
+        return os.path.join(self.shard_dir(i), "eval.json") if i is not None else os.path.join(self.root, "eval.txt")
+
+    def _dir(self, i: Optional[int]) -> str:
+        return self.root if i is None else self.shard_dir(i)
+
+    def query_order(self) -> List[str]:
+        with open(os.path.join(self.root, QUERY_ORDER), 'r') as f:
+            return f.read().split()
+
+
+def split_file(file_path: str, dest_files: List[str], shard_cache: Dict[str, int],
+               order: Optional[List[str]] = None) -> int:
+    """
+    Copy every line of a run or qrel file to the file of its query's shard, in one pass over large batches of
+    lines. Lines keep their order, so every shard file holds the lines of the source with its queries.
+    :param shard_cache: shard of every query seen so far, filled in as queries are seen
+    :param order: if given, queries seen for the first time are appended to it
+    :return: the number of lines read
+    """
+    num_shards = len(dest_files)
+    outs = [compressed_io.open_file(dest, 'w', buffering=ranklib_io.BUFFER_SIZE) for dest in dest_files]
+    num_lines = 0
+    try:
+        with compressed_io.open_file(file_path, 'r') as f:
+            while True:
+                lines = f.readlines(run_loader.CHUNK_SIZE)
+                if not lines:
+                    break
+                if not lines[-1].endswith("\n"):
+                    lines[-1] += "\n"
+                parts: List[List[str]] = [[] for _ in range(num_shards)]
+                current, part = None, parts[0]
+                # Lines of a query usually come together, so the shard is looked up once per query block
+                for line in lines:
+                    query = line.split(None, 1)[:1]
+                    if not query:
+                        continue
+                    if query[0] != current:
+                        current = query[0]
+                        shard = shard_cache.get(current)
+                        if shard is None:
+                            shard = shard_cache[current] = shard_of(current, num_shards)
+                            if order is not None:
+                                order.append(current)
+                        part = parts[shard]
+                    part.append(line)
+                for out, part in zip(outs, parts):
+                    if part:
+                        out.write("".join(part))
+                num_lines += len(lines)
+    finally:
+        for out in outs:
+            out.close()
+    return num_lines
+
+
+def split(run_dir: str, qrel_file: str, root: str, num_shards: int, compress: Optional[str] = None) -> ShardSet:
+    """Split every run file of a directory and the qrels into num_shards shards of queries under root."""
+    if num_shards < 1:
+        raise ValueError("Need at least one shard, not {}.".format(num_shards))
+    # A shard set without its info file is incomplete, so drop the info file of an earlier split first
+    info_file = os.path.join(root, SHARD_INFO)
+    if os.path.exists(info_file):
+        os.remove(info_file)
+    names = sorted(os.listdir(run_dir))
+    shard_names = [compressed_io.output_path(compressed_io.strip_suffix(name), compress) for name in names]
+    qrel_name = compressed_io.output_path(compressed_io.strip_suffix(os.path.basename(qrel_file)), compress)
+    shard_dirs = [os.path.join(root, "shard-{:04d}".format(i)) for i in range(num_shards)]
+    for shard_dir in shard_dirs:
+        os.makedirs(os.path.join(shard_dir, "runs"), exist_ok=True)
+
+    shard_cache: Dict[str, int] = {}
+    order: List[str] = []
+    with instrumentation.stage("split", shards=str(num_shards)):
+        for name, shard_name in zip(names, shard_names):
+            print("Splitting {}....".format(name), end=" ")
+            num_lines = split_file(os.path.join(run_dir, name),
+                                   [os.path.join(d, "runs", shard_name) for d in shard_dirs], shard_cache, order)
+            instrumentation.count("lines_read", num_lines)
+            print("[Done]")
+        print("Splitting {}....".format(os.path.basename(qrel_file)), end=" ")
+        instrumentation.count("lines_read", split_file(qrel_file, [os.path.join(d, qrel_name) for d in shard_dirs],
+                                                       shard_cache))
+        print("[Done]")
+
+    with open(os.path.join(root, QUERY_ORDER), 'w') as f:
+        f.write("".join(q + "\n" for q in order))
+    with open(info_file, 'w') as f:
+        json.dump({"version": FORMAT_VERSION, "shards": num_shards, "runs": shard_names, "qrel": qrel_name,
+                   "compress": compress}, f)
+    sizes = np.bincount([shard_cache[q] for q in order], minlength=num_shards) if order else np.zeros(num_shards)
+    print("Split {} queries into {} shards of {} to {} queries.".format(len(order), num_shards, int(sizes.min()),
+                                                                       int(sizes.max())))
+    return ShardSet(root)
+
+
+def shard_matrix(shards: ShardSet, i: int):
+    """The feature matrix of a shard. Runs are read in the order of the split (that of their original names)."""
+    queries, docs = run_loader.IdTable(), run_loader.IdTable()
+    runs = [run_loader.read_run(os.path.join(shards.run_dir(i), name), queries, docs) for name in shards.runs]
+    return create_feature_file.create_feature_matrix(runs)
+
+
+def fit_shard(root: str, i: int, mode: str):
+    """Fit the normalization statistics of one shard (only zscore needs statistics of all shards)."""
+    shards = ShardSet(root)
+    normalizer = normalization.Normalizer(mode)
+    matrix = shard_matrix(shards, i)
+    if len(matrix):
+        normalizer.fit(matrix)
+    normalizer.save(shards.stats_file(i))
+
+
+def merged_stats(shards: ShardSet, mode: str) -> normalization.Normalizer:
+    missing = [i for i in range(shards.num_shards) if not os.path.exists(shards.stats_file(i))]
+    if missing:
+        raise FileNotFoundError("Shards {} have no normalization statistics; run the stats step for them first."
+                                .format(", ".join(str(i) for i in missing)))
+    return normalization.merge([normalization.Normalizer.load(shards.stats_file(i))
+                                for i in range(shards.num_shards)])
+
+
+def features_shard(root: str, i: int, mode: str = "none", sparse: bool = False, graded: bool = False):
+    """
+    Write the feature file of one shard. Global zscore statistics are merged from the statistics of every shard
+    (the stats step), so that every shard is normalized as the whole collection would be; the other modes only
+    need the queries of the shard.
+    """
+    shards = ShardSet(root)
+    stats_in = None
+    if mode == "zscore":
+        merged_stats(shards, mode).save(shards.norm_file(i))
+        stats_in = shards.norm_file(i)
+    matrix = shard_matrix(shards, i)
+    qrels = run_loader.read_qrels(shards.qrel_file(i), matrix.queries, matrix.docs)
+    create_feature_file.write_matrix(matrix, qrels, shards.features(i), mode, sparse, stats_in, None, graded)
+
+
+def combine_shard(root: str, i: int, model_file: str, stream: bool = False):
+    shards = ShardSet(root)
+    combine.combine(shards.features(i), model_file, shards.combined(i), stream)
+
+
+def evaluate_shard(root: str, i: int, measures: List[str]):
+    """Evaluate the combined run of one shard, keeping the value of every query for the merge."""
+    shards = ShardSet(root)
+    evaluator = map.Evaluator.from_file(shards.qrel_file(i))
+    _, per_query = evaluator.evaluate_file(shards.combined(i), measures)
+    with open(shards.evaluation(i), 'w') as f:
+        json.dump({"measures": measures, "qrel_queries": len(evaluator.queries), "per_query": per_query}, f)
+
+
+def iter_groups(file_path: str, query_of) -> Iterator[Tuple[str, List[str]]]:
+    """(query, lines) for every block of consecutive lines of a query, skipping blank lines."""
+    with compressed_io.open_file(file_path, 'r', buffering=ranklib_io.BUFFER_SIZE) as f:
+        lines = (line if line.endswith("\n") else line + "\n" for line in f if line.strip())
+        for query, group in itertools.groupby(lines, key=query_of):
+            yield query, list(group)
+
+
+def merge_files(shards: ShardSet, order: List[str], shard_files: List[str], out_file: str, query_of,
+                renumber: bool = False) -> int:
+    """
+    Merge per-shard files of query blocks into one file with the queries in the global order. Every shard file
+    holds its queries in that order, so the merge reads each file once, front to back. Queries may be missing
+    from a shard file (e.g. a run leaves out queries whose candidates all scored 0), but not out of order.
+    :param renumber: give the k-th query of the merged feature file qid k, as a feature file of all queries has
+    :return: the number of queries written
+    """
+    groups = [iter_groups(path, query_of) for path in shard_files]
+    pending: List[Optional[Tuple[str, List[str]]]] = [next(g, None) for g in groups]
+    written = 0
+    with compressed_io.open_file(out_file, 'w', buffering=ranklib_io.BUFFER_SIZE) as out:
+        for query in order:
+            s = shard_of(query, shards.num_shards)
+            if pending[s] is None or pending[s][0] != query:
+                continue
+            lines = pending[s][1]
+            if renumber:
+                written_qid = " qid:{} ".format(written + 1)
+                local_qid = " " + lines[0].split(None, 2)[1] + " "
+                lines = [line.replace(local_qid, written_qid, 1) for line in lines]
+            out.write("".join(lines))
+            written += 1
+            pending[s] = next(groups[s], None)
+    left = [(s, p[0]) for s, p in enumerate(pending) if p is not None]
+    if left:
+        s, query = left[0]
+        raise ValueError("Query {} of {} is out of the order of the split, or comes twice.".format(
+            query, shard_files[s]))
+    return written
+
+
+def merge_evaluation(shards: ShardSet, order: List[str], complete: bool = False):
+    """
+    Aggregate the per-query values of every shard as map.Evaluator would over the merged run: summed in the
+    global query order, averaged over the queries in the run and the qrels (or over every qrel query with
+    complete), with num_ measures summed.
+    :return: (measures, {measure: mean}, {measure: {query: value}})
+    """
+    parts = []
+    for i in range(shards.num_shards):
+        with open(shards.evaluation(i), 'r') as f:
+            parts.append(json.load(f))
+    measures = parts[0]["measures"]
+    if any(part["measures"] != measures for part in parts):
+        raise ValueError("The shards were evaluated with different measures; run the evaluate step again.")
+    num_qrel_queries = sum(part["qrel_queries"] for part in parts)
+    aggregate: Dict[str, float] = {}
+    per_query: Dict[str, Dict[str, float]] = {}
+    for measure in measures:
+        shard_values = [part["per_query"][measure] for part in parts]
+        values = {}
+        for query in order:
+            value = shard_values[shard_of(query, shards.num_shards)].get(query)
+            if value is not None:
+                values[query] = value
+        total = float(np.array(list(values.values()), dtype=np.float64).sum())
+        num_queries = num_qrel_queries if complete else len(values)
+        if map.parse_measure(measure)[0].startswith("num_"):
+            aggregate[measure] = total
+        else:
+            aggregate[measure] = total / num_queries if num_queries else 0.0
+        per_query[measure] = values
+    return measures, aggregate, per_query
+
+
+def merge(root: str, complete: bool = False):
+    """Merge whatever every shard has: the feature files, the combined runs and the evaluations."""
+    shards = ShardSet(root)
+    order = shards.query_order()
+    shard_ids = range(shards.num_shards)
+    with instrumentation.stage("merge"):
+        for name, files, out_file, query_of, renumber in [
+                ("feature files", [shards.features(i) for i in shard_ids], shards.features(), combine._query_of, True),
+                ("combined runs", [shards.combined(i) for i in shard_ids], shards.combined(),
+                 lambda line: line.split(None, 1)[0], False)]:
+            if not _all_or_none(files, name):
+                continue
+            print("Merging the {}....".format(name), end=" ")
+            num_queries = merge_files(shards, order, files, out_file, query_of, renumber)
+            print("[Done]")
+            print("{} queries written to: {}".format(num_queries, out_file))
+
+        if _all_or_none([shards.evaluation(i) for i in shard_ids], "evaluations"):
+            measures, aggregate, per_query = merge_evaluation(shards, order, complete)
+            with open(shards.evaluation(), 'w') as f:
+                for measure in measures:
+                    for query, value in per_query[measure].items():
+                        f.write(measure + "\t\t\t" + query + "\t" + "{:.4f}".format(value) + "\n")
+                    f.write(measure + "\t\t\t" + "all" + "\t" + "{:.4f}".format(aggregate[measure]) + "\n")
+            for measure in measures:
+                print(measure + "\t\t\t" + "all" + "\t" + "{:.4f}".format(aggregate[measure]))
+            print("Evaluation written to: " + shards.evaluation())
+
+
+def _all_or_none(files: List[str], name: str) -> bool:
+    """Whether every shard has its file; an error if only some do, as the merge would be missing queries."""
+    missing = [i for i, path in enumerate(files) if not os.path.exists(path)]
+    if missing and len(missing) < len(files):
+        raise FileNotFoundError("Shards {} have no {} yet.".format(", ".join(str(i) for i in missing), name))
+    return not missing
+
+
+def run_shards(step: str, func, root: str, indices: List[int], workers: int, *args):
+    """Do a step for the given shards, up to workers shards at a time in separate processes."""
+    with instrumentation.stage(step, shards=str(len(indices))):
+        jobs = [(root, i) + args for i in indices]
+        if workers > 1 and len(jobs) > 1:
+            with Pool(min(workers, len(jobs))) as pool:
+                pool.starmap(func, jobs)
+        else:
+            for job in jobs:
+                func(*job)
+
+
+def main():
+    parser = argparse.ArgumentParser("Split run and qrel files into shards of queries, create the feature files, "
+                                     "combine and evaluate shard by shard, and merge the shards' outputs.")
+    parser.add_argument("--dir", help="Path to the directory of the shards.", required=True)
+    parser.add_argument("--step", help="Step to do ({}), or all of them in order (all but split without --rundir)."
+                        .format(", ".join(STEPS)),
+                        choices=STEPS + ["all"], required=True)
+    parser.add_argument("--shard", help="Do the step for this shard only (e.g. one shard per machine on a shared "
+                                        "file system). Defaults to every shard.")
+    parser.add_argument("--workers", help="Number of shards to process at the same time. Defaults to 1.", default=1)
+    parser.add_argument("--rundir", help="Path to the directory containing the run files (split).")
+    parser.add_argument("--qrel", help="Path to the ground truth (qrel) file (split).")
+    parser.add_argument("--shards", help="Number of shards to split into (split).")
+    normalization.add_arguments(parser)
+    parser.add_argument("--sparse", help="Whether to leave out features with value 0 or not (features).",
+                        action="store_true")
+    parser.add_argument("--graded", help="Label the candidates with their relevance grade in the qrels instead of 1 "
+                                         "(features). Negative grades are labelled 0.", action="store_true")
+    parser.add_argument("--model", help="Path to the RankLib model file (combine).")
+    parser.add_argument("--stream", help="Score one group of queries at a time (combine).", action="store_true")
+    parser.add_argument("--measures", help="Comma separated measures to compute (evaluate). Defaults to map.",
+                        default="map")
+    parser.add_argument("--c", help="Average over all queries in the qrels, not only the ones in the run (merge).",
+                        action="store_true")
+    compressed_io.add_arguments(parser)
+    run_cache.add_arguments(parser)
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
+    run_cache.configure_from_args(args)
+    instrumentation.configure_from_args(args)
+    mode = normalization.mode_of(args.zscore, args.normalize)
+
+    steps = STEPS if args.step == "all" else [args.step]
+    if args.step == "all" and not args.rundir:
+        # Start from the split already in --dir
+        steps = STEPS[1:]
+    if args.shard is not None and ("split" in steps or "merge" in steps):
+        parser.error("--shard only applies to the per-shard steps ({}).".format(", ".join(SHARD_STEPS)))
+    if "split" in steps and not (args.rundir and args.qrel and args.shards):
+        parser.error("The split step needs --rundir, --qrel and --shards.")
+    if args.step == "combine" and not args.model:
+        parser.error("The combine step needs --model.")
+
+    with instrumentation.stage("sharding"):
+        for step in steps:
+            if step == "split":
+                split(args.rundir, args.qrel, args.dir, int(args.shards), args.compress)
+                continue
+            if step == "merge":
+                merge(args.dir, args.c)
+                continue
+            if args.step == "all" and step in ("combine", "evaluate") and not args.model:
+                continue
+            if step == "stats" and mode != "zscore":
+                print("{} normalization needs no statistics of all shards.".format(mode))
+                continue
+            shards = ShardSet(args.dir)
+            indices = [int(args.shard)] if args.shard is not None else list(range(shards.num_shards))
+            print("Doing the {} step for {} shards....".format(step, len(indices)))
+            if step == "stats":
+                run_shards(step, fit_shard, args.dir, indices, int(args.workers), mode)
+            elif step == "features":
+                run_shards(step, features_shard, args.dir, indices, int(args.workers), mode, args.sparse,
+                           args.graded)
+            elif step == "combine":
+                run_shards(step, combine_shard, args.dir, indices, int(args.workers), args.model, args.stream)
+            else:
+                run_shards(step, evaluate_shard, args.dir, indices, int(args.workers), args.measures.split(","))
+    instrumentation.finish()
+
+
+if __name__ == '__main__':
+    main()
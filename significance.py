@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+"""This script compares TREC-CAR runs against a baseline with paired significance tests and confidence intervals."""
+
+__author__ = "Shubham Chatterjee"
+__version__ = "10/18/26"
+
+from typing import Dict, List, Optional, Tuple
+import argparse
+import os
+import sys
+import time
+import numpy as np
+from scipy.stats import t as t_dist
+from map import Evaluator, MEASURES, parse_measure
+
+# Number of random permutations (or resamples) scored with one matrix product; bounds memory to about
+# BATCH_SIZE x number of queries x 8 bytes.
+BATCH_SIZE: int = 10000
+
+
+class ScoreMatrix:
+    """Per-query scores of several runs: scores[i, j] is the score of run names[j] on query queries[i]."""
+
+    def __init__(self, queries: List[str], names: List[str], scores: np.ndarray):
+        self.queries = queries
+        self.names = names
+        self.scores = scores
+
+    def column(self, name: str) -> int:
+        if name not in self.names:
+            raise ValueError("Unknown run '{}'. Runs: {}".format(name, ", ".join(self.names)))
+        return self.names.index(name)
+
+
+def _to_matrix(per_run: Dict[str, Dict[str, float]], queries: Optional[List[str]] = None) -> ScoreMatrix:
+    # A query missing from a run scores 0 for it, as with trec_eval -c
+    names = sorted(per_run)
+    if queries is None:
+        queries = sorted(set(q for scores in per_run.values() for q in scores))
+    scores = np.zeros((len(queries), len(names)), dtype=np.float64)
+    for j, name in enumerate(names):
+        run_scores = per_run[name]
+        scores[:, j] = [run_scores.get(q, 0.0) for q in queries]
+    return ScoreMatrix(queries, names, scores)
+
+
+def score_runs(run_files: List[str], qrel_file: str, measure: str = "map") -> ScoreMatrix:
+    """Evaluate run files in-process; every query of the qrels is a row."""
+    parse_measure(measure)
+    evaluator = Evaluator.from_file(qrel_file)
+    per_run = {}
+    for run_file in run_files:
+        _, per_query = evaluator.evaluate_file(run_file, [measure], complete=True)
+        per_run[os.path.basename(run_file)] = per_query[measure]
+    return _to_matrix(per_run, list(evaluator.queries.ids))
+
+
+def read_trec_eval(eval_files: List[str], measure: str = "map") -> ScoreMatrix:
+    """Per-query scores from trec_eval -q outputs ("measure query value" lines; the "all" lines are skipped)."""
+    per_run = {}
+    for eval_file in eval_files:
+        scores = {}
+        with open(eval_file, 'r') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[0] == measure and parts[1] != "all":
+                    scores[parts[1]] = float(parts[2])
+        per_run[os.path.basename(eval_file)] = scores
+    return _to_matrix(per_run)
+
+
+def paired_t_test(base: np.ndarray, others: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Two-sided paired t-test of every column of others against base.
+    :return: (t statistics, p-values), one per column
+    """
+    diff = others - base[:, None]
+    n = diff.shape[0]
+    mean = diff.mean(axis=0)
+    sd = diff.std(axis=0, ddof=1) if n > 1 else np.zeros(diff.shape[1])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = mean / (sd / np.sqrt(n))
+    # Identical runs: no difference, nothing to test
+    t = np.where(sd > 0, t, 0.0)
+    p = np.where(sd > 0, 2 * t_dist.sf(np.abs(t), max(n - 1, 1)), 1.0)
+    return t, p
+
+
+def randomization_test(base: np.ndarray, others: np.ndarray, trials: int = 100000, seed: Optional[int] = 0,
+                       batch_size: int = BATCH_SIZE) -> np.ndarray:
+    """
+    Two-sided paired (Fisher) randomization test of every column of others against base: each trial swaps the
+    two systems' scores on a random subset of queries, i.e. flips the sign of their differences. All columns
+    share the same trials, and a batch of trials is one (trials x queries) @ (queries x runs) product.
+    :return: p-values, one per column
+    """
+    rng = np.random.RandomState(seed)
+    diff = others - base[:, None]
+    n, m = diff.shape
+    observed = np.abs(diff.sum(axis=0))
+    # Sums that only differ by rounding count as ties with the observed one
+    tolerance = 1e-9 * np.maximum(np.abs(diff).sum(axis=0), 1.0)
+    at_least = np.zeros(m, dtype=np.int64)
+    for start in range(0, trials, batch_size):
+        size = min(batch_size, trials - start)
+        bits = np.unpackbits(np.frombuffer(rng.bytes((size * n + 7) // 8), dtype=np.uint8))[:size * n]
+        signs = bits.reshape(size, n).astype(np.float64) * 2 - 1
+        at_least += (np.abs(signs @ diff) >= observed - tolerance).sum(axis=0)
+    return (at_least + 1) / (trials + 1)
+
+
+def bootstrap_ci(base: np.ndarray, others: np.ndarray, trials: int = 100000, alpha: float = 0.05,
+                 seed: Optional[int] = 0, batch_size: int = BATCH_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Percentile bootstrap confidence interval of the mean difference of every column of others over base. Each
+    resample draws the queries with replacement, as a vector of per-query counts, so a batch of resamples is
+    one (trials x queries) @ (queries x runs) product.
+    :return: (lower bounds, upper bounds), one per column
+    """
+    rng = np.random.RandomState(seed)
+    diff = others - base[:, None]
+    n, m = diff.shape
+    means = np.empty((trials, m), dtype=np.float64)
+    for start in range(0, trials, batch_size):
+        size = min(batch_size, trials - start)
+        # Count the draws of every query in every resample with one bincount over (resample, query) keys
+        draws = rng.randint(0, n, size=(size, n)) + (np.arange(size) * n)[:, None]
+        counts = np.bincount(draws.ravel(), minlength=size * n).reshape(size, n).astype(np.float64)
+        means[start:start + size] = counts @ diff / n
+    lower, upper = np.percentile(means, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+    return lower, upper
+
+
+def compare(matrix: ScoreMatrix, baseline: str, trials: int = 100000, alpha: float = 0.05,
+            seed: Optional[int] = 0) -> List[dict]:
+    """Every run against the baseline: means, difference, t-test and randomization p-values and bootstrap CI."""
+    b = matrix.column(baseline)
+    others = [j for j in range(len(matrix.names)) if j != b]
+    base = matrix.scores[:, b]
+    scores = matrix.scores[:, others]
+    t, p_t = paired_t_test(base, scores)
+    p_rand = randomization_test(base, scores, trials, seed)
+    lower, upper = bootstrap_ci(base, scores, trials, alpha, seed)
+    rows = []
+    for i, j in enumerate(others):
+        rows.append({"run": matrix.names[j], "mean": float(scores[:, i].mean()), "baseline": float(base.mean()),
+                     "diff": float((scores[:, i] - base).mean()), "t": float(t[i]), "p_t": float(p_t[i]),
+                     "p_rand": float(p_rand[i]), "ci_low": float(lower[i]), "ci_high": float(upper[i])})
+    return rows
+
+
+def write_comparison(rows: List[dict], out_file: str):
+    columns = ["run", "mean", "baseline", "diff", "t", "p_t", "p_rand", "ci_low", "ci_high"]
+    with open(out_file, 'w') as f:
+        f.write("\t".join(columns) + "\n")
+        for row in rows:
+            f.write("\t".join(str(row[c]) for c in columns) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser("Compare TREC-CAR runs against a baseline with paired significance tests.")
+    parser.add_argument("--runs", help="Paths to run files, or to a directory of run files.", nargs="+")
+    parser.add_argument("--qrel", help="Path to the ground truth (qrel) file, to evaluate the runs with.")
+    parser.add_argument("--eval", help="Paths to trec_eval -q output files to read the per-query scores from, "
+                                       "instead of evaluating runs.", nargs="+")
+    parser.add_argument("--measure", help="Measure to compare ({}). Defaults to map.".format(", ".join(MEASURES)),
+                        default="map")
+    parser.add_argument("--baseline", help="File name of the baseline run (or trec_eval file).", required=True)
+    parser.add_argument("--trials", help="Number of randomization trials and bootstrap resamples. "
+                                         "Defaults to 100000.", default=100000)
+    parser.add_argument("--alpha", help="Significance level; the confidence intervals are 1 - alpha. "
+                                        "Defaults to 0.05.", default=0.05)
+    parser.add_argument("--seed", help="Random seed. Defaults to 0.", default=0)
+    parser.add_argument("--out", help="Path to a TSV file to write the comparison to.")
+    args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
+
+    start = time.perf_counter()
+    if args.eval:
+        matrix = read_trec_eval(args.eval, args.measure)
+    elif args.runs and args.qrel:
+        run_files = args.runs
+        if len(run_files) == 1 and os.path.isdir(run_files[0]):
+            run_files = [os.path.join(run_files[0], f) for f in sorted(os.listdir(run_files[0]))]
+        matrix = score_runs(run_files, args.qrel, args.measure)
+    else:
+        parser.error("Give either --runs and --qrel, or --eval.")
+    print("Scored {} runs on {} queries in {:.1f} seconds.".format(len(matrix.names), len(matrix.queries),
+                                                                   time.perf_counter() - start))
+
+    start = time.perf_counter()
+    alpha = float(args.alpha)
+    rows = compare(matrix, args.baseline, int(args.trials), alpha, int(args.seed))
+    print("Compared against {} in {:.1f} seconds.".format(args.baseline, time.perf_counter() - start))
+    print("{:<30}{:>9}{:>9}{:>10}{:>10}{:>10}  {}".format("run", args.measure, "diff", "t", "p(t)", "p(rand)",
+                                                          "{:.0f}% CI of diff".format(100 * (1 - alpha))))
+    for row in rows:
+        print("{:<30}{:>9.4f}{:>+9.4f}{:>10.3f}{:>10.4f}{:>10.4f}  [{:+.4f}, {:+.4f}]{}".format(
+            row["run"], row["mean"], row["diff"], row["t"], row["p_t"], row["p_rand"], row["ci_low"], row["ci_high"],
+            " *" if row["p_rand"] < alpha else ""))
+    print("Baseline {}: {:.4f}".format(args.baseline, rows[0]["baseline"] if rows else 0.0))
+    if args.out:
+        write_comparison(rows, args.out)
+        print("Comparison is written to: " + args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,12 +8,14 @@ import math
 import sys
 import argparse
 from typing import List
+import compressed_io
+import qrel_index
 
 
 def standard_error(file_path: str, qrel_file_path: str) -> float:
     nums: List[float] = []
     n: int = number_of_queries(qrel_file_path)
-    with open(file_path, 'r') as file:
+    with compressed_io.open_file(file_path, 'r') as file:
         for line in file:
             m = line.split()
             nums.append(float(m[2]))
@@ -22,14 +24,7 @@ def standard_error(file_path: str, qrel_file_path: str) -> float:
 
 
 def number_of_queries(qrel_file_path: str) -> int:
-    query_list: List[str] = []
-    with open(qrel_file_path, 'r') as file:
-        for line in file:
-            line_parts = line.split(" ")
-            query_id = line_parts[0]
-            if query_id not in query_list:
-                query_list.append(query_id)
-    return len(query_list)
+    return qrel_index.QrelIndex.from_file(qrel_file_path).num_queries
 
 
 def main():
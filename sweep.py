@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+"""This script runs cross-validation over a grid of rankers, training metrics, normalizations and numbers of folds."""
+
+__author__ = "Shubham Chatterjee"
+__version__ = "10/18/26"
+
+from itertools import product
+from typing import Dict, List, Optional, Tuple
+import argparse
+import csv
+import os
+import sys
+import coordinate_ascent
+import create_folds
+import cross_validation
+import instrumentation
+import manifest
+import map
+import normalization
+import rank_lib_runner
+import run_cache
+
+# Columns of the results table that describe the configuration; the measures come after them.
+COLUMNS = ["config", "trainer", "ranker", "metric", "normalize", "k"]
+
+RESULTS_FILE = "results.tsv"
+
+
+class Config:
+    """One point of the grid. Its name is the directory its models and run file are kept in."""
+
+    def __init__(self, ranker: str, metric: str, normalize: str, k: int):
+        self.ranker = ranker
+        self.metric = metric
+        self.normalize = normalize
+        self.k = k
+
+    @property
+    def name(self) -> str:
+        return "ranker{}-{}-{}-k{}".format(self.ranker, self.metric, self.normalize, self.k)
+
+
+class FeatureSet:
+    """The test feature files of the folds of one (normalization, k), and the train set of every fold."""
+
+    def __init__(self, test_dir: str, train_files: Dict[int, List[str]]):
+        self.test_dir = test_dir
+        self.train_files = train_files
+
+    def test_file(self, i: int) -> str:
+        return self.test_dir + "/feature-file-" + str(i) + ".txt"
+
+
+def grid(rankers: List[str], metrics: List[str], normalizations: List[str], ks: List[int]) -> List[Config]:
+    return [Config(r, m, n, k) for k, n, r, m in product(ks, normalizations, rankers, metrics)]
+
+
+def read_results(results_file: str) -> List[Dict[str, str]]:
+    if not os.path.exists(results_file):
+        return []
+    with open(results_file, 'r', newline='') as f:
+        return list(csv.DictReader(f, delimiter="\t"))
+
+
+def append_result(results_file: str, row: Dict[str, str], measures: List[str]):
+    """Add a row to the results table, keeping the columns of the table if it already exists."""
+    if os.path.exists(results_file):
+        with open(results_file, 'r', newline='') as f:
+            columns = next(csv.reader(f, delimiter="\t"))
+    else:
+        columns = COLUMNS + measures
+        with open(results_file, 'w', newline='') as f:
+            csv.writer(f, delimiter="\t").writerow(columns)
+    with open(results_file, 'a', newline='') as f:
+        csv.writer(f, delimiter="\t").writerow([row.get(c, "") for c in columns])
+
+
+def make_folds(sweep_dir: str, run_dir: str, k: int) -> str:
+    """Divide the runs into k folds, unless they already are. :return: the fold directory"""
+    k_dir = sweep_dir + "/k" + str(k)
+    fold_dir = k_dir + "/folds"
+    os.makedirs(fold_dir, exist_ok=True)
+    mf = manifest.Manifest(k_dir)
+
+    def action():
+        cross_validation.clear_directory(fold_dir)
+        create_folds.create_folds(fold_dir, run_dir, k)
+    with instrumentation.stage("folds", k=k):
+        if not mf.run("folds", "folds", manifest.list_files(run_dir), action, lambda: manifest.list_files(fold_dir),
+                      {"k": k}):
+            print("Folds for k = {} are up to date.".format(k))
+    return fold_dir
+
+
+def make_features(fold_dir: str, qrels_dir: str, qrel_file: str, mode: str, k: int, write_train: bool) -> FeatureSet:
+    """
+    Create the test feature files of the folds with one normalization, unless they are up to date, and the
+    leave-i.txt train files if they are to be written (RankLib needs them).
+    """
+    feature_dir = os.path.dirname(fold_dir) + "/" + mode
+    test_dir = feature_dir + "/test"
+    train_dir = feature_dir + "/train"
+    os.makedirs(test_dir, exist_ok=True)
+    mf = manifest.Manifest(feature_dir)
+    with instrumentation.stage("features", normalize=mode, k=k):
+        cross_validation.create_test_set(fold_dir, test_dir, qrels_dir, qrel_file, False, k, mf, mode)
+        train_files = cross_validation.get_train_sets(test_dir, k)
+        if write_train:
+            os.makedirs(train_dir, exist_ok=True)
+            cross_validation.create_train_set(train_dir, test_dir, k, mf)
+            train_files = {i: [train_dir + "/leave-" + str(i) + ".txt"] for i in range(k)}
+    return FeatureSet(test_dir, train_files)
+
+
+def sweep(sweep_dir: str, run_dir: str, qrels_dir: str, qrel_file: str, rankers: List[str], metrics: List[str],
+          normalizations: List[str], ks: List[int], ranklib_path: Optional[str] = None, trainer: str = "ranklib",
+          workers: int = 1, heap: Optional[str] = None, measures: List[str] = map.DEFAULT_MEASURES,
+          write_train: bool = False, timeout: Optional[float] = None) -> Tuple[str, List[str]]:
+    """
+    Cross-validate every configuration of the grid that is not in the results table yet, and add its row.
+
+    The folds are made once per k and the feature files once per (normalization, k), then the training jobs of
+    every fold of every configuration are run on one pool of workers. A configuration's folds are combined and
+    the run evaluated in-process as soon as its last model is saved. Models are recorded in the manifest of the
+    configuration's directory, so an interrupted sweep resumes at the models that did not finish.
+    A RankLib job that fails or times out only stops its own configuration: the other jobs run on, and the
+    configuration is left out of the results table, so that the next sweep retries it.
+    :return: (path to the results table, names of the configurations that did not finish)
+    """
+    if trainer == "numpy":
+        if any(r != "4" for r in rankers):
+            raise ValueError("The NumPy trainer only has Coordinate Ascent (ranker 4).")
+        for metric in metrics:
+            coordinate_ascent.parse_metric(metric)
+    elif not ranklib_path:
+        raise ValueError("Training with RankLib needs the path to the RankLib JAR.")
+
+    os.makedirs(sweep_dir, exist_ok=True)
+    results_file = sweep_dir + "/" + RESULTS_FILE
+    finished = set(row["config"] for row in read_results(results_file) if row.get("trainer") == trainer)
+    configs = grid(rankers, metrics, normalizations, ks)
+    todo = [c for c in configs if c.name not in finished]
+    print("{} configurations, {} of them already in {}.".format(len(configs), len(configs) - len(todo), results_file))
+    if not todo:
+        return results_file, []
+
+    print("Creating folds and feature files.......")
+    print("============================================================================")
+    features: Dict[tuple, FeatureSet] = {}
+    for k in sorted(set(c.k for c in todo)):
+        fold_dir = make_folds(sweep_dir, run_dir, k)
+        for mode in [n for n in normalizations if any(c.k == k and c.normalize == n for c in todo)]:
+            features[(mode, k)] = make_features(fold_dir, qrels_dir, qrel_file, mode, k,
+                                                trainer == "ranklib" or write_train)
+
+    evaluator = map.Evaluator.from_file(qrels_dir + "/" + qrel_file)
+    config_dirs: Dict[str, str] = {}
+    manifests: Dict[str, manifest.Manifest] = {}
+    remaining: Dict[str, int] = {}
+    job_inputs: Dict[str, List[str]] = {}
+    job_config: Dict[str, Config] = {}
+    stale: List[rank_lib_runner.TrainJob] = []
+    stale_files: List[List[str]] = []
+
+    def params(config: Config) -> dict:
+        return {"trainer": trainer, "ranker": config.ranker, "metric": config.metric}
+
+    def finish(config: Config):
+        """Combine the folds of a configuration whose models are all saved, evaluate the run and record it."""
+        cfg_dir, mf, fs = config_dirs[config.name], manifests[config.name], features[(config.normalize, config.k)]
+        with instrumentation.stage("finish", config=config.name):
+            combined = []
+            for i in range(config.k):
+                model = cfg_dir + "/models/model-" + str(i) + ".txt"
+                comb = cfg_dir + "/combined/comb-" + str(i) + ".txt"
+                cross_validation.step(mf, "combine-" + str(i), "combine", [fs.test_file(i), model],
+                                      lambda: cross_validation.combine_fold(
+                                           fs.test_file(i), model, comb, config.ranker, ranklib_path, heap,
+                                           cfg_dir + "/logs/score-" + str(i) + ".log"), [comb])
+                combined.append(comb)
+            run_file = cfg_dir + "/" + config.name + ".run"
+            cross_validation.step(mf, "concat", "evaluate", combined,
+                                  lambda: cross_validation.concat(combined, run_file), [run_file])
+            aggregate, _ = evaluator.evaluate_file(run_file, measures)
+        row = {"config": config.name, "trainer": trainer, "ranker": config.ranker, "metric": config.metric,
+               "normalize": config.normalize, "k": str(config.k)}
+        row.update({measure: "{:.4f}".format(value) for measure, value in aggregate.items()})
+        append_result(results_file, row, list(aggregate))
+        print("{}: {}".format(config.name, " ".join("{}={:.4f}".format(m, v) for m, v in aggregate.items())))
+
+    def on_done(job: rank_lib_runner.TrainJob):
+        config = job_config[job.name]
+        manifests[config.name].record("model-" + job.name, "models", job_inputs[job.name], [job.model_file],
+                                      params(config))
+        remaining[config.name] -= 1
+        if remaining[config.name] == 0:
+            finish(config)
+
+    for config in todo:
+        cfg_dir = sweep_dir + "/configs/" + config.name
+        for sub in ("models", "combined", "logs"):
+            os.makedirs(cfg_dir + "/" + sub, exist_ok=True)
+        config_dirs[config.name] = cfg_dir
+        manifests[config.name] = mf = manifest.Manifest(cfg_dir)
+        fs = features[(config.normalize, config.k)]
+        remaining[config.name] = 0
+        for i in range(config.k):
+            job = rank_lib_runner.TrainJob(config.name + "/fold-" + str(i), fs.train_files[i][0],
+                                           cfg_dir + "/models/model-" + str(i) + ".txt",
+                                           cfg_dir + "/logs/train-" + str(i) + ".log", config.ranker, config.metric)
+            job_config[job.name] = config
+            job_inputs[job.name] = fs.train_files[i] + ([ranklib_path] if trainer == "ranklib" else [])
+            if not mf.up_to_date("model-" + job.name, "models", job_inputs[job.name], params(config)):
+                mf.invalidate("model-" + job.name)
+                stale.append(job)
+                stale_files.append(fs.train_files[i])
+                remaining[config.name] += 1
+
+    print("\n")
+    print("Training {} of the {} folds of {} configurations.......".format(len(stale), sum(c.k for c in todo),
+                                                                          len(todo)))
+    print("============================================================================")
+    # Configurations whose models were all saved by an earlier sweep only need to be combined and evaluated
+    for config in todo:
+        if remaining[config.name] == 0:
+            finish(config)
+
+    with instrumentation.stage("models", trainer=trainer):
+        instrumentation.count("trained", len(stale))
+        if stale and trainer == "numpy":
+            cross_validation.train_numpy(stale, "MAP", workers, on_done, stale_files)
+        elif stale:
+            try:
+                rank_lib_runner.train_all(ranklib_path, stale, "MAP", workers, heap, on_done, timeout, fail_fast=False)
+            except rank_lib_runner.RankLibError as e:
+                for result in e.results:
+                    if not result.ok:
+                        print("{}: {}".format(result.job.name, result.describe()))
+
+    failed = [config.name for config in todo if remaining[config.name] > 0]
+    if failed:
+        print("{} configurations did not finish and are left out of the results; the next sweep retries them: {}"
+              .format(len(failed), ", ".join(failed)))
+    return results_file, failed
+
+
+def print_results(results_file: str, sort_by: Optional[str] = None):
+    """Print the results table, best first by the sort_by measure (defaults to the first one)."""
+    rows = read_results(results_file)
+    if not rows:
+        return
+    columns = list(rows[0])
+    measures = [c for c in columns if c not in COLUMNS]
+    sort_by = sort_by or (measures[0] if measures else None)
+    if sort_by in measures:
+        rows.sort(key=lambda row: -float(row[sort_by]) if row[sort_by] else float("inf"))
+    width = max(len(row["config"]) for row in rows) + 2
+    print("{:<{}}".format("config", width) + "".join("{:>12}".format(m) for m in measures))
+    for row in rows:
+        print("{:<{}}".format(row["config"], width) + "".join("{:>12}".format(row[m]) for m in measures))
+
+
+def main():
+    parser = argparse.ArgumentParser("Cross-validate a grid of rankers, metrics, normalizations and folds.")
+    parser.add_argument("--sweepdir", help="Path to the directory where all sweep data will be stored.",
+                        required=True)
+    parser.add_argument("--rundir", help="Path to the directory containing the run files.", required=True)
+    parser.add_argument("--qrelsdir", help="Path to the directory containing the ground truth files.", required=True)
+    parser.add_argument("--qrelfile", help="Name of the ground truth file file.", required=True)
+    parser.add_argument("--rankers", help="RankLib rankers to sweep ({}). Defaults to 4.".format(
+        ", ".join("{}: {}".format(r, name) for r, name in rank_lib_runner.RANKERS.items())), nargs="+",
+                        choices=list(rank_lib_runner.RANKERS), default=["4"])
+    parser.add_argument("--metrics", help="Metrics to optimize for (MAP|NDCG@k|DCG@k|P@k|RR@k|ERR@k). Defaults to "
+                                          "MAP.", nargs="+", default=["MAP"])
+    parser.add_argument("--normalize", help="Normalizations to sweep ({}). Defaults to none.".format(
+        ", ".join(normalization.MODES)), nargs="+", choices=normalization.MODES, default=["none"])
+    parser.add_argument("--k", help="Numbers of folds to sweep.", nargs="+", required=True)
+    parser.add_argument("--ranklib", help="Path to the RankLib JAR file.")
+    parser.add_argument("--trainer", help="Train with the RankLib JAR (ranklib) or with the in-process NumPy "
+                                          "Coordinate Ascent (numpy). Defaults to ranklib.",
+                        choices=["ranklib", "numpy"], default="ranklib")
+    parser.add_argument("--workers", help="Number of training jobs (folds of any configuration) to run at the same "
+                                          "time. Defaults to 1.", default=1)
+    parser.add_argument("--heap", help="Maximum JVM heap of each training job, e.g. 8g. Defaults to the JVM default.")
+    parser.add_argument("--timeout", help="Seconds a RankLib training job may run before it is killed. Defaults to "
+                                          "no limit.")
+    parser.add_argument("--measures", help="Measures of the results table. Defaults to: {}.".format(
+        " ".join(map.DEFAULT_MEASURES)), nargs="+", default=map.DEFAULT_MEASURES)
+    parser.add_argument("--sort", help="Measure to sort the printed results by. Defaults to the first one.")
+    parser.add_argument("--write-train", help="Write the leave-i.txt train files even for the NumPy trainer.",
+                        action="store_true")
+    run_cache.add_arguments(parser)
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
+    run_cache.configure_from_args(args)
+    instrumentation.configure_from_args(args)
+    try:
+        with instrumentation.stage("sweep"):
+            results_file, failed = sweep(args.sweepdir, args.rundir, args.qrelsdir, args.qrelfile, args.rankers,
+                                         args.metrics, args.normalize, [int(k) for k in args.k], args.ranklib,
+                                         args.trainer, int(args.workers), args.heap, args.measures, args.write_train,
+                                         float(args.timeout) if args.timeout else None)
+    except (ValueError, rank_lib_runner.RankLibError) as e:
+        print(e)
+        sys.exit(-1)
+    print("\n")
+    print("Results ({}).......".format(results_file))
+    print("============================================================================")
+    print_results(results_file, args.sort)
+    instrumentation.finish()
+    if failed:
+        sys.exit(-1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""This script generates synthetic TREC-CAR run files, qrels and RankLib feature and model files for benchmarking."""
+
+__author__ = "Shubham Chatterjee"
+__version__ = "10/18/26"
+
+from typing import List
+import argparse
+import os
+import sys
+import numpy as np
+
+# Number of lines formatted and written at a time.
+CHUNK_LINES: int = 1 << 16
+
+
+class Scale:
+    """The size of a synthetic data set."""
+
+    def __init__(self, queries: int = 100, depth: int = 100, runs: int = 10, id_length: int = 40,
+                 relevant: int = 10, features: int = 10, seed: int = 0):
+        self.queries = queries
+        self.depth = depth
+        self.runs = runs
+        self.id_length = id_length
+        self.relevant = relevant
+        self.features = features
+        self.seed = seed
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+
+def query_ids(num_queries: int) -> List[str]:
+    """TREC-CAR style query IDs: a page and a section."""
+    return ["enwiki:Synthetic%20page%20{}/Section%20{}".format(q // 4, q % 4) for q in range(num_queries)]
+
+
+def para_ids(rng: np.random.RandomState, num: int, length: int) -> np.ndarray:
+    """num distinct hex paragraph IDs of the given length (40 for TREC-CAR's SHA-1 IDs)."""
+    digits = np.array(list("0123456789abcdef"))
+    while True:
+        ids = np.array(["".join(row) for row in digits[rng.randint(0, 16, size=(num, length))].tolist()])
+        if len(np.unique(ids)) == num:
+            return ids
+
+
+def generate(out_dir: str, scale: Scale) -> dict:
+    """
+    Write <out_dir>/runs/run-NN.run, <out_dir>/qrels, <out_dir>/features.txt and <out_dir>/model.txt.
+    Every query has a pool of 2 x depth paragraphs, scale.relevant of which are relevant. Each run ranks depth
+    paragraphs of the pool by a noisy score that favours relevant ones, so that the runs differ in quality.
+    The same scale (including the seed) always gives the same files.
+    :return: the paths of the generated files
+    """
+    rng = np.random.RandomState(scale.seed)
+    run_dir = os.path.join(out_dir, "runs")
+    os.makedirs(run_dir, exist_ok=True)
+    queries = query_ids(scale.queries)
+    pool_size = 2 * scale.depth
+    docs = para_ids(rng, scale.queries * pool_size, scale.id_length).reshape(scale.queries, pool_size)
+    relevant = np.zeros((scale.queries, pool_size), dtype=bool)
+    relevant[:, :min(scale.relevant, pool_size)] = True
+    for q in range(scale.queries):
+        rng.shuffle(relevant[q])
+
+    qrel_file = os.path.join(out_dir, "qrels")
+    q_idx, d_idx = np.nonzero(relevant)
+    _write_lines(qrel_file, ["{} 0 {} 1\n".format(queries[q], docs[q, d]) for q, d in zip(q_idx.tolist(),
+                                                                                          d_idx.tolist())])
+
+    run_files = []
+    for r in range(scale.runs):
+        quality = rng.uniform(0.2, 2.0)
+        noisy = rng.standard_normal((scale.queries, pool_size)) + quality * relevant
+        top = np.argsort(-noisy, axis=1, kind="stable")[:, :scale.depth]
+        scores = np.take_along_axis(noisy, top, axis=1)
+        name = "run-{:02d}".format(r)
+        run_file = os.path.join(run_dir, name + ".run")
+        lines = ["{} Q0 {} {} {} {}\n".format(queries[q], docs[q, d], rank, score, name)
+                 for q in range(scale.queries)
+                 for rank, (d, score) in enumerate(zip(top[q].tolist(), scores[q].tolist()), start=1)]
+        _write_lines(run_file, lines)
+        run_files.append(run_file)
+
+    # A feature file with one line per (query, pool paragraph) and a Coordinate Ascent model for it
+    feature_file = os.path.join(out_dir, "features.txt")
+    values = rng.standard_normal((scale.queries * pool_size, scale.features)) + \
+        relevant.reshape(-1, 1) * rng.uniform(0, 1, scale.features)
+    labels = relevant.reshape(-1).astype(np.int8).tolist()
+    row_query = np.repeat(np.arange(scale.queries), pool_size).tolist()
+    fet_names = [str(f) + ":" for f in range(1, scale.features + 1)]
+    _write_lines(feature_file, ("{} qid:{} {} #{}_{}\n".format(
+        label, q + 1, " ".join(map(str.__add__, fet_names, map(str, row))), queries[q], doc)
+        for label, q, row, doc in zip(labels, row_query, values.tolist(), docs.reshape(-1).tolist())))
+    model_file = os.path.join(out_dir, "model.txt")
+    weights = rng.uniform(-1, 1, scale.features)
+    with open(model_file, 'w') as f:
+        f.write("## Coordinate Ascent\n")
+        f.write(" ".join("{}:{}".format(fid, w) for fid, w in enumerate(weights.tolist(), start=1)) + "\n")
+
+    return {"run_dir": run_dir, "run_files": run_files, "qrels": qrel_file, "features": feature_file,
+            "model": model_file}
+
+
+def _write_lines(file_path: str, lines):
+    with open(file_path, 'w') as f:
+        chunk: List[str] = []
+        for line in lines:
+            chunk.append(line)
+            if len(chunk) >= CHUNK_LINES:
+                f.write("".join(chunk))
+                chunk = []
+        f.write("".join(chunk))
+
+
+def main():
+    parser = argparse.ArgumentParser("Generate synthetic TREC-CAR runs, qrels and RankLib files.")
+    parser.add_argument("--out", help="Path to the directory to write the data to.", required=True)
+    parser.add_argument("--queries", help="Number of queries. Defaults to 100.", default=100)
+    parser.add_argument("--depth", help="Number of paragraphs every run retrieves per query. Defaults to 100.",
+                        default=100)
+    parser.add_argument("--runs", help="Number of run files. Defaults to 10.", default=10)
+    parser.add_argument("--id-length", help="Length of the paragraph IDs. Defaults to 40.", default=40)
+    parser.add_argument("--relevant", help="Number of relevant paragraphs per query. Defaults to 10.", default=10)
+    parser.add_argument("--features", help="Number of features of the feature file. Defaults to 10.", default=10)
+    parser.add_argument("--seed", help="Random seed. Defaults to 0.", default=0)
+    args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
+    scale = Scale(int(args.queries), int(args.depth), int(args.runs), int(args.id_length), int(args.relevant),
+                  int(args.features), int(args.seed))
+    paths = generate(args.out, scale)
+    print("Run files are written to: " + paths["run_dir"])
+    print("Qrels are written to: " + paths["qrels"])
+    print("Feature file is written to: " + paths["features"])
+    print("Model file is written to: " + paths["model"])
+
+
+if __name__ == '__main__':
+    main()